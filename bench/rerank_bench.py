@@ -0,0 +1,62 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+# rerank_results (hashed n-gram + MMR) 마이크로 벤치마크. 목표: 20개 over-fetch 기준 수 ms 이내.
+#
+#   python bench/rerank_bench.py --candidates 20 --top-k 5 --chars 1000
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lambda'))
+
+from rerank import rerank_results
+
+WORDS = ['전문투자자', '지정', '신청서', '서류', '해외주식', '매도', '원화', '결제', '심사', '금융투자상품',
+         '잔고', '소득', '자산', '확인서', '제출', '영업일', '계좌', '수수료', '환전', '위험']
+
+
+def make_results(candidates, chars, files, seed=1):
+    rng = random.Random(seed)
+    results = []
+    for i in range(candidates):
+        words = []
+        while sum(len(w) + 1 for w in words) < chars:
+            words.append(rng.choice(WORDS))
+        results.append({
+            'content': {'text': ' '.join(words)},
+            'location': {'type': 'S3', 's3Location': {'uri': f's3://bench-bucket/doc-{i % files}.pdf'}},
+            'score': round(0.9 - i * 0.01, 3)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-ranking micro-benchmark')
+    parser.add_argument('--candidates', type=int, default=20)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--chars', type=int, default=1000, help='characters per chunk')
+    parser.add_argument('--files', type=int, default=4, help='distinct source files')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    results = make_results(args.candidates, args.chars, args.files)
+    rerank_results(results, args.top_k)  # warm-up
+
+    timings = []
+    for _ in range(args.iterations):
+        started = time.perf_counter()
+        picked = rerank_results(results, args.top_k)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    print(f"candidates={args.candidates} top_k={args.top_k} chars={args.chars} iterations={args.iterations}")
+    print(f"mean={statistics.mean(timings):.3f}ms p50={timings[len(timings) // 2]:.3f}ms "
+          f"p95={timings[int(len(timings) * 0.95) - 1]:.3f}ms max={timings[-1]:.3f}ms")
+    print('picked sources:', [r['location']['s3Location']['uri'].split('/')[-1] for r in picked])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# cold start 측정. 새 파이썬 프로세스에서 핸들러 모듈 import 시간과 첫 핸들러 호출 시간을 잰다
+# (fake 클라이언트 사용, AWS 호출 없음). -X importtime 으로 무거운 import 를 모듈별로 보여준다.
+#
+#   python bench/startup_bench.py --target server --runs 5
+#   python bench/startup_bench.py --target stream --top 15 --json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(target):
+    # 새 프로세스 안에서 실행: import -> 첫 호출 -> 두 번째 호출(warm)
+    sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'tmp')]
+    os.environ.setdefault('api_endpoint', 'https://fake.execute-api.local/dev')
+    os.environ.setdefault('region', 'us-east-1')
+
+    started = time.perf_counter()
+    if target == 'server':
+        import server as handler_module
+    else:
+        import stream_lambda as handler_module
+    imported = time.perf_counter()
+
+    # 클라이언트는 첫 사용 때 만들어지므로 import 뒤에 fake 를 등록해도 된다
+    import client_pool
+    from fakes import FakeAgentRuntime, FakeBedrockRuntime, FakeGatewayClient
+    client_pool.register_client(FakeBedrockRuntime(chunks=4, token_ms=0, first_token_ms=0), 'bedrock-runtime', region_name='us-east-1')
+    client_pool.register_client(FakeAgentRuntime(latency_ms=0), 'bedrock-agent-runtime', region_name='us-east-1')
+    client_pool.register_client(FakeGatewayClient(latency_ms=0), 'apigatewaymanagementapi',
+                                endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
+    setup_ms = (time.perf_counter() - imported) * 1000
+
+    event = {
+        'requestContext': {'connectionId': 'startup-bench', 'routeKey': 'sendMessage'},
+        'body': json.dumps({'prompt': '해외주식 원화 결제 서비스 신청 방법', 'connectionId': 'startup-bench'})
+    }
+    sys.stdout = open(os.devnull, 'w')
+    call_started = time.perf_counter()
+    handler_module.lambda_handler(event, None)
+    first_call = time.perf_counter()
+    handler_module.lambda_handler(event, None)
+    second_call = time.perf_counter()
+    sys.stdout = sys.__stdout__
+
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'first_call_ms': (first_call - call_started) * 1000,
+        'warm_call_ms': (second_call - first_call) * 1000,
+        'time_to_first_response_ms': (first_call - started) * 1000 - setup_ms
+    }))
+
+
+def run_child(target, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += [os.path.abspath(__file__), '--child', '--target', target]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def import_breakdown(stderr, module, top):
+    # "import time: self [us] | cumulative | imported package" 에서 핸들러 모듈이 직접 import 한 모듈만 누적 시간순으로.
+    # 출력은 하위 모듈이 먼저 나오므로 핸들러 줄이 나올 때까지 한 단계 아래 줄을 모은다
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == module:
+                children.sort(key=lambda row: row[1], reverse=True)
+                return [(module, int(cumulative_us) / 1000.0)] + children[:top]
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), int(cumulative_us) / 1000.0))
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start benchmark for the stream / RAG handlers')
+    parser.add_argument('--target', choices=['stream', 'server'], default='server')
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes to measure')
+    parser.add_argument('--top', type=int, default=10, help='heaviest top-level imports to show')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.target)
+        return
+
+    # 첫 실행은 .pyc 생성 비용이 섞이므로 버린다
+    run_child(args.target)
+    runs = [run_child(args.target)[0] for _ in range(args.runs)]
+    _, stderr = run_child(args.target, importtime=True)
+
+    summary = {'target': args.target, 'runs': args.runs}
+    for key in ('import_ms', 'first_call_ms', 'warm_call_ms', 'time_to_first_response_ms'):
+        summary[key] = round(statistics.median(run[key] for run in runs), 1)
+    summary['imports'] = [{'module': name, 'cumulative_ms': round(ms, 1)} for name, ms in import_breakdown(stderr, 'server' if args.target == 'server' else 'stream_lambda', args.top)]
+
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+    for key, value in summary.items():
+        if key != 'imports':
+            print(f"{key:<28} {value}")
+    print('\nheaviest imports (cumulative ms)')
+    for row in summary['imports']:
+        print(f"  {row['module']:<40} {row['cumulative_ms']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+# 로컬 fake 클라이언트로 stream_lambda / tmp/server.py 의 스트리밍 경로를 측정한다 (AWS 호출 없음).
+#
+#   python bench/stream_bench.py --requests 50 --concurrency 4 --post-ms 20
+#   coalesce_max_bytes=0 python bench/stream_bench.py --target server --json
+#
+# 기능 플래그(coalesce_max_bytes, stream_pipeline ...)는 환경 변수로 그대로 넘긴다.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'tmp')]
+
+os.environ.setdefault('api_endpoint', 'https://fake.execute-api.local/dev')
+os.environ.setdefault('region', 'us-east-1')
+
+import client_pool
+from fakes import FakeAgentRuntime, FakeBedrockRuntime, FakeGatewayClient
+from frames import decode_frame
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def install_fakes(args):
+    bedrock = FakeBedrockRuntime(chunks=args.chunks, chunk_chars=args.chunk_chars,
+                                 token_ms=args.token_ms, first_token_ms=args.first_token_ms)
+    agent = FakeAgentRuntime(latency_ms=args.retrieve_ms)
+    gateway = FakeGatewayClient(latency_ms=args.post_ms, fail_on=args.fail_on, error_rate=args.error_rate, seed=1)
+
+    client_pool.register_client(bedrock, 'bedrock-runtime', region_name='us-east-1')
+    client_pool.register_client(agent, 'bedrock-agent-runtime', region_name='us-east-1')
+    client_pool.register_client(gateway, 'apigatewaymanagementapi',
+                                endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
+    return bedrock, agent, gateway
+
+
+def load_handler(target):
+    if target == 'server':
+        import server
+        return server.lambda_handler
+    import stream_lambda
+    return stream_lambda.lambda_handler
+
+
+def is_delta(data):
+    return decode_frame(data)['type'] == 'delta'
+
+
+def run_one(handler, gateway, prompt, protocol):
+    connection_id = str(uuid.uuid4())
+    body = {'prompt': prompt, 'connectionId': connection_id}
+    if protocol != 'v1':
+        body.update({'protocol': 2, 'encoding': 'compact' if protocol == 'compact' else 'json'})
+    event = {
+        'requestContext': {'connectionId': connection_id, 'routeKey': 'sendMessage'},
+        'body': json.dumps(body)
+    }
+
+    started = time.perf_counter()
+    handler(event, None)
+    finished = time.perf_counter()
+
+    posts = gateway.timeline(connection_id)
+    first = next((t for data, t in posts if is_delta(data)), None)
+    return {
+        'latency': finished - started,
+        'ttft': first - started if first is not None else None,
+        'posts': len(posts),
+        'bytes': sum(len(data.encode('utf-8')) for data, _ in posts)
+    }
+
+
+def run(args):
+    bedrock, agent, gateway = install_fakes(args)
+    handler = load_handler(args.target)
+    prompts = [args.prompt] * args.requests
+
+    results = []
+    lock = threading.Lock()
+
+    def worker(items):
+        for prompt in items:
+            result = run_one(handler, gateway, prompt, args.protocol)
+            with lock:
+                results.append(result)
+
+    # 핸들러 로그는 스레드 간에 섞이므로 실행 전체에서 한 번만 가린다
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    tracemalloc.start()
+    started = time.perf_counter()
+    with logs:
+        threads = [threading.Thread(target=worker, args=(prompts[i::args.concurrency],)) for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = [r['latency'] for r in results]
+    ttfts = [r['ttft'] for r in results if r['ttft'] is not None]
+    tokens = bedrock.emitted()
+
+    return {
+        'target': args.target,
+        'requests': len(results),
+        'concurrency': args.concurrency,
+        'bedrock_calls': len(bedrock.calls),
+        'retrieve_calls': agent.calls,
+        'wall_s': round(wall, 3),
+        'ttft_ms_p50': ms(percentile(ttfts, 50)),
+        'ttft_ms_p95': ms(percentile(ttfts, 95)),
+        'tokens_per_s': round(tokens / sum(latencies), 1) if latencies and sum(latencies) else None,
+        'posts_per_response': round(statistics.mean(r['posts'] for r in results), 1) if results else None,
+        'bytes_per_response': round(statistics.mean(r['bytes'] for r in results), 1) if results else None,
+        'latency_ms_p50': ms(percentile(latencies, 50)),
+        'latency_ms_p95': ms(percentile(latencies, 95)),
+        'latency_ms_p99': ms(percentile(latencies, 99)),
+        'peak_memory_kb': round(peak / 1024, 1)
+    }
+
+
+def ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local streaming benchmark with fake AWS clients')
+    parser.add_argument('--target', choices=['stream', 'server'], default='stream')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--prompt', default='전문투자자 지정 신청서에 필요한 서류를 알려줘.')
+    parser.add_argument('--chunks', type=int, default=64, help='model deltas per response')
+    parser.add_argument('--chunk-chars', type=int, default=4)
+    parser.add_argument('--token-ms', type=float, default=10)
+    parser.add_argument('--first-token-ms', type=float, default=200)
+    parser.add_argument('--retrieve-ms', type=float, default=100)
+    parser.add_argument('--post-ms', type=float, default=5)
+    parser.add_argument('--fail-on', type=int, default=None, help='gateway fails from this post on')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='random gateway post failure rate')
+    parser.add_argument('--protocol', choices=['v1', 'v2', 'compact'], default='v1', help='wire frame format')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--verbose', action='store_true', help='keep handler logs')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        for key, value in report.items():
+            print(f'{key:20} {value}')
+
+
+if __name__ == '__main__':
+    main()
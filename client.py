@@ -1,82 +1,282 @@
+import argparse
 import asyncio
-import websockets
+import csv
 import json
+import math
+import time
+import websockets
+
+from ws_client import WEBSOCKET_URL, CallbackSink, ServerBusy, StreamClient, StreamError, parse_frame, protocol_url
 
-async def connect():
-    # WebSocket API의 URL
-    websocket_url = 'wss://l776hl36a4.execute-api.us-east-1.amazonaws.com/dev'
 
-    async with websockets.connect(websocket_url) as websocket:
+async def connect(websocket_url=WEBSOCKET_URL, protocol=2, compact=False):
+    # 연결/재연결, 프레임 해석, requestId 별 분배는 ws_client.StreamClient 가 맡는다
+    async with StreamClient(websocket_url, protocol, compact) as client:
         print("WebSocket connection opened")
+        print(f"Connection ID: {client.connection_id}")
 
-        # 연결 후 connectionID를 서버로부터 받기 위해 초기 메시지를 전송
-        connect_message = {
-            'action': '$connect'
-        }
-        await websocket.send(json.dumps(connect_message))
-        
-        # 서버로부터 connectionID 수신
-        connection_response = await websocket.recv()
-        print(f"Connection response: {connection_response}")
-        connection_data = json.loads(connection_response)
-        connection_id = connection_data.get('connectionId')
-        print(f"Connection ID: {connection_id}")
-
-        # 실제 메시지 전송
-        message = {
-            'action': 'sendMessage',
-            'body': json.dumps({
-                'prompt': '다이어트에 도움이 되는 음식을 추천해줘.',
-                'connectionId': connection_id
-            })
+        try:
+            async for delta in client.stream('다이어트에 도움이 되는 음식을 추천해줘.'):
+                print(delta, end='', flush=True)
+        except StreamError as e:
+            print(f"Error: {e}")
+
+
+################################################################################################
+# 부하 테스트 모드
+#   python client.py --corpus prompts.txt --concurrency 20 --rate 5 --requests 200 --json out.json --csv out.csv
+################################################################################################
+
+class Histogram:
+    # ms 단위 값을 로그 스케일 버킷으로 집계 (percentile 은 원본 값으로 계산)
+    BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 60000]
+
+    def __init__(self, name):
+        self.name = name
+        self.values = []
+
+    def add(self, value_ms):
+        self.values.append(value_ms)
+
+    def percentile(self, p):
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100.0 * len(ordered)) - 1))
+        return ordered[index]
+
+    def buckets(self):
+        counts = [0] * (len(self.BOUNDS) + 1)
+        for value in self.values:
+            index = next((i for i, bound in enumerate(self.BOUNDS) if value <= bound), len(self.BOUNDS))
+            counts[index] += 1
+        labels = [f'<={bound}' for bound in self.BOUNDS] + [f'>{self.BOUNDS[-1]}']
+        return [(label, count) for label, count in zip(labels, counts) if count]
+
+    def summary(self):
+        return {
+            'count': len(self.values),
+            'min': round(min(self.values), 1) if self.values else None,
+            'p50': round(self.percentile(50), 1) if self.values else None,
+            'p90': round(self.percentile(90), 1) if self.values else None,
+            'p95': round(self.percentile(95), 1) if self.values else None,
+            'p99': round(self.percentile(99), 1) if self.values else None,
+            'max': round(max(self.values), 1) if self.values else None,
+            'buckets': dict(self.buckets())
         }
-        await websocket.send(json.dumps(message))
 
-        combined_response = ""  # 전체 응답 메시지를 저장할 변수
 
-        try:
+async def run_request(index, prompt, url):
+    record = {'index': index, 'prompt': prompt, 'ok': False, 'error': None,
+              'connect_ms': None, 'ttft_ms': None, 'total_ms': None, 'deltas': 0, 'gaps_ms': []}
+    started = time.perf_counter()
+    try:
+        async with websockets.connect(url) as websocket:
+            await websocket.send(json.dumps({'action': '$connect'}))
+            connection_data = json.loads(await websocket.recv())
+            connection_id = connection_data.get('connectionId')
+            connected = time.perf_counter()
+            record['connect_ms'] = (connected - started) * 1000
+
+            await websocket.send(json.dumps({
+                'action': 'sendMessage',
+                'body': json.dumps({'prompt': prompt, 'connectionId': connection_id})
+            }))
+            sent = time.perf_counter()
+
+            last = None
             async for message in websocket:
-                # 수신된 메시지가 JSON 형식인지 확인
-                try:
-                    data = json.loads(message)
-                    
-                    # 서버로부터 메시지를 수신했을 때 처리
-                    if 'message' in data:
-                        inner_message = data['message']
-                        
-                        # 'message' 내용이 JSON 형식인지 확인하고 다시 파싱
-                        try:
-                            inner_data = json.loads(inner_message)
-                            if inner_data.get('type') == 'done':
-                                # print('Received done signal, closing connection.')
-                                break
-                        except Exception:
-                            pass
-                        
-                        combined_response += inner_message
-                        print(inner_message, end='', flush=True)
-
-                except json.JSONDecodeError:
-                    combined_response += message
-                    print(message, end='', flush=True)
-
-        except websockets.ConnectionClosed:
-            print("WebSocket connection closed")
-        except Exception as e:
-            print(f"Error: {e}")
+                now = time.perf_counter()
+                frame = parse_frame(message)
+                if frame['type'] == 'error':
+                    record['error'] = str(frame['data'])
+                    break
+                if frame['type'] == 'busy':
+                    record['error'] = f"busy: {frame['data']}"
+                    break
+                if frame['type'] == 'done':
+                    record['ok'] = True
+                    break
+                if frame['type'] != 'delta':
+                    continue
+                if last is None:
+                    record['ttft_ms'] = (now - sent) * 1000
+                else:
+                    record['gaps_ms'].append((now - last) * 1000)
+                last = now
+                record['deltas'] += 1
 
+            await websocket.send(json.dumps({'action': 'disconnect', 'connectionId': connection_id}))
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+    record['total_ms'] = (time.perf_counter() - started) * 1000
+    return record
+
+
+async def run_shared_request(index, prompt, client):
+    # --reuse: 이미 열린 StreamClient 연결 하나에 요청을 얹는다 (connect_ms 없음)
+    record = {'index': index, 'prompt': prompt, 'ok': False, 'error': None,
+              'connect_ms': None, 'ttft_ms': None, 'total_ms': None, 'deltas': 0, 'gaps_ms': []}
+    started = time.perf_counter()
+    last = None
+
+    def on_delta(text):
+        nonlocal last
+        now = time.perf_counter()
+        if last is None:
+            record['ttft_ms'] = (now - started) * 1000
+        else:
+            record['gaps_ms'].append((now - last) * 1000)
+        last = now
+        record['deltas'] += 1
+
+    try:
+        async for _ in client.stream(prompt, sink=CallbackSink(on_delta)):
+            pass
+        record['ok'] = True
+    except ServerBusy as e:
+        record['error'] = f'busy: {e}'
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+    record['total_ms'] = (time.perf_counter() - started) * 1000
+    return record
+
+
+async def load_test(prompts, url, concurrency, rate, total, client=None):
+    # rate(req/s) 로 요청을 시작하고, 동시에 진행 중인 요청은 concurrency 개로 제한 (하나의 이벤트 루프).
+    # client 가 있으면 (--reuse) 모든 요청이 그 연결 하나를 같이 쓰고, 없으면 요청마다 새 연결을 연다
+    semaphore = asyncio.Semaphore(concurrency)
+    records = []
+
+    async def bounded(index, prompt):
+        async with semaphore:
+            if client is not None:
+                records.append(await run_shared_request(index, prompt, client))
+            else:
+                records.append(await run_request(index, prompt, url))
+
+    started = time.perf_counter()
+    tasks = []
+    for index in range(total):
+        if rate:
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(bounded(index, prompts[index % len(prompts)])))
+    await asyncio.gather(*tasks)
+    return records, time.perf_counter() - started
+
+
+async def batch_test(prompts, url, protocol, compact, total, batch_size, mode):
+    # --batch: 질문을 batch_size 개씩 sendBatch 로 보낸다 (서버가 한 번의 호출에서 동시에 처리, 연결 하나)
+    records = []
+    started = time.perf_counter()
+    async with StreamClient(url, protocol, compact) as client:
+        for offset in range(0, total, batch_size):
+            indexes = list(range(offset, min(total, offset + batch_size)))
+            items = [{'id': str(index), 'prompt': prompts[index % len(prompts)]} for index in indexes]
+            try:
+                summary = await client.batch(items, mode=mode)
+            except StreamError as e:
+                records += [{'index': index, 'prompt': item['prompt'], 'ok': False, 'error': str(e), 'connect_ms': None,
+                             'ttft_ms': None, 'total_ms': None, 'deltas': 0, 'gaps_ms': []} for index, item in zip(indexes, items)]
+                continue
+            for result in summary['results']:
+                index = int(result['id'])
+                records.append({'index': index, 'prompt': prompts[index % len(prompts)], 'ok': result['ok'],
+                                'error': result['error'], 'connect_ms': None, 'ttft_ms': result.get('ttftMs'),
+                                'total_ms': result.get('totalMs'), 'deltas': 0, 'gaps_ms': []})
+    return records, time.perf_counter() - started
+
+
+def summarize(records, wall):
+    histograms = {name: Histogram(name) for name in ['connect_ms', 'ttft_ms', 'gap_ms', 'total_ms']}
+    for record in records:
+        for name in ['connect_ms', 'ttft_ms', 'total_ms']:
+            if record[name] is not None:
+                histograms[name].add(record[name])
+        for gap in record['gaps_ms']:
+            histograms['gap_ms'].add(gap)
+
+    ok = sum(1 for record in records if record['ok'])
+    busy = sum(1 for record in records if (record['error'] or '').startswith('busy'))
+    return {
+        'requests': len(records),
+        'ok': ok,
+        'errors': len(records) - ok - busy,
+        'busy': busy,
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(len(records) / wall, 2) if wall else None,
+        'histograms': {name: histogram.summary() for name, histogram in histograms.items()}
+    }
+
+
+def print_summary(summary):
+    print(f"requests={summary['requests']} ok={summary['ok']} errors={summary['errors']} busy={summary['busy']} "
+          f"wall={summary['wall_s']}s throughput={summary['throughput_rps']} req/s")
+    print(f"{'metric':12}{'count':>8}{'min':>10}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, h in summary['histograms'].items():
+        row = [h[k] if h[k] is not None else '-' for k in ['min', 'p50', 'p90', 'p95', 'p99', 'max']]
+        print(f"{name:12}{h['count']:>8}" + ''.join(f'{str(v):>10}' for v in row))
+
+
+def write_csv(path, records):
+    fields = ['index', 'ok', 'error', 'connect_ms', 'ttft_ms', 'total_ms', 'deltas', 'max_gap_ms', 'prompt']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for record in sorted(records, key=lambda r: r['index']):
+            row = {k: record.get(k) for k in fields}
+            row['max_gap_ms'] = max(record['gaps_ms']) if record['gaps_ms'] else None
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebSocket streaming client / load generator')
+    parser.add_argument('--url', default=WEBSOCKET_URL)
+    parser.add_argument('--protocol', type=int, choices=[1, 2], default=2, help='wire frame version')
+    parser.add_argument('--compact', action='store_true', help='compact v2 frame encoding')
+    parser.add_argument('--corpus', help='prompt file, one prompt per line (enables load mode)')
+    parser.add_argument('--concurrency', type=int, default=10, help='max requests in flight')
+    parser.add_argument('--reuse', action='store_true', help='multiplex all requests over one persistent connection (v2 only)')
+    parser.add_argument('--rate', type=float, default=0, help='target request starts per second (0 = as fast as possible)')
+    parser.add_argument('--requests', type=int, help='total requests (default: number of prompts)')
+    parser.add_argument('--batch', type=int, default=0, help='send prompts with sendBatch, this many per batch (v2 only)')
+    parser.add_argument('--batch-mode', choices=['aggregate', 'stream'], default='aggregate')
+    parser.add_argument('--json', help='write summary and per-request records as JSON')
+    parser.add_argument('--csv', help='write per-request records as CSV')
+    args = parser.parse_args()
+    url = protocol_url(args.url, args.protocol, args.compact)
+
+    if not args.corpus:
+        # WebSocket 연결 시작
+        asyncio.run(connect(args.url, args.protocol, args.compact))
+        return
+    if (args.reuse or args.batch) and args.protocol < 2:
+        parser.error('--reuse / --batch need --protocol 2 (frames must carry the request id)')
+
+    with open(args.corpus, encoding='utf-8') as f:
+        prompts = [line.strip() for line in f if line.strip()]
+    total = args.requests or len(prompts)
+
+    if args.batch:
+        records, wall = asyncio.run(batch_test(prompts, args.url, args.protocol, args.compact, total, args.batch, args.batch_mode))
+    elif args.reuse:
+        async def reuse_test():
+            async with StreamClient(args.url, args.protocol, args.compact) as client:
+                return await load_test(prompts, url, args.concurrency, args.rate, total, client)
+        records, wall = asyncio.run(reuse_test())
+    else:
+        records, wall = asyncio.run(load_test(prompts, url, args.concurrency, args.rate, total))
+    summary = summarize(records, wall)
+    print_summary(summary)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'requests': sorted(records, key=lambda r: r['index'])}, f, ensure_ascii=False, indent=2)
+    if args.csv:
+        write_csv(args.csv, records)
 
-        # 최종 합친 응답 메시지 출력
-        # print("\n\n############################################")
-        # print('combined_response: ', combined_response)
-        
-        # disconnect 메시지 전송
-        disconnect_message = {
-            'action': 'disconnect',
-            'connectionId': connection_id
-        }
-        await websocket.send(json.dumps(disconnect_message))
-        # print("Sent disconnect message")
 
-# WebSocket 연결 시작
-asyncio.get_event_loop().run_until_complete(connect())
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+import os
+import time
+
+from context_packer import estimate_tokens
+from state_store import get_store
+
+# 요청 수 / 토큰 수 제한 (admission_control=1 일 때 사용).
+# Bedrock 호출 전에 connectionId 별 버킷과 전체 버킷에서 토큰을 가져간다. 버킷마다 두 가지를 같이 센다.
+#   - 요청 수: 초당 rps 개씩 채워지고 burst 개까지 쌓인다
+#   - 모델 토큰: 분당 tpm 개씩 채워진다 (예상 입력 토큰 + max_tokens 를 미리 가져가고, 끝나면 쓰지 않은 만큼 돌려준다)
+# 부족하면 채워질 때까지 admission_max_wait_ms 안에서 기다리고 (동시에 기다리는 요청은 admission_max_queue 개까지),
+# 그래도 안 되면 스트림을 시작하지 않고 busy 프레임 ({"retryAfterMs": n, "scope": ...}) 을 보낸다.
+# 기다리는 순서는 보장하지 않는다 (FIFO 큐가 아니라 대기 시간이 제한된 limiter). 기다리는 요청은 각자 필요한 만큼
+# 쉬었다가 다시 가져가 보므로, 늦게 온 작은 요청이 먼저 들어갈 수 있다. 오래 기다린 요청도 max_wait 를 넘지 않는다.
+#
+# 저장소 키 (state_store, replace 로 갱신)
+#   bucket:conn:<connectionId>  {"requests": n, "tokens": n, "at": timestamp}
+#   bucket:global
+#   admission:waiting           기다리는 요청 id 집합
+
+BUCKET_TTL = 2 * 60 * 60
+WAITING_KEY = 'admission:waiting'
+
+
+def bucket_key(scope):
+    return f'bucket:{scope}'
+
+
+class TokenBucket:
+    def __init__(self, scope, rps, burst, tpm, store=None):
+        self.key = bucket_key(scope)
+        self.scope = scope
+        self.rps = float(rps)
+        self.burst = float(burst)
+        self.tpm = float(tpm)
+        self._store = store
+
+    @property
+    def store(self):
+        return self._store or get_store()
+
+    def refill(self, state, now):
+        if state is None:
+            return {'requests': self.burst, 'tokens': self.tpm, 'at': now}
+        elapsed = max(0.0, now - state['at'])
+        return {
+            'requests': min(self.burst, state['requests'] + elapsed * self.rps),
+            'tokens': min(self.tpm, state['tokens'] + elapsed * self.tpm / 60.0),
+            'at': now
+        }
+
+    def wait_time(self, state, tokens, requests=1):
+        # requests 요청 + tokens 를 가져갈 수 있을 때까지 남은 초
+        waits = [0.0]
+        if state['requests'] < requests:
+            waits.append((requests - state['requests']) / self.rps if self.rps else float('inf'))
+        if state['tokens'] < tokens:
+            waits.append((tokens - state['tokens']) * 60.0 / self.tpm if self.tpm else float('inf'))
+        return max(waits)
+
+    def take(self, tokens, now=None, requests=1):
+        # 가져갔으면 0, 아니면 기다려야 하는 초 (버킷은 그대로)
+        tokens = min(float(tokens), self.tpm)  # 한 번에 버킷보다 큰 요청도 언젠가는 들어갈 수 있도록
+        requests = min(float(requests), self.burst)
+        for _ in range(8):
+            current = self.store.get(self.key)
+            state = self.refill(current, now or time.time())
+            wait = self.wait_time(state, tokens, requests)
+            if wait > 0:
+                return wait
+            state['requests'] -= requests
+            state['tokens'] -= tokens
+            if self.store.replace(self.key, current, state, ttl=BUCKET_TTL):
+                return 0.0
+        # 다른 요청과 계속 겹치면 잠깐 뒤에 다시
+        return 0.01
+
+    def give_back(self, requests=0, tokens=0):
+        # tokens 가 음수면 더 가져간다 (미리 잡은 것보다 많이 쓴 경우: 그만큼 다음 요청이 기다린다)
+        for _ in range(8):
+            current = self.store.get(self.key)
+            if current is None:
+                return
+            state = self.refill(current, time.time())
+            state['requests'] = min(self.burst, state['requests'] + requests)
+            state['tokens'] = min(self.tpm, state['tokens'] + tokens)
+            if self.store.replace(self.key, current, state, ttl=BUCKET_TTL):
+                return
+
+
+class Ticket:
+    def __init__(self, connection_id, tokens, per_connection=True, use_global=True, requests=1):
+        self.connection_id = connection_id
+        self.tokens = tokens
+        self.per_connection = per_connection
+        self.use_global = use_global
+        self.requests = requests
+        self.admitted = False
+        self.scope = None  # 거절된 버킷 (connection / global / queue)
+        self.retry_after_ms = 0
+        self.waited_ms = 0.0
+
+    def busy_data(self):
+        return {'retryAfterMs': self.retry_after_ms, 'scope': self.scope}
+
+
+class AdmissionControl:
+    def __init__(self, enabled=None, store=None, conn_rps=None, conn_burst=None, conn_tpm=None,
+                 global_rps=None, global_burst=None, global_tpm=None, max_wait_ms=None, max_queue=None):
+        if enabled is None:
+            enabled = os.environ.get('admission_control') == '1'
+        if conn_rps is None:
+            conn_rps = os.environ.get('admission_conn_rps', 0.5)
+        if conn_burst is None:
+            conn_burst = os.environ.get('admission_conn_burst', 3)
+        if conn_tpm is None:
+            conn_tpm = os.environ.get('admission_conn_tpm', 20000)
+        if global_rps is None:
+            global_rps = os.environ.get('admission_global_rps', 10)
+        if global_burst is None:
+            global_burst = os.environ.get('admission_global_burst', 20)
+        if global_tpm is None:
+            global_tpm = os.environ.get('admission_global_tpm', 200000)
+        if max_wait_ms is None:
+            max_wait_ms = os.environ.get('admission_max_wait_ms', 3000)
+        if max_queue is None:
+            max_queue = os.environ.get('admission_max_queue', 20)
+
+        self.enabled = enabled
+        self._store = store
+        self.conn_limits = (float(conn_rps), float(conn_burst), float(conn_tpm))
+        self.global_bucket = TokenBucket('global', float(global_rps), float(global_burst), float(global_tpm), store)
+        self.max_wait = float(max_wait_ms) / 1000.0
+        self.max_queue = int(max_queue)
+
+    @property
+    def store(self):
+        return self._store or get_store()
+
+    def connection_bucket(self, connection_id):
+        return TokenBucket(f'conn:{connection_id}', *self.conn_limits, store=self._store)
+
+    def estimate(self, prompt_text, max_tokens, extra_tokens=0):
+        # 예상 입력 토큰 + 출력 최대치 (Bedrock 도 max_tokens 기준으로 분당 토큰 한도를 잡는다)
+        return estimate_tokens(prompt_text) + int(extra_tokens) + int(max_tokens)
+
+    def admit(self, connection_id, tokens, trace=None, per_connection=True, use_global=True, requests=1):
+        # sendBatch 는 배치 전체를 연결 버킷에서 한 번에 가져가고 (use_global=False, requests=항목 수),
+        # 항목마다 전체 버킷에서 가져간다 (per_connection=False)
+        ticket = Ticket(connection_id, tokens, per_connection, use_global, requests)
+        if not self.enabled:
+            ticket.admitted = True
+            return ticket
+
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        queued = False
+        wait_id = f'{time.time():.3f}:{connection_id}:{id(ticket)}'
+        try:
+            while True:
+                wait, scope = self.try_take(connection_id, tokens, per_connection, use_global, requests)
+                if wait == 0:
+                    ticket.admitted = True
+                    return ticket
+
+                remaining = deadline - time.monotonic()
+                if wait > remaining:
+                    ticket.scope = scope
+                    ticket.retry_after_ms = int(wait * 1000)
+                    return ticket
+                if not queued:
+                    if self.waiting() >= self.max_queue:
+                        ticket.scope = 'queue'
+                        ticket.retry_after_ms = int(wait * 1000)
+                        return ticket
+                    self.store.add_member(WAITING_KEY, wait_id, ttl=BUCKET_TTL)
+                    queued = True
+                time.sleep(wait)
+        finally:
+            if queued:
+                self.store.remove_member(WAITING_KEY, wait_id)
+            ticket.waited_ms = (time.monotonic() - started) * 1000
+            if trace is not None and not ticket.admitted:
+                trace.count('admission_rejected')
+                trace.warning('Admission rejected', connectionId=connection_id, scope=ticket.scope,
+                              retryAfterMs=ticket.retry_after_ms)
+
+    def waiting(self):
+        # 기다리는 요청 수. 기록을 지우지 못하고 끝난 요청 (Lambda 타임아웃 등) 은 시작 시각으로 걸러낸다
+        oldest = time.time() - self.max_wait - 1
+        return sum(1 for wait_id in self.store.members(WAITING_KEY) if float(wait_id.split(':', 1)[0]) > oldest)
+
+    def try_take(self, connection_id, tokens, per_connection=True, use_global=True, requests=1):
+        # 연결 버킷 -> 전체 버킷 순서. 전체 버킷에서 막히면 연결 버킷에서 가져간 것을 돌려준다
+        connection_bucket = self.connection_bucket(connection_id) if per_connection else None
+        if connection_bucket:
+            wait = connection_bucket.take(tokens, requests=requests)
+            if wait > 0:
+                return wait, 'connection'
+        if use_global:
+            wait = self.global_bucket.take(tokens, requests=requests)
+            if wait > 0:
+                if connection_bucket:
+                    connection_bucket.give_back(requests=min(requests, connection_bucket.burst),
+                                                tokens=min(tokens, connection_bucket.tpm))
+                return wait, 'global'
+        return 0.0, None
+
+    def settle(self, ticket, answer, max_tokens, unused_input=0):
+        # 끝난 뒤 max_tokens 중 실제로 생성하지 않은 만큼 돌려준다.
+        # unused_input: 미리 잡은 입력 토큰 중 쓰지 않은 만큼 (RAG context 예산 - 실제 context 등)
+        if not self.enabled or not ticket.admitted:
+            return
+        unused = int(max_tokens) - estimate_tokens(answer or '') + max(0, int(unused_input))
+        if unused > 0:
+            if ticket.per_connection:
+                self.connection_bucket(ticket.connection_id).give_back(tokens=unused)
+            if ticket.use_global:
+                self.global_bucket.give_back(tokens=unused)
+
+    def settle_used(self, ticket, used_tokens):
+        # 미리 가져간 토큰을 실제 사용량에 맞춘다 (sendBatch 전체 ticket: 항목별 사용량의 합).
+        # 버킷보다 큰 요청은 버킷 크기만큼만 가져갔으므로 그 기준으로 돌려주거나 더 가져간다
+        if not self.enabled or not ticket.admitted:
+            return
+        buckets = []
+        if ticket.per_connection:
+            buckets.append(self.connection_bucket(ticket.connection_id))
+        if ticket.use_global:
+            buckets.append(self.global_bucket)
+        for bucket in buckets:
+            bucket.give_back(tokens=min(float(ticket.tokens), bucket.tpm) - used_tokens)
+
+    def clear(self, connection_id):
+        if self.enabled:
+            self.store.delete(bucket_key(f'conn:{connection_id}'))
@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from bedrock_stream import InvokeBedrock, post_to_connection, router
+from client_pool import get_client
+from context_packer import estimate_tokens
+from frames import FrameCodec, decode_frame, negotiate
+from instrumentation import NOOP_TRACE
+
+# sendBatch: 한 번의 호출로 여러 질문을 batch_workers 개씩 동시에 처리한다.
+#   {"action": "sendBatch", "prompts": [{"id": "q1", "prompt": "..."}, "질문 문자열", ...], "mode": "stream" | "aggregate"}
+# id 가 없으면 <batch requestId>-<index>.
+#   - stream    : 항목마다 sendMessage 와 같은 프레임 (delta / sources / done / error / busy) 을 항목 id 로 보낸다.
+#                 여러 항목의 프레임이 섞여 오므로 v2 프레임 (id) 이 필요하다. v1 연결은 aggregate 로 처리한다.
+#   - aggregate : 항목이 끝날 때마다 done 프레임 하나 (id 는 항목 id)
+#                 {"id", "ok", "text", "error", "queuedMs", "ttftMs", "totalMs", "chars"}
+# 마지막에 batch requestId 로 done 프레임 {"batch": {"items", "ok", "failed", "totalMs", "results": [...]}} 을 보낸다.
+# results 는 항목별 결과 (aggregate 의 text 제외). 한 항목이 실패해도 나머지는 계속 처리한다.
+# Lambda 남은 시간이 batch_reserve_ms 보다 적으면 아직 시작하지 않은 항목은 건너뛴다 (error: skipped).
+# admission_control=1 이면 배치 전체를 연결 버킷에서 한 번에 가져가고 (요청 수 = 항목 수, 토큰 = 항목 예상 토큰 합),
+# 항목마다 전체 버킷에서 가져간다. 끝나면 연결 버킷을 실제 사용량에 맞춘다.
+
+BATCH_MODES = ['stream', 'aggregate']
+
+_batch_pool = None
+_batch_lock = threading.Lock()
+
+
+def batch_pool():
+    # warm invocation 사이에 재사용 (retrieval fan-out 풀과는 따로 둔다: 항목 안에서 fan-out 풀을 기다리므로)
+    global _batch_pool
+    with _batch_lock:
+        if _batch_pool is None:
+            _batch_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('batch_workers', 4)),
+                                             thread_name_prefix='batch')
+        return _batch_pool
+
+
+def send_batch(connection_id, body, trace, context, admission, prepare=None, invoker_class=InvokeBedrock, extra_tokens=0):
+    # sendBatch 핸들러. prepare(invoker, item, trace) -> (Bedrock 에 보낼 프롬프트, 쓰지 않은 extra_tokens).
+    # 없으면 질문을 그대로 보낸다. extra_tokens 는 항목마다 미리 잡는 입력 토큰 (RAG context 예산)
+    codec = negotiate(connection_id, body)  # requestId 는 batch id (마지막 요약 프레임)
+    try:
+        items, mode = parse_batch(body, codec.request_id, codec)
+    except ValueError as e:
+        trace.warning('Invalid batch', error=str(e))
+        post_to_connection(connection_id, codec.encode('error', str(e)))
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': str(e)})
+        }
+
+    plans = [router.plan(item['prompt'], extra_tokens) for item in items]
+    estimates = [admission.estimate(item['prompt'], plan.max_tokens, extra_tokens) for item, plan in zip(items, plans)]
+    with trace.stage('admission'):
+        ticket = admission.admit(connection_id, sum(estimates), trace, use_global=False, requests=len(items))
+    if not ticket.admitted:
+        post_to_connection(connection_id, codec.encode('busy', ticket.busy_data()))
+        return {
+            'statusCode': 429,
+            'body': json.dumps({'error': 'Too many requests', 'retryAfterMs': ticket.retry_after_ms})
+        }
+
+    used = []
+    by_id = {item['id']: (plan, estimate) for item, plan, estimate in zip(items, plans, estimates)}
+
+    def run_item(item, item_codec, item_conn):
+        plan, estimate = by_id[item['id']]
+        invoker = invoker_class(connection_id, conn=item_conn, codec=item_codec, trace=trace)
+        return answer_batch_item(invoker, item, plan, estimate, admission, prepare, extra_tokens, used, trace)
+
+    conn = get_client('apigatewaymanagementapi', endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
+    try:
+        summary = run_batch(items, run_item, connection_id, codec, conn, mode, trace,
+                            getattr(context, 'get_remaining_time_in_millis', None))
+    finally:
+        admission.settle_used(ticket, sum(used))
+    trace.info('Batch finished', items=summary['items'], failed=summary['failed'], totalMs=summary['totalMs'])
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'message': 'Batch finished', 'ok': summary['ok'], 'failed': summary['failed']})
+    }
+
+
+def answer_batch_item(invoker, item, plan, estimate, admission, prepare, extra_tokens, used, trace):
+    # 배치 항목 하나. sendMessage 와 같은 생성 경로 (대화 기록 / single-flight 없음, admission 은 전체 버킷만).
+    # 실제로 쓴 토큰 (입력 + 답변) 을 used 에 더한다
+    ticket = admission.admit(invoker.params["ConnectionId"], estimate, trace, per_connection=False)
+    if not ticket.admitted:
+        invoker.reject(ticket)
+        return None
+
+    answer = None
+    unused_input = extra_tokens
+    try:
+        request = item['prompt']
+        if prepare:
+            request, unused_input = prepare(invoker, item, trace)
+        answer = invoker.call_bedrock(request, None, plan)
+    finally:
+        admission.settle(ticket, answer, plan.max_tokens, unused_input)
+        used.append(estimate - plan.max_tokens - max(0, unused_input) + estimate_tokens(answer or ''))
+    return answer
+
+
+def parse_batch(body, batch_id, codec):
+    # (items, mode). 형식이 잘못되면 ValueError
+    prompts = body.get('prompts')
+    if not isinstance(prompts, list) or not prompts:
+        raise ValueError('prompts must be a non-empty list')
+    max_items = int(os.environ.get('batch_max_items', 200))
+    if len(prompts) > max_items:
+        raise ValueError(f'too many prompts: {len(prompts)} > {max_items}')
+
+    items = []
+    seen = set()
+    for index, entry in enumerate(prompts):
+        if isinstance(entry, str):
+            entry = {'prompt': entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('prompt'), str) or not entry['prompt'].strip():
+            raise ValueError(f'prompt {index} has no text')
+        item_id = str(entry.get('id') or f'{batch_id}-{index}')
+        if item_id in seen:
+            raise ValueError(f'duplicate prompt id: {item_id}')
+        seen.add(item_id)
+        items.append({'id': item_id, 'prompt': entry['prompt'], 'queryVariants': entry.get('queryVariants')})
+
+    mode = body.get('mode', 'stream')
+    if mode not in BATCH_MODES:
+        raise ValueError(f'unknown batch mode: {mode}')
+    if codec.version < 2:
+        mode = 'aggregate'
+    return items, mode
+
+
+class ItemConnection:
+    # 항목의 InvokeBedrock 에 conn 으로 넘기는 post_to_connection 대체.
+    # 보내는 프레임에서 첫 델타 시각과 오류를 기록하고, stream 모드일 때만 실제 연결로 보낸다.
+    def __init__(self, conn, forward):
+        self.conn = conn
+        self.forward = forward
+        self.frames = 0
+        self.first_delta = None
+        self.error = None
+        self.busy = None
+
+    def post_to_connection(self, ConnectionId, Data):
+        frame = decode_frame(Data)
+        self.frames += 1
+        if frame['type'] == 'delta' and self.first_delta is None:
+            self.first_delta = time.perf_counter()
+        elif frame['type'] == 'error':
+            self.error = str(frame['data'])
+        elif frame['type'] == 'busy':
+            self.busy = frame['data']
+        if self.forward:
+            return self.conn.post_to_connection(ConnectionId=ConnectionId, Data=Data)
+        return {}
+
+
+def run_batch(items, run_item, connection_id, codec, conn, mode='stream', trace=NOOP_TRACE, remaining_ms=None):
+    # run_item(item, item_codec, item_conn) -> 답변 텍스트. 항목별 결과를 모은 summary 를 반환
+    started = time.perf_counter()
+    reserve_ms = int(os.environ.get('batch_reserve_ms', 30000))
+    gone = threading.Event()
+
+    def post(data):
+        try:
+            conn.post_to_connection(ConnectionId=connection_id, Data=data)
+        except ClientError as e:
+            trace.error('Failed to send message to client', error=str(e))
+            if e.response.get('Error', {}).get('Code') == 'GoneException':
+                gone.set()
+
+    def work(item):
+        item_started = time.perf_counter()
+        result = {'id': item['id'], 'ok': False, 'error': None,
+                  'queuedMs': round((item_started - started) * 1000, 1), 'ttftMs': None, 'totalMs': None, 'chars': 0}
+        item_codec = FrameCodec(codec.version, codec.compact, item['id'])
+        item_conn = ItemConnection(conn, mode == 'stream')
+        answer = None
+        if gone.is_set():
+            result['error'] = 'skipped: connection gone'
+        elif remaining_ms and remaining_ms() < reserve_ms:
+            result['error'] = 'skipped: invocation time limit'
+        else:
+            try:
+                answer = run_item(item, item_codec, item_conn)
+                if item_conn.busy is not None:
+                    result['error'] = 'busy'
+                    result['retryAfterMs'] = item_conn.busy.get('retryAfterMs')
+                elif item_conn.error is not None:
+                    result['error'] = item_conn.error
+                else:
+                    result['ok'] = True
+            except Exception as e:
+                result['error'] = f'{type(e).__name__}: {e}'
+                trace.error('Batch item failed', id=item['id'], error=result['error'])
+                if mode == 'stream':
+                    post(item_codec.encode('error', result['error'], item_conn.frames))
+        if item_conn.first_delta is not None:
+            result['ttftMs'] = round((item_conn.first_delta - item_started) * 1000, 1)
+        result['totalMs'] = round((time.perf_counter() - item_started) * 1000, 1)
+        result['chars'] = len(answer or '')
+        if mode == 'aggregate' and not gone.is_set():
+            post(item_codec.encode('done', dict(result, text=answer or ''), 0))
+        return result
+
+    futures = [batch_pool().submit(work, item) for item in items]
+    results = []
+    for item, future in zip(items, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append({'id': item['id'], 'ok': False, 'error': f'{type(e).__name__}: {e}'})
+
+    ok = sum(1 for result in results if result['ok'])
+    summary = {
+        'items': len(results),
+        'ok': ok,
+        'failed': len(results) - ok,
+        'totalMs': round((time.perf_counter() - started) * 1000, 1),
+        'results': results
+    }
+    trace.count('batch_items', len(results))
+    trace.count('batch_failed', len(results) - ok)
+    if not gone.is_set():
+        post(codec.encode('done', {'batch': summary}, 0))
+    return summary
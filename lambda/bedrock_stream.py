@@ -0,0 +1,330 @@
+import json
+import os
+import threading
+import time
+from botocore.exceptions import BotoCoreError, ClientError
+from coalescer import DeltaCoalescer
+from pipeline import DeliveryPipeline
+from cancellation import CancelWatcher
+from client_pool import get_client
+from completion_cache import CompletionCache
+from frames import FrameCodec, codec_from_settings, negotiate
+import replay
+from instrumentation import NOOP_TRACE
+from conversation import build_messages, history_digest, history_tokens
+from routing import ModelRouter, route_name
+
+# stream_lambda.py 와 tmp/server.py 가 같이 쓰는 Bedrock 스트리밍 / 전송 경로.
+# 핸들러마다 다른 부분 (RAG 의 출처 프레임 등) 은 InvokeBedrock 을 상속해서 바꾼다.
+
+completion_cache = CompletionCache()
+router = ModelRouter()
+
+
+def post_to_connection(connection_id, data):
+    conn = get_client('apigatewaymanagementapi', endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
+    conn.post_to_connection(ConnectionId=connection_id, Data=data)
+
+
+def resume(connection_id, body, trace):
+    codec = negotiate(connection_id, body)  # body 의 requestId 로 원래 요청의 id 를 그대로 쓴다
+    request_id = body['requestId']
+    try:
+        sent = replay.resume_stream(request_id, int(body.get('lastSeq', -1)), connection_id, codec,
+                                    trace.timed_post(post_to_connection), resume_key=body.get('resumeKey'))
+    except replay.ResumeRejected as e:
+        # 이어 받을 수 없음: 클라이언트는 처음부터 다시 요청한다
+        trace.warning('Resume rejected', requestId=request_id, reason=e.reason, error=str(e))
+        post_to_connection(connection_id, codec.encode('error', f'Resume rejected ({e.reason}): {e}'))
+        return {
+            'statusCode': 403 if e.reason == 'owner' else 409,
+            'body': json.dumps({'error': 'Resume rejected', 'reason': e.reason})
+        }
+    if sent is None:
+        trace.warning('Unknown or expired requestId', requestId=request_id)
+        post_to_connection(connection_id, codec.encode('error', 'Unknown or expired requestId'))
+        return {
+            'statusCode': 404,
+            'body': json.dumps({'error': 'Unknown or expired requestId'})
+        }
+    trace.info('Resumed stream', requestId=request_id, frames=sent)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'message': 'Resumed'})
+    }
+
+
+class InvokeBedrock:
+    def __init__(self, connection_id, client=None, conn=None, flight=None, codec=None, trace=None, resume_key=None):
+        # client / conn 은 로컬 테스트에서 fake 클라이언트를 주입할 때 사용
+        # flight 가 있으면 (single-flight leader) 모든 구독자에게 전송
+        # codec 은 프레임 형식 (기본: 기존 v1 형식)
+        # trace 는 요청 단위 로그/타이머 (instrumentation.py)
+        # resume_key 는 다른 연결에서 resume 할 때 같은 클라이언트인지 확인하는 값 (sendMessage 의 resumeKey)
+        self.client = client  # 없으면 router 가 route 의 리전별 공유 클라이언트를 쓴다
+        self.conn = conn or get_client('apigatewaymanagementapi', endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
+        self.params = {
+            "ConnectionId": connection_id,
+            "Data": ""
+        }
+        self.gone = False  # GoneException 을 받으면 True (single-flight 에서는 구독자가 모두 끊기면)
+        self.flight = flight
+        self.codec = codec or FrameCodec()
+        self.seq = 0
+        self.seq_lock = threading.Lock()
+        self.trace = trace or NOOP_TRACE
+        # stream_replay=1 이면 보낸 프레임을 버퍼에 남겨 다른 연결에서 resume 할 수 있게 한다 (single-flight 제외)
+        self.replay = None
+        self.detached = False  # 연결이 끊긴 뒤 resume 을 기다리며 버퍼에만 쌓는 중
+        self.detached_at = None
+        self.watcher = None
+        self.pipeline = None
+        self.coalescer = None
+        if replay.is_enabled() and not flight:
+            self.replay = replay.ReplayRecorder(self.codec.request_id, connection_id, resume_key=resume_key)
+
+    def call_bedrock(self, request, history=None, plan=None):
+        # history 는 ConversationStore.history() (이전 대화). 생성한 답변 텍스트를 반환한다
+        # plan 은 router.plan() (모델 / max_tokens 선택). 없으면 프롬프트 크기로 정한다
+        plan = plan or router.plan(request, history_tokens(history))
+        system, messages = build_messages(history, request)
+        native_request = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": plan.max_tokens,
+            "temperature": 0.5,
+            "messages": messages
+        }
+        if system:
+            native_request["system"] = system
+
+        request_payload = json.dumps(native_request)
+
+        # completion_cache=1 이면 같은 프롬프트의 기록된 응답을 재생한다
+        cache_key = None
+        if completion_cache.enabled:
+            cache_key = completion_cache.make_key(plan.model_id, [history_digest(history), request], native_request["temperature"], native_request["max_tokens"])
+            cached = completion_cache.get(cache_key, self.trace)
+            if cached is not None:
+                self.trace.info('Completion cache hit', stats=completion_cache.stats())
+                self.replay_completion(cached)
+                if self.replay:
+                    self.finish_replay()
+                return "".join(cached)
+
+        # stream_pipeline=1 이면 스트림 읽기와 전송을 별도 스레드로 분리
+        pipeline = None
+        emit = self.send_frame
+        if os.environ.get('stream_pipeline') == '1':
+            pipeline = self.pipeline = DeliveryPipeline(self.deliver, trace=self.trace)
+            emit = lambda frame_type, data=None: pipeline.submit((frame_type, data))
+
+        trace = self.trace
+        coalescer = None
+        try:
+            # 첫 델타 전까지만 재시도 / 다른 모델·리전으로 장애 조치 (routing.py)
+            event_stream = router.open_stream(plan, request_payload, trace, self.client)
+            trace.debug('Model route', route=route_name(event_stream.route), stats=router.snapshot())
+
+            coalescer = self.coalescer = DeltaCoalescer(lambda text: emit('delta', text))
+            recorded = []
+            watcher = self.watcher = CancelWatcher(self.params["ConnectionId"])
+            for event in event_stream:
+                # 클라이언트가 끊겼거나 cancel 을 요청했으면 스트림을 닫고 중단
+                if self.should_stop(watcher):
+                    trace.info('Stopping generation', reason='connection gone' if self.gone else 'cancelled')
+                    close_event_stream(event_stream)
+                    break
+
+                if 'chunk' in event:
+                    chunk_data = event['chunk']['bytes']
+                    chunk = json.loads(chunk_data)
+                    if trace.verbose:
+                        trace.debug('Chunk received', chunk=chunk)
+                    if chunk.get("type") == "content_block_delta":
+                        message = chunk["delta"].get("text", "")
+                        if trace.enabled:
+                            trace.mark('ttft')
+                        coalescer.add(str(message))  # 문자열로 변환하여 전송
+                        recorded.append(str(message))
+                    elif chunk.get("type") == "content_block_stop":
+                        coalescer.flush()
+                        self.send_footer(emit)
+                        emit('done')
+                        if cache_key:
+                            completion_cache.put(cache_key, recorded)
+                else:
+                    trace.warning("No 'chunk' in event")
+
+            if watcher.cancelled and not self.gone:
+                coalescer.flush()
+                emit('done', {'reason': 'cancelled'})
+
+            return "".join(recorded)
+
+        except (BotoCoreError, ClientError) as error:
+            trace.error('Bedrock error', error=str(error))
+            # 스트림 중간 오류: 모아 둔 델타를 먼저 보내고 error
+            if coalescer:
+                coalescer.flush()
+            if pipeline:
+                pipeline.close()
+                pipeline = self.pipeline = None
+            self.send_frame('error', str(error))
+        finally:
+            # 스트림을 중간에 버렸으면 (연결 끊김) 남은 시간 flush 타이머를 끈다
+            if coalescer:
+                coalescer.cancel()
+                self.coalescer = None
+                self.count_coalesced(coalescer)
+            if pipeline:
+                pipeline.close()
+                self.pipeline = None
+                trace.debug('Pipeline stats', stats=pipeline.stats())
+            if self.replay:
+                self.finish_replay()
+
+    def send_footer(self, emit):
+        # 답변 끝 (done 직전) 에 보낼 프레임. RAG 핸들러는 출처 (sources) 를 보낸다
+        pass
+
+    def reject(self, ticket):
+        # 요청 제한에 걸려 생성하지 않음 (single-flight 구독자에게도 같이 보낸다)
+        self.send_frame('busy', ticket.busy_data())
+        if self.replay:
+            self.finish_replay()
+
+    def should_stop(self, watcher):
+        if self.gone:
+            return True
+        if self.detached and time.monotonic() - self.detached_at > replay.detach_timeout():
+            # replay_detach_ms 안에 resume 이 없으면 생성을 중단한다
+            if not self.follow_redirect(force=True):
+                self.trace.info('No resume before detach timeout', requestId=self.codec.request_id)
+                self.gone = True
+                return True
+        if not watcher.check():
+            return False
+        if not self.flight:
+            return True
+
+        # single-flight 에서는 cancel 한 leader 만 빠지고, 다른 구독자가 남아 있으면 계속 생성한다
+        connection_id = self.params["ConnectionId"]
+        if connection_id in self.flight.targets:
+            # 모아 둔 델타를 먼저 보낸다 (타이머 flush 가 cancel done 과 동시에 보내지 않도록)
+            if self.coalescer:
+                self.coalescer.flush()
+            self.flight.drop(connection_id)
+            self.send_cancelled(connection_id)
+        if not self.flight.alive():
+            self.gone = True
+            return True
+        return False
+
+    def replay_completion(self, deltas):
+        # 캐시된 델타를 실제 생성과 같은 전송 경로로 보낸다 (footer, done 포함)
+        self.trace.mark('ttft')
+        coalescer = DeltaCoalescer(self.send_message_to_client)
+        for message in deltas:
+            if self.gone:
+                coalescer.cancel()
+                return
+            coalescer.add(message)
+        coalescer.flush()
+        self.count_coalesced(coalescer)
+        self.send_footer(self.send_frame)
+        self.send_frame('done')
+
+    def count_coalesced(self, coalescer):
+        # 델타 수 / 델타 전송 수 / 모아 보내서 줄인 전송 수를 요청 메트릭 (EMF) 으로 ('posts' 는 전체 전송 수)
+        stats = coalescer.stats()
+        self.trace.count('deltas', stats['deltas'])
+        self.trace.count('delta_posts', stats['posts'])
+        self.trace.count('saved_posts', stats['saved_posts'])
+
+    def send_message_to_client(self, message):
+        self.send_frame('delta', str(message))  # 문자열로 변환하여 전송
+
+    def send_cancelled(self, connection_id):
+        # cancel 한 구독자에게 done. pipeline 이 있으면 같은 큐로 보내 이미 넣은 델타보다 먼저 가지 않게 한다
+        def send():
+            try:
+                self.flight.post(connection_id, self.codec.encode('done', {'reason': 'cancelled'}, self.next_seq()))
+            except ClientError as e:
+                self.trace.error('Failed to send message to client', error=str(e))
+        if self.pipeline:
+            self.pipeline.submit(send)
+        else:
+            send()
+
+    def deliver(self, frame, seq):
+        # pipeline sender 스레드에서 호출. 프레임 (type, data) 이거나 순서를 지켜 실행할 전송 함수
+        if callable(frame):
+            frame()
+        else:
+            self.send_frame(*frame)
+
+    def send_frame(self, frame_type, data=None):
+        if self.gone:
+            return
+        seq = self.next_seq()
+        if self.flight:
+            if not self.flight.deliver((frame_type, data, seq)):
+                self.gone = True
+            return
+        if self.replay:
+            self.replay.record((frame_type, data, seq))
+            if self.follow_redirect() or self.detached:
+                return
+        self.post_data(self.codec.encode(frame_type, data, seq))
+
+    def follow_redirect(self, force=False):
+        # 다른 연결에서 resume 했으면 이후 프레임은 그 연결로 보낸다. 이번 프레임까지 보냈으면 True
+        target = self.replay.poll_redirect(force)
+        if not target or target['connectionId'] == self.params["ConnectionId"]:
+            return False
+        self.trace.info('Following resumed connection', connectionId=target['connectionId'])
+        self.params["ConnectionId"] = target['connectionId']
+        self.codec = codec_from_settings(target['settings'])
+        self.detached = False
+        if self.watcher:
+            self.watcher.connection_id = target['connectionId']
+        for frame in self.replay.frames_after(target['replayedThrough']):
+            self.post_data(self.codec.encode(*frame))
+        return True
+
+    def finish_replay(self):
+        # 마지막 프레임까지 저장하고, 끝나기 직전에 들어온 resume 이 있으면 남은 프레임을 보낸다
+        self.replay.finish()
+        self.follow_redirect(force=True)
+
+    def next_seq(self):
+        with self.seq_lock:
+            seq = self.seq
+            self.seq += 1
+            return seq
+
+    def post_data(self, data):
+        started = time.perf_counter()
+        try:
+            # pipeline 모드에서는 sender 스레드에서 호출되므로 self.params 를 공유하지 않는다
+            self.conn.post_to_connection(ConnectionId=self.params["ConnectionId"], Data=data)
+        except ClientError as e:
+            self.trace.error('Failed to send message to client', error=str(e))
+            if e.response.get('Error', {}).get('Code') == 'GoneException':
+                # stream_replay=1 이면 생성은 계속하고 resume 을 기다린다
+                if self.replay:
+                    if not self.detached:
+                        self.detached_at = time.monotonic()
+                    self.detached = True
+                else:
+                    self.gone = True
+        finally:
+            if self.trace.enabled:
+                self.trace.record_post(len(data.encode('utf-8')), (time.perf_counter() - started) * 1000)
+
+
+def close_event_stream(event_stream):
+    # botocore EventStream 은 close() 로 HTTP 응답을 닫을 수 있다
+    close = getattr(event_stream, 'close', None)
+    if close:
+        close()
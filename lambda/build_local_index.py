@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from rerank import hashed_ngram_vectors
+
+# LocalIndexRetriever 용 인덱스를 오프라인으로 만든다 (Lambda 에서는 실행하지 않음).
+#
+#   # KB 데이터 소스 문서를 받아 둔 디렉터리에서 (.txt / .md)
+#   python lambda/build_local_index.py --docs ./docs --uri-prefix s3://my-kb-bucket/ --out ./index
+#   # 또는 {"text": ..., "uri": ...} 형식 JSONL 에서, IVF 파티션 64개
+#   python lambda/build_local_index.py --jsonl chunks.jsonl --out ./index --nlist 64
+#
+# 만든 디렉터리를 Lambda layer (예: /opt/index) 로 배포하고 local_index_path 로 지정한다.
+
+
+def read_documents(args):
+    if args.jsonl:
+        with open(args.jsonl, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    doc = json.loads(line)
+                    yield doc['text'], doc['uri']
+        return
+
+    for root, _, files in os.walk(args.docs):
+        for name in sorted(files):
+            if not name.endswith(('.txt', '.md')):
+                continue
+            path = os.path.join(root, name)
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            yield text, args.uri_prefix + os.path.relpath(path, args.docs).replace(os.sep, '/')
+
+
+def chunk_text(text, size, overlap):
+    text = ' '.join(text.split())
+    if len(text) <= size:
+        return [text] if text else []
+    step = max(1, size - overlap)
+    return [text[i:i + size] for i in range(0, len(text) - overlap, step)]
+
+
+def kmeans(vectors, nlist, iterations, seed=1):
+    # 코사인 k-means (벡터/centroid 모두 L2 정규화)
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(nlist):
+            members = vectors[assign == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+    assign = np.argmax(vectors @ centroids.T, axis=1)
+    return centroids.astype(np.float32), assign.astype(np.int32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a local vector index for LocalIndexRetriever')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--docs', help='directory of .txt / .md documents')
+    source.add_argument('--jsonl', help='JSONL file with {"text", "uri"} per line')
+    parser.add_argument('--uri-prefix', default='', help='S3 URI prefix for --docs files')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--chunk-chars', type=int, default=1000)
+    parser.add_argument('--overlap', type=int, default=100)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--nlist', type=int, default=0, help='IVF partitions (0 = flat index)')
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+
+    texts = []
+    metadata = []
+    for text, uri in read_documents(args):
+        for chunk in chunk_text(text, args.chunk_chars, args.overlap):
+            texts.append(chunk)
+            metadata.append({'text': chunk, 'uri': uri})
+    if not texts:
+        sys.exit('no documents found')
+
+    os.makedirs(args.out, exist_ok=True)
+    embeddings = hashed_ngram_vectors(texts, dim=args.dim)
+    np.save(os.path.join(args.out, 'embeddings.npy'), embeddings)
+    with open(os.path.join(args.out, 'metadata.jsonl'), 'w', encoding='utf-8') as f:
+        for meta in metadata:
+            f.write(json.dumps(meta, ensure_ascii=False) + '\n')
+
+    for name in ('ivf_centroids.npy', 'ivf_assign.npy'):
+        path = os.path.join(args.out, name)
+        if os.path.exists(path):
+            os.remove(path)
+    if args.nlist:
+        nlist = min(args.nlist, len(texts))
+        centroids, assign = kmeans(embeddings, nlist, args.iterations)
+        np.save(os.path.join(args.out, 'ivf_centroids.npy'), centroids)
+        np.save(os.path.join(args.out, 'ivf_assign.npy'), assign)
+
+    print(f"Indexed {len(texts)} chunks (dim={args.dim}, nlist={args.nlist or 'flat'}) -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import os
+import time
+
+from state_store import get_store
+
+CANCEL_TTL = 3600
+
+
+def cancel_key(connection_id):
+    return f'cancel:{connection_id}'
+
+
+def request_cancel(connection_id, store=None):
+    # cancel 요청 시각을 기록. 이 시각 이전에 시작한 생성만 중단된다.
+    (store or get_store()).put(cancel_key(connection_id), time.time(), ttl=CANCEL_TTL)
+
+
+def clear_cancel(connection_id, store=None):
+    (store or get_store()).delete(cancel_key(connection_id))
+
+
+def is_cancelled(connection_id, since=0, store=None):
+    cancelled_at = (store or get_store()).get(cancel_key(connection_id))
+    return cancelled_at is not None and cancelled_at >= since
+
+
+class CancelWatcher:
+    # 스트림 루프에서 청크마다 호출하지만 저장소 조회는 interval 마다 한 번만 한다.
+    def __init__(self, connection_id, store=None, interval_ms=None):
+        if interval_ms is None:
+            interval_ms = os.environ.get('cancel_check_ms', 250)
+
+        self.connection_id = connection_id
+        self.store = store
+        self.interval = float(interval_ms) / 1000.0
+        self.started_at = time.time()
+        self.last_check = time.monotonic()
+        self.cancelled = False
+
+    def check(self):
+        if self.cancelled or not self.connection_id:
+            return self.cancelled
+        now = time.monotonic()
+        if now - self.last_check >= self.interval:
+            self.last_check = now
+            self.cancelled = is_cancelled(self.connection_id, since=self.started_at, store=self.store)
+        return self.cancelled
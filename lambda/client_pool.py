@@ -0,0 +1,93 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+# warm invocation 사이에 boto3 클라이언트(와 커넥션 풀)를 재사용하기 위한 모듈 레벨 레지스트리.
+# (service, region, endpoint, config) 별로 한 번만 생성한다. config 가 다르면 (재시도 설정 등) 다른 클라이언트다.
+
+_clients = {}
+_registered = {}  # register_client 로 주입한 fake. config 와 상관없이 우선
+_lock = threading.Lock()
+_stats = {'created': 0, 'reused': 0}
+
+
+def default_config():
+    return Config(
+        max_pool_connections=int(os.environ.get('client_pool_size', 10)),
+        tcp_keepalive=os.environ.get('client_keepalive', '1') == '1'
+    )
+
+
+def config_key(config):
+    # botocore Config 는 값으로 비교할 수 없으므로 사용자가 지정한 옵션으로 키를 만든다
+    if config is None:
+        return None
+    options = getattr(config, '_user_provided_options', None)
+    if options is None:
+        options = vars(config)
+    return repr(sorted(options.items()))
+
+
+def get_client(service, region_name=None, endpoint_url=None, config=None):
+    key = (service, region_name, endpoint_url, config_key(config))
+    with _lock:
+        client = _registered.get((service, region_name, endpoint_url)) or _clients.get(key)
+        if client is not None:
+            _stats['reused'] += 1
+            return client
+
+        merged = default_config()
+        if config is not None:
+            merged = merged.merge(config)
+        client = boto3.client(service, region_name=region_name, endpoint_url=endpoint_url, config=merged)
+        _clients[key] = client
+        _stats['created'] += 1
+        return client
+
+
+class LazyClient:
+    # 첫 메서드 호출 때 get_client 로 생성한다 (모듈 import 시점에는 만들지 않음)
+    def __init__(self, service, region_name=None, endpoint_url=None, config=None):
+        self.service = service
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        self.config = config
+        self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            self._client = get_client(self.service, self.region_name, self.endpoint_url, self.config)
+        return getattr(self._client, name)
+
+
+def lazy_client(service, region_name=None, endpoint_url=None, config=None):
+    return LazyClient(service, region_name, endpoint_url, config)
+
+
+def register_client(client, service, region_name=None, endpoint_url=None):
+    # 로컬 테스트 / 벤치마크에서 fake 클라이언트 주입용
+    with _lock:
+        _registered[(service, region_name, endpoint_url)] = client
+
+
+def clear():
+    with _lock:
+        _clients.clear()
+        _registered.clear()
+        _stats['created'] = 0
+        _stats['reused'] = 0
+
+
+def pool_stats():
+    with _lock:
+        return dict(_stats, clients=len(_clients))
+
+
+def count_pool(trace, before):
+    # before (pool_stats()) 이후 생성 / 재사용한 클라이언트 수를 요청 메트릭 (EMF) 으로
+    after = pool_stats()
+    trace.count('clients_created', after['created'] - before['created'])
+    trace.count('clients_reused', after['reused'] - before['reused'])
+    return after
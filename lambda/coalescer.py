@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+
+class DeltaCoalescer:
+    # content_block_delta 조각들을 모아서 post_to_connection 호출 수를 줄인다.
+    # - 첫 토큰은 바로 전송 (time-to-first-token 유지)
+    # - 버퍼가 max_bytes 이상이거나 마지막 전송 후 max_delay_ms 가 지나면 flush
+    # - content_block_stop 에서는 호출 측이 flush() 를 직접 부른다
+    # 시간 조건은 델타가 도착할 때 검사하고, 버퍼가 남아 있으면 타이머로 한 번 더 검사한다
+    # (스트림이 멈춰도 모아 둔 텍스트가 max_delay_ms 안에 나간다). 타이머가 send 를 부를 수 있으므로
+    # add / flush / cancel 은 lock 으로 직렬화한다. 스트림을 버릴 때는 cancel() 로 타이머를 끈다.
+    def __init__(self, send, max_bytes=None, max_delay_ms=None):
+        if max_bytes is None:
+            max_bytes = os.environ.get('coalesce_max_bytes', 256)
+        if max_delay_ms is None:
+            max_delay_ms = os.environ.get('coalesce_max_ms', 50)
+
+        self.send = send
+        self.max_bytes = int(max_bytes)
+        self.max_delay = float(max_delay_ms) / 1000.0
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.last_flush = None
+        self.deltas = 0
+        self.posts = 0
+        self.lock = threading.RLock()
+        self.timer = None
+
+    def add(self, text):
+        if not text:
+            return
+        with self.lock:
+            self.deltas += 1
+
+            # 첫 토큰은 버퍼링하지 않는다
+            if self.last_flush is None:
+                self._send(text)
+                return
+
+            self.buffer.append(text)
+            self.buffered_bytes += len(text.encode('utf-8'))
+            elapsed = time.monotonic() - self.last_flush
+            if self.buffered_bytes >= self.max_bytes or elapsed >= self.max_delay:
+                self.flush()
+            elif self.timer is None:
+                timer = self.timer = threading.Timer(self.max_delay - elapsed, lambda: self._expire(timer))
+                timer.daemon = True
+                timer.start()
+
+    def flush(self):
+        with self.lock:
+            self.cancel()
+            if not self.buffer:
+                return
+            text = ''.join(self.buffer)
+            self.buffer = []
+            self.buffered_bytes = 0
+            self._send(text)
+
+    def cancel(self):
+        # 예약된 시간 flush 만 취소한다 (버퍼는 그대로)
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+    def _expire(self, timer):
+        # 이미 취소됐거나 새 타이머로 바뀌었으면 무시 (cancel 과 동시에 만료된 경우)
+        with self.lock:
+            if self.timer is timer:
+                self.flush()
+
+    def _send(self, text):
+        self.send(text)
+        self.posts += 1
+        self.last_flush = time.monotonic()
+
+    @property
+    def saved_posts(self):
+        return self.deltas - self.posts
+
+    def stats(self):
+        return {
+            'deltas': self.deltas,
+            'posts': self.posts,
+            'saved_posts': self.saved_posts
+        }
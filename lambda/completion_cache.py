@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import NOOP_TRACE
+from state_store import get_store
+
+# 동일한 프롬프트에 대한 응답 재생용 캐시 (completion_cache=1 일 때만 사용).
+# 키: model id + 최종 프롬프트 + temperature + max_tokens. 값: 기록된 델타 목록.
+# KB 가 바뀌면 bump_kb_version() 으로 전체 무효화 (state_store 의 kb:version 을 주기적으로 확인).
+
+KB_VERSION_KEY = 'kb:version'
+
+
+def bump_kb_version(store=None):
+    # KB 동기화(ingestion) 이후 호출. 모든 인스턴스의 completion cache 가 무효화된다.
+    (store or get_store()).put(KB_VERSION_KEY, time.time())
+
+
+class CompletionCache:
+    def __init__(self, enabled=None, max_entries=None, max_bytes=None, max_entry_bytes=None, ttl=None,
+                 store=None, version_check_seconds=None):
+        env = os.environ
+        self.enabled = (env.get('completion_cache') == '1') if enabled is None else enabled
+        self.max_entries = int(max_entries if max_entries is not None else env.get('completion_cache_entries', 128))
+        self.max_bytes = int(max_bytes if max_bytes is not None else env.get('completion_cache_max_bytes', 4 * 1024 * 1024))
+        self.max_entry_bytes = int(max_entry_bytes if max_entry_bytes is not None else env.get('completion_cache_entry_bytes', 64 * 1024))
+        self.ttl = float(ttl if ttl is not None else env.get('completion_cache_ttl', 3600))
+        self.version_check = float(version_check_seconds if version_check_seconds is not None else env.get('completion_cache_version_check', 30))
+
+        self.store = store
+        self.kb_version = None
+        self.last_version_check = None
+        self.entries = OrderedDict()  # key -> (expires_at, deltas, size)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def make_key(self, model_id, prompt, temperature, max_tokens):
+        raw = json.dumps([model_id, prompt, temperature, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key, trace=NOOP_TRACE):
+        if not self.enabled:
+            return None
+        self.sync_kb_version(trace)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, deltas):
+        if not self.enabled:
+            return
+        size = sum(len(d.encode('utf-8')) for d in deltas)
+        if size > self.max_entry_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.time() + self.ttl, list(deltas), size)
+            self.total_bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            self.invalidations += 1
+
+    def sync_kb_version(self, trace=NOOP_TRACE):
+        now = time.monotonic()
+        first_check = self.last_version_check is None
+        if not first_check and now - self.last_version_check < self.version_check:
+            return
+        self.last_version_check = now
+
+        version = (self.store or get_store()).get(KB_VERSION_KEY)
+        if not first_check and version != self.kb_version:
+            trace.info('KB version changed, invalidating completion cache', previous=self.kb_version, version=version)
+            self.invalidate()
+        self.kb_version = version
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
@@ -1,4 +1,7 @@
 import json
+from cancellation import clear_cancel
+from frames import save_protocol
+from conversation import ConversationStore
 
 def lambda_handler(event, context):
     # requestContext에서 connectionId 추출
@@ -7,6 +10,12 @@ def lambda_handler(event, context):
     if connection_id:
         print(f'Connection ID: {connection_id}')
         print('Connected successfully')
+        # 같은 connectionId 에 남아있는 cancel 표시 정리
+        clear_cancel(connection_id)
+        # ?protocol=2&encoding=compact 로 연결하면 프레임 형식을 저장
+        save_protocol(connection_id, event.get('queryStringParameters'))
+        # conversation_memory=1 이면 빈 대화 기록 생성
+        ConversationStore().start(connection_id)
         return {
             'statusCode': 200,
             'body': json.dumps({'message': 'Connected successfully', 'connectionId': connection_id})
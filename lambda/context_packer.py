@@ -0,0 +1,87 @@
+import os
+import re
+
+# 검색 결과를 프롬프트의 {context} 로 조립한다.
+# 점수순 정렬 -> 중복/겹치는 청크 제거 -> 청크별 길이 제한 -> 전체 토큰 예산 안에서 채우기
+
+
+def estimate_tokens(text):
+    # 토크나이저 없이 쓰는 근사치: 영문/숫자는 약 4자, 한글 등은 약 1.5자당 1토큰
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) / 1.5) + 1
+
+
+def normalize_text(text):
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def shingles(text, n=5):
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    # 짧은 쪽 기준 겹침 비율: 한 청크가 다른 청크에 거의 포함되면 중복으로 본다
+    return len(a & b) / min(len(a), len(b))
+
+
+def truncate_to_tokens(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return text, False
+    # 토큰 추정치 비율로 자르고, 가능하면 문장 끝에서 자른다 (text 는 normalize_text 를 거쳐 줄바꿈이 없다)
+    cut = max(1, int(len(text) * max_tokens / estimate_tokens(text)))
+    truncated = text[:cut]
+    boundary = max(truncated.rfind(end) for end in ('. ', '? ', '! '))
+    if boundary > cut // 2:
+        truncated = truncated[:boundary + 1]
+    return truncated.rstrip() + ' …', True
+
+
+def pack_context(results, budget_tokens=None, max_chunk_tokens=None, threshold=None):
+    if budget_tokens is None:
+        budget_tokens = int(os.environ.get('context_token_budget', 1500))
+    if max_chunk_tokens is None:
+        max_chunk_tokens = int(os.environ.get('context_chunk_tokens', 500))
+    if threshold is None:
+        threshold = float(os.environ.get('context_dedup_threshold', 0.8))
+
+    chunks = []
+    for result in results:
+        text = normalize_text(result.get('content', {}).get('text', ''))
+        if text:
+            chunks.append((result.get('score', 0.0), text))
+    chunks.sort(key=lambda item: item[0], reverse=True)
+
+    kept = []
+    kept_shingles = []
+    duplicates = 0
+    truncated_count = 0
+    used_tokens = 0
+    for score, text in chunks:
+        grams = shingles(text)
+        if any(similarity(grams, other) >= threshold for other in kept_shingles):
+            duplicates += 1
+            continue
+
+        remaining = budget_tokens - used_tokens
+        if remaining < 32:
+            break
+        text, truncated = truncate_to_tokens(text, min(max_chunk_tokens, remaining))
+        truncated_count += truncated
+
+        kept.append(text)
+        kept_shingles.append(grams)
+        used_tokens += estimate_tokens(text)
+
+    report = {
+        'chunks_in': len(chunks),
+        'duplicates': duplicates,
+        'chunks_used': len(kept),
+        'truncated': truncated_count,
+        'tokens': used_tokens,
+        'budget': budget_tokens
+    }
+    return '\n\n'.join(kept), report
@@ -0,0 +1,121 @@
+import json
+import os
+
+from context_packer import estimate_tokens, normalize_text, truncate_to_tokens
+from state_store import get_store
+
+# connectionId 별 대화 기록 (conversation_memory=1 일 때 사용).
+#   $connect 에서 start, $disconnect 에서 clear, 응답이 끝날 때마다 append 로 질문/답변 한 쌍을 추가한다.
+#   최근 대화는 그대로 두고, conversation_token_budget 을 넘으면 오래된 대화부터 요약으로 옮긴다.
+#   요약은 추가 모델 호출 없이 질문/답변 앞부분을 잘라 만들고, conversation_summary_tokens 안에서 오래된 줄부터 버린다.
+#   그래서 세션이 길어져도 프롬프트(prefill) 크기는 일정 범위 안에 머문다.
+#
+# 저장소는 state_store (state_store=memory | sqlite | dynamodb), 키 conv:<connectionId>
+#   {"summary": ["Q: ... / A: ...", ...], "turns": [{"role": "user", "text": ...}, {"role": "assistant", "text": ...}, ...]}
+
+CONVERSATION_TTL = 2 * 60 * 60  # API Gateway 웹소켓 연결 최대 유지 시간
+
+
+def conversation_key(connection_id):
+    return f'conv:{connection_id}'
+
+
+def summarize_exchange(question, answer, max_tokens=60):
+    question, _ = truncate_to_tokens(normalize_text(question), max_tokens // 2)
+    answer, _ = truncate_to_tokens(normalize_text(answer), max_tokens // 2)
+    return f'Q: {question} / A: {answer}'
+
+
+def turns_tokens(turns):
+    return sum(estimate_tokens(turn['text']) for turn in turns)
+
+
+def summary_tokens(summary):
+    return sum(estimate_tokens(line) for line in summary)
+
+
+def history_tokens(history):
+    # 프롬프트에 들어가는 대화 기록의 토큰 추정치 (compact 와 같은 계산). 모델 선택 / admission 용
+    if not history:
+        return 0
+    return turns_tokens(history.get('turns', [])) + summary_tokens(history.get('summary', []))
+
+
+class ConversationStore:
+    def __init__(self, enabled=None, store=None, budget_tokens=None, summary_tokens=None, turn_tokens=None):
+        if enabled is None:
+            enabled = os.environ.get('conversation_memory') == '1'
+        if budget_tokens is None:
+            budget_tokens = os.environ.get('conversation_token_budget', 1000)
+        if summary_tokens is None:
+            summary_tokens = os.environ.get('conversation_summary_tokens', 200)
+        if turn_tokens is None:
+            turn_tokens = os.environ.get('conversation_turn_tokens', 400)
+
+        self.enabled = enabled
+        self._store = store
+        self.budget_tokens = int(budget_tokens)
+        self.summary_tokens = int(summary_tokens)
+        self.turn_tokens = int(turn_tokens)
+
+    @property
+    def store(self):
+        return self._store or get_store()
+
+    def start(self, connection_id):
+        if self.enabled:
+            self.store.put(conversation_key(connection_id), {'summary': [], 'turns': []}, ttl=CONVERSATION_TTL)
+
+    def clear(self, connection_id):
+        if self.enabled:
+            self.store.delete(conversation_key(connection_id))
+
+    def history(self, connection_id):
+        # {"summary": [...], "turns": [...]} (기록이 없으면 빈 기록)
+        if not self.enabled or not connection_id:
+            return {'summary': [], 'turns': []}
+        return self.store.get(conversation_key(connection_id)) or {'summary': [], 'turns': []}
+
+    def append(self, connection_id, question, answer):
+        if not self.enabled or not connection_id or not answer:
+            return
+        history = self.history(connection_id)
+        # 한 턴이 너무 길면 (긴 답변 등) 잘라서 저장
+        for role, text in (('user', question), ('assistant', answer)):
+            text, _ = truncate_to_tokens(text, self.turn_tokens)
+            history['turns'].append({'role': role, 'text': text})
+        self.store.put(conversation_key(connection_id), self.compact(history), ttl=CONVERSATION_TTL)
+
+    def compact(self, history):
+        # 최근 턴만 예산 안에 남기고 (항상 마지막 질문/답변 한 쌍은 유지) 나머지는 요약으로
+        turns = history['turns']
+        summary = history['summary']
+        while len(turns) > 2 and turns_tokens(turns) + self.summary_cost(summary) > self.budget_tokens:
+            question, answer = turns[0]['text'], turns[1]['text']
+            turns = turns[2:]
+            summary = summary + [summarize_exchange(question, answer)]
+        while summary and self.summary_cost(summary) > self.summary_tokens:
+            summary = summary[1:]
+        return {'summary': summary, 'turns': turns}
+
+    def summary_cost(self, summary):
+        return summary_tokens(summary)
+
+
+def build_messages(history, request):
+    # Bedrock messages API 형식. 요약은 system 으로, 최근 턴은 user/assistant 메시지로, 마지막에 이번 요청
+    messages = [{"role": turn['role'], "content": [{"type": "text", "text": turn['text']}]}
+                for turn in (history or {}).get('turns', [])]
+    messages.append({"role": "user", "content": [{"type": "text", "text": request}]})
+    system = None
+    if history and history.get('summary'):
+        system = "Summary of the earlier conversation with this user:\n" + "\n".join(history['summary'])
+    return system, messages
+
+
+def history_digest(history):
+    # single-flight / completion cache 키에 대화 기록을 반영할 때 사용 (기록이 없으면 빈 문자열).
+    # 크기 추정에는 쓰지 않는다 (JSON 키 / 이스케이프만큼 커진다): history_tokens 사용
+    if not history or not (history.get('turns') or history.get('summary')):
+        return ''
+    return json.dumps(history, ensure_ascii=False, sort_keys=True)
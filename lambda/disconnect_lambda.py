@@ -1,10 +1,35 @@
 import json
-import boto3
 import os
+from cancellation import request_cancel
+from client_pool import get_client
+from singleflight import SingleFlight
+from frames import clear_protocol
+from conversation import ConversationStore
+from admission import AdmissionControl
+from replay import is_enabled as replay_enabled
 
 def lambda_handler(event, context):
     connection_id = event['requestContext']['connectionId']
-    client = boto3.client('apigatewaymanagementapi', endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
+    route_key = event['requestContext'].get('routeKey')
+
+    # 진행 중인 생성 중단 요청. stream lambda 가 청크 사이에 확인한다.
+    # stream_replay=1 이면 끊긴 뒤 resume 할 수 있도록 $disconnect 에서는 중단하지 않는다 (cancel 라우트만)
+    if route_key == 'cancel' or not replay_enabled():
+        request_cancel(connection_id)
+    # single-flight follower 로 구독 중이었다면 구독 해제 (cancel 이면 leader 가 done {reason: cancelled} 를 보낸다)
+    single_flight = SingleFlight()
+    if single_flight.enabled:
+        single_flight.leave(connection_id, cancelled=route_key == 'cancel')
+    if route_key == 'cancel':
+        return {
+            'statusCode': 200,
+            'body': json.dumps('Cancel requested')
+        }
+
+    clear_protocol(connection_id)
+    ConversationStore().clear(connection_id)
+    AdmissionControl().clear(connection_id)
+    client = get_client('apigatewaymanagementapi', endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
 
     try:
         # 연결 종료
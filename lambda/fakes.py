@@ -0,0 +1,176 @@
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+# 로컬 테스트용 AWS 클라이언트 대체 구현 (실제 AWS 호출 없음)
+
+
+def client_error(code, operation, message=None):
+    return ClientError({'Error': {'Code': code, 'Message': message or code}}, operation)
+
+
+class FakeGoneException(ClientError):
+    pass
+
+
+class FakeGatewayClient:
+    # apigatewaymanagementapi 대체.
+    # fail_on 번째(0부터) post 부터 error_code 로 실패하고, error_rate 확률로 임의의 post 가 실패한다.
+    # disconnect(connection_id) / delete_connection 후에는 그 연결로의 post 가 GoneException 으로 실패한다.
+    exceptions = SimpleNamespace(GoneException=FakeGoneException)
+
+    def __init__(self, latency_ms=0, fail_on=None, error_code='GoneException', error_rate=0.0, seed=None):
+        self.latency = latency_ms / 1000.0
+        self.fail_on = fail_on
+        self.error_code = error_code
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.posts = []
+        self.post_times = []
+        self.attempts = 0
+        self.disconnected = set()
+        self.lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId, Data):
+        with self.lock:
+            attempt = self.attempts
+            self.attempts += 1
+            failed = self.error_rate and self.random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if (self.fail_on is not None and attempt >= self.fail_on) or failed:
+            raise client_error(self.error_code, 'PostToConnection', f'{self.error_code} on post {attempt}')
+        if ConnectionId in self.disconnected:
+            raise client_error('GoneException', 'PostToConnection', f'{ConnectionId} is gone')
+        with self.lock:
+            self.posts.append((ConnectionId, Data))
+            self.post_times.append(time.perf_counter())
+        return {}
+
+    def disconnect(self, connection_id):
+        with self.lock:
+            self.disconnected.add(connection_id)
+
+    def delete_connection(self, ConnectionId):
+        with self.lock:
+            if ConnectionId in self.disconnected:
+                raise FakeGoneException({'Error': {'Code': 'GoneException', 'Message': f'{ConnectionId} is gone'}},
+                                        'DeleteConnection')
+            self.disconnected.add(ConnectionId)
+        return {}
+
+    def messages(self, connection_id=None):
+        # post 된 Data 를 JSON 으로 풀어서 반환
+        return [json.loads(data) for conn, data in self.posts if connection_id is None or conn == connection_id]
+
+    def timeline(self, connection_id):
+        # [(Data, post 완료 시각)]
+        with self.lock:
+            return [(data, t) for (conn, data), t in zip(self.posts, self.post_times) if conn == connection_id]
+
+
+class FakeEventStream:
+    # invoke_model_with_response_stream 의 response['body'] 대체 (close() 지원)
+    # error_after 가 있으면 델타를 그만큼 보낸 뒤 error_code 로 실패한다 (스트림 중간 예외, 0 이면 첫 델타 전)
+    def __init__(self, chunks, delay, first_delay, error_after=None, error_code='ThrottlingException'):
+        self.chunks = chunks
+        self.delay = delay
+        self.first_delay = first_delay
+        self.error_after = error_after
+        self.error_code = error_code
+        self.closed = False
+        self.emitted = 0
+
+    def __iter__(self):
+        events = [{'type': 'message_start'}, {'type': 'content_block_start', 'index': 0}]
+        events += [{'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': c}} for c in self.chunks]
+        events += [{'type': 'content_block_stop', 'index': 0}, {'type': 'message_delta'}, {'type': 'message_stop'}]
+
+        for event in events:
+            if self.closed:
+                return
+            if event['type'] == 'content_block_delta':
+                if self.error_after is not None and self.emitted >= self.error_after:
+                    raise client_error(self.error_code, 'InvokeModelWithResponseStream', f'{self.error_code} in stream')
+                time.sleep(self.first_delay if self.emitted == 0 else self.delay)
+                self.emitted += 1
+            yield {'chunk': {'bytes': json.dumps(event, ensure_ascii=False).encode('utf-8')}}
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBedrockRuntime:
+    # bedrock-runtime 대체. text 를 chunk_chars 글자씩 잘라 token_ms 간격으로 스트리밍한다.
+    # throttle 주입: 처음 throttle_first 번 호출과 throttle_rate 확률의 호출이 error_code 로 실패한다
+    # (throttle_models 가 있으면 그 모델만). stream_error_after 가 있으면 호출은 성공하고 스트림 중간에 실패한다.
+    def __init__(self, text=None, chunks=64, chunk_chars=4, token_ms=10, first_token_ms=200, throttle_first=0,
+                 throttle_rate=0.0, throttle_models=None, stream_error_after=None, error_code='ThrottlingException', seed=None):
+        if text is None:
+            text = ''.join(f'토큰{i % 10} ' for i in range(chunks * chunk_chars // 4 + 1))
+        self.text = text
+        self.chunk_chars = chunk_chars
+        self.token_delay = token_ms / 1000.0
+        self.first_token_delay = first_token_ms / 1000.0
+        self.throttle_first = throttle_first
+        self.throttle_rate = throttle_rate
+        self.throttle_models = set(throttle_models) if throttle_models else None
+        self.stream_error_after = stream_error_after
+        self.error_code = error_code
+        self.random = random.Random(seed)
+        self.calls = []
+        self.streams = []
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def invoke_model_with_response_stream(self, modelId, body, contentType=None, accept=None):
+        with self.lock:
+            attempt = len(self.calls)
+            self.calls.append({'modelId': modelId, 'body': json.loads(body)})
+            targeted = self.throttle_models is None or modelId in self.throttle_models
+            failed = targeted and (attempt < self.throttle_first or (self.throttle_rate and self.random.random() < self.throttle_rate))
+            if failed:
+                self.throttled += 1
+        if failed:
+            raise client_error(self.error_code, 'InvokeModelWithResponseStream', f'{self.error_code} on call {attempt}')
+        chunks = [self.text[i:i + self.chunk_chars] for i in range(0, len(self.text), self.chunk_chars)]
+        error_after = self.stream_error_after if targeted else None
+        stream = FakeEventStream(chunks, self.token_delay, self.first_token_delay, error_after, self.error_code)
+        with self.lock:
+            self.streams.append(stream)
+        return {'body': stream}
+
+    def emitted(self):
+        return sum(stream.emitted for stream in self.streams)
+
+
+class FakeAgentRuntime:
+    # bedrock-agent-runtime 대체. retrieve 는 latency_ms 후 numberOfResults 개의 결과를 반환한다.
+    def __init__(self, results=None, latency_ms=100, documents=8):
+        self.results = results
+        self.latency = latency_ms / 1000.0
+        self.documents = documents
+        self.calls = 0
+
+    def retrieve(self, retrievalQuery, knowledgeBaseId, retrievalConfiguration=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        n = (retrievalConfiguration or {}).get('vectorSearchConfiguration', {}).get('numberOfResults', 5)
+        if self.results is not None:
+            return {'retrievalResults': self.results[:n]}
+
+        query = retrievalQuery['text']
+        results = []
+        for i in range(n):
+            doc = i % self.documents
+            results.append({
+                'content': {'text': f'{query} 관련 문서 {doc} 의 {i} 번째 청크입니다. ' * 8},
+                'location': {'type': 'S3', 's3Location': {'uri': f's3://fake-kb-bucket/docs/document-{doc}.pdf'}},
+                'score': round(0.9 - i * 0.05, 3)
+            })
+        return {'retrievalResults': results}
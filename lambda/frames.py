@@ -0,0 +1,135 @@
+import json
+import uuid
+
+from state_store import get_store
+
+# 웹소켓 메시지 프레임 형식
+#
+# v1 (기존 형식, 기본값)
+#   delta / sources : {"message": "<text>", "seq": n}
+#   done            : {"message": "{\"type\": \"done\"}", "seq": n}
+#   error           : {"error": "<text>", "seq": n}
+#   busy            : {"error": "Server busy, retry later", "busy": {"retryAfterMs": n, "scope": ...}, "seq": n}
+#
+# v2 : {"v": 2, "type": "delta" | "sources" | "done" | "error" | "busy", "id": "<requestId>", "seq": n, "data": ...}
+# v2 compact : [2, "d" | "s" | "x" | "e" | "b", "<requestId>", n, data]
+#
+# busy 는 요청 제한 (admission.py) 에 걸려 스트림을 시작하지 않았다는 뜻이다. 같은 요청의 마지막 프레임.
+#
+# 버전/인코딩은 $connect 의 query string (?protocol=2&encoding=compact) 으로 정하고,
+# sendMessage body 의 protocol / encoding 으로 요청마다 바꿀 수 있다.
+
+PROTOCOL_VERSION = 2
+FRAME_TYPES = ['delta', 'sources', 'done', 'error', 'busy']
+COMPACT_CODES = {'delta': 'd', 'sources': 's', 'done': 'x', 'error': 'e', 'busy': 'b'}
+COMPACT_TYPES = {code: frame_type for frame_type, code in COMPACT_CODES.items()}
+PROTOCOL_TTL = 2 * 60 * 60  # API Gateway 웹소켓 연결 최대 유지 시간
+
+
+class FrameCodec:
+    def __init__(self, version=1, compact=False, request_id=None):
+        self.version = int(version)
+        self.compact = bool(compact) and self.version >= 2
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+
+    def encode(self, frame_type, data=None, seq=0):
+        if self.version < 2:
+            return encode_legacy(frame_type, data, seq)
+        if self.compact:
+            return json.dumps([PROTOCOL_VERSION, COMPACT_CODES[frame_type], self.request_id, seq, data],
+                              ensure_ascii=False, separators=(',', ':'))
+        return json.dumps({'v': PROTOCOL_VERSION, 'type': frame_type, 'id': self.request_id, 'seq': seq, 'data': data},
+                          ensure_ascii=False, separators=(',', ':'))
+
+    def settings(self):
+        return {'protocol': self.version, 'encoding': 'compact' if self.compact else 'json', 'requestId': self.request_id}
+
+
+def encode_legacy(frame_type, data, seq):
+    if frame_type == 'error':
+        return json.dumps({'error': str(data), 'seq': seq})
+    if frame_type == 'busy':
+        return json.dumps({'error': 'Server busy, retry later', 'busy': data, 'seq': seq})
+    if frame_type == 'done':
+        done = {'type': 'done'}
+        done.update(data or {})
+        return json.dumps({'message': json.dumps(done), 'seq': seq})
+    return json.dumps({'message': str(data), 'seq': seq})
+
+
+def decode_frame(raw):
+    # 모든 형식을 {"type", "id", "seq", "data"} 로 변환. 알 수 없는 형식 / 타입은 error 프레임으로 본다
+    value = json.loads(raw)
+    if isinstance(value, list):
+        if len(value) != 5 or not isinstance(value[1], str) or value[1] not in COMPACT_TYPES:
+            return unknown_frame(raw, value[2] if len(value) > 2 else None)
+        _, code, request_id, seq, data = value
+        return {'type': COMPACT_TYPES[code], 'id': request_id, 'seq': seq, 'data': data}
+    if not isinstance(value, dict):
+        return unknown_frame(raw)
+    if value.get('v', 1) >= 2:
+        if value.get('type') not in FRAME_TYPES:
+            return unknown_frame(raw, value.get('id'), value.get('seq'))
+        return {'type': value['type'], 'id': value.get('id'), 'seq': value.get('seq'), 'data': value.get('data')}
+    if 'busy' in value:
+        return {'type': 'busy', 'id': None, 'seq': value.get('seq'), 'data': value['busy']}
+    if 'error' in value:
+        return {'type': 'error', 'id': None, 'seq': value.get('seq'), 'data': value['error']}
+
+    message = value.get('message', '')
+    done = legacy_done(message)
+    if done is not None:
+        return {'type': 'done', 'id': None, 'seq': value.get('seq'), 'data': done or None}
+    return {'type': 'delta', 'id': None, 'seq': value.get('seq'), 'data': message}
+
+
+def legacy_done(message):
+    # v1 done 은 message 안의 JSON {"type": "done", ...}. done 이면 나머지 필드, 아니면 None
+    if not isinstance(message, str) or not message.startswith('{'):
+        return None
+    try:
+        inner = json.loads(message)
+    except ValueError:
+        return None
+    if not isinstance(inner, dict) or inner.get('type') != 'done':
+        return None
+    inner.pop('type')
+    return inner
+
+
+def unknown_frame(raw, request_id=None, seq=None):
+    return {'type': 'error', 'id': request_id, 'seq': seq, 'data': f'Unknown frame: {raw}'}
+
+
+def protocol_key(connection_id):
+    return f'proto:{connection_id}'
+
+
+def save_protocol(connection_id, params, store=None):
+    # $connect 에서 호출. protocol 을 지정한 연결만 저장한다.
+    params = params or {}
+    if 'protocol' not in params:
+        return
+    settings = {'protocol': int(params['protocol']), 'encoding': params.get('encoding', 'json')}
+    (store or get_store()).put(protocol_key(connection_id), settings, ttl=PROTOCOL_TTL)
+
+
+def clear_protocol(connection_id, store=None):
+    (store or get_store()).delete(protocol_key(connection_id))
+
+
+def negotiate(connection_id, body=None, store=None):
+    # sendMessage body 에 protocol 이 있으면 우선, 없으면 $connect 에서 저장한 설정, 둘 다 없으면 v1
+    body = body or {}
+    settings = None
+    if 'protocol' in body:
+        settings = {'protocol': body['protocol'], 'encoding': body.get('encoding', 'json')}
+    elif connection_id:
+        settings = (store or get_store()).get(protocol_key(connection_id))
+    settings = settings or {'protocol': 1, 'encoding': 'json'}
+    return FrameCodec(settings['protocol'], settings.get('encoding') == 'compact', body.get('requestId'))
+
+
+def codec_from_settings(settings):
+    settings = settings or {}
+    return FrameCodec(settings.get('protocol', 1), settings.get('encoding') == 'compact', settings.get('requestId'))
@@ -0,0 +1,196 @@
+import json
+import os
+import random
+import threading
+import time
+
+# 요청 단위 로그/타이머/카운터.
+#   log_level        debug | info | warning | error (기본 info)
+#   log_sample_rate  debug 로그를 남길 요청 비율 (0~1, 기본 0). 샘플된 요청은 log_level 과 관계없이 debug 까지 남긴다
+#   instrumentation  off 이면 NOOP_TRACE 사용 (로그/메트릭 없음, error 만 출력)
+#   metrics_namespace CloudWatch Embedded Metric Format 네임스페이스
+#
+# 요청이 끝나면 emit() 으로 EMF 레코드 한 줄을 출력한다 (CloudWatch Logs 가 메트릭으로 추출).
+# 스트림 루프 안에서는 trace.enabled / trace.verbose 를 먼저 확인해 no-op 모드에서 비용이 없게 한다.
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+STAGE_METRICS = ['parse', 'admission', 'retrieval', 'prompt', 'ttft', 'total']
+
+
+class Trace:
+    enabled = True
+
+    def __init__(self, function_name, request_id=None, level=None, sample_rate=None, namespace=None):
+        if level is None:
+            level = os.environ.get('log_level', 'info')
+        if sample_rate is None:
+            sample_rate = float(os.environ.get('log_sample_rate', 0))
+        if namespace is None:
+            namespace = os.environ.get('metrics_namespace', 'AWSLLMAPI')
+
+        self.function_name = function_name
+        self.request_id = request_id
+        self.namespace = namespace
+        self.sampled = sample_rate > 0 and random.random() < sample_rate
+        self.level = LEVELS['debug'] if self.sampled else LEVELS.get(level, LEVELS['info'])
+        self.verbose = self.level <= LEVELS['debug']
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {'posts': 0, 'bytes': 0, 'errors': 0}
+        self.post_ms_total = 0.0
+        self.post_ms_max = 0.0
+        self.lock = threading.Lock()  # pipeline worker 스레드에서도 기록
+
+    def log(self, level, message, **fields):
+        if LEVELS[level] < self.level:
+            return
+        record = {'level': level.upper(), 'message': message, 'function': self.function_name}
+        if self.request_id:
+            record['requestId'] = self.request_id
+        record.update(fields)
+        print(json.dumps(record, ensure_ascii=False, default=str))
+
+    def debug(self, message, **fields):
+        self.log('debug', message, **fields)
+
+    def info(self, message, **fields):
+        self.log('info', message, **fields)
+
+    def warning(self, message, **fields):
+        self.log('warning', message, **fields)
+
+    def error(self, message, **fields):
+        with self.lock:
+            self.counters['errors'] += 1
+        self.log('error', message, **fields)
+
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    def mark(self, name):
+        # 요청 시작부터 지금까지 (ttft 등). 처음 한 번만 기록
+        if name not in self.stages:
+            self.stages[name] = (time.perf_counter() - self.started) * 1000
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_post(self, size, elapsed_ms):
+        with self.lock:
+            self.counters['posts'] += 1
+            self.counters['bytes'] += size
+            self.post_ms_total += elapsed_ms
+            self.post_ms_max = max(self.post_ms_max, elapsed_ms)
+
+    def timed_post(self, post):
+        # post(connection_id, data) 에 카운터/타이머를 붙인다 (single-flight 전송용)
+        def timed(connection_id, data):
+            started = time.perf_counter()
+            try:
+                post(connection_id, data)
+            finally:
+                self.record_post(len(data.encode('utf-8')), (time.perf_counter() - started) * 1000)
+        return timed
+
+    def emit(self):
+        self.mark('total')
+        metrics = {}
+        for name in STAGE_METRICS:
+            if name in self.stages:
+                metrics[f'{name}_ms'] = (round(self.stages[name], 2), 'Milliseconds')
+        for name, value in self.counters.items():
+            metrics[name] = (value, 'Bytes' if name == 'bytes' else 'Count')
+        if self.counters['posts']:
+            metrics['post_ms_avg'] = (round(self.post_ms_total / self.counters['posts'], 2), 'Milliseconds')
+            metrics['post_ms_max'] = (round(self.post_ms_max, 2), 'Milliseconds')
+
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['function']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()]
+                }]
+            },
+            'function': self.function_name
+        }
+        if self.request_id:
+            record['requestId'] = self.request_id
+        record.update({name: value for name, (value, _) in metrics.items()})
+        print(json.dumps(record, separators=(',', ':')))
+        return record
+
+
+class StageTimer:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.stages[self.name] = self.trace.stages.get(self.name, 0.0) + (time.perf_counter() - self.started) * 1000
+        return False
+
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NoopTrace:
+    enabled = False
+    verbose = False
+    sampled = False
+    request_id = None
+    _null_stage = NullStage()
+
+    def log(self, level, message, **fields):
+        pass
+
+    def debug(self, message, **fields):
+        pass
+
+    def info(self, message, **fields):
+        pass
+
+    def warning(self, message, **fields):
+        pass
+
+    def error(self, message, **fields):
+        print(f"{message} {fields}" if fields else message)
+
+    def stage(self, name):
+        return self._null_stage
+
+    def mark(self, name):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def record_post(self, size, elapsed_ms):
+        pass
+
+    def timed_post(self, post):
+        return post
+
+    def emit(self):
+        return None
+
+
+NOOP_TRACE = NoopTrace()
+
+
+def start_trace(function_name, request_id=None):
+    if os.environ.get('instrumentation') == 'off':
+        return NOOP_TRACE
+    return Trace(function_name, request_id)
@@ -0,0 +1,67 @@
+import os
+import queue
+import threading
+import time
+
+from instrumentation import NOOP_TRACE
+
+
+class DeliveryPipeline:
+    # Bedrock 스트림 읽기와 post_to_connection 전송을 분리한다.
+    # 스트림을 읽는 쪽(호출 스레드)은 submit() 으로 bounded queue 에 넣기만 하고,
+    # sender 스레드 하나가 넣은 순서대로 전송한다. 큐가 가득 차면 submit() 이 대기한다 (backpressure).
+    # 한 연결로 가는 전송은 순서를 지켜야 하므로 sender 를 늘려도 동시에 보낼 수 없다 (연결마다 sender 하나).
+    # 마지막 프레임 (done / cancel) 도 submit() 으로 넣어야 앞서 넣은 델타보다 먼저 가지 않는다.
+    def __init__(self, send, maxsize=None, trace=NOOP_TRACE):
+        if maxsize is None:
+            maxsize = os.environ.get('pipeline_queue_size', 64)
+
+        self.send = send  # send(message, seq)
+        self.trace = trace
+        self.queue = queue.Queue(maxsize=int(maxsize))
+        self.next_seq = 0
+        self.sent = 0
+        self.errors = []
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+
+        self.thread = threading.Thread(target=self._worker, name='sender', daemon=True)
+        self.thread.start()
+
+    def submit(self, message):
+        seq = self.next_seq
+        self.next_seq += 1
+
+        started = time.monotonic()
+        self.queue.put((seq, message))
+        self.blocked_seconds += time.monotonic() - started
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return seq
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            seq, message = item
+            try:
+                self.send(message, seq)
+            except Exception as e:
+                self.trace.error('Pipeline send failed', seq=seq, error=str(e))
+                self.errors.append(e)
+            finally:
+                self.sent += 1
+
+    def close(self):
+        # 남은 메시지를 모두 보낸 뒤 sender 종료
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        return {
+            'submitted': self.next_seq,
+            'sent': self.sent,
+            'errors': len(self.errors),
+            'max_depth': self.max_depth,
+            'blocked_ms': round(self.blocked_seconds * 1000, 1)
+        }
@@ -0,0 +1,29 @@
+from string import Formatter
+
+# langchain PromptTemplate(f-string 형식) 대체. 템플릿은 모듈 로드 시 한 번만 파싱하고,
+# format 은 미리 나눈 조각을 join 한다. {{ }} 이스케이프 지원, 변수에 형식 지정자/속성 접근은 지원하지 않는다.
+
+
+class PromptTemplate:
+    def __init__(self, template, input_variables=None):
+        self.template = template
+        self.parts = []  # (literal, variable 또는 None)
+        variables = []
+        for literal, field, spec, conversion in Formatter().parse(template):
+            if field is not None and (spec or conversion or not field.isidentifier()):
+                raise ValueError(f'unsupported placeholder: {{{field}}}')
+            self.parts.append((literal, field))
+            if field is not None and field not in variables:
+                variables.append(field)
+        self.input_variables = input_variables or variables
+        missing = set(variables) - set(self.input_variables)
+        if missing:
+            raise ValueError(f'template uses undeclared variables: {sorted(missing)}')
+
+    def format(self, **values):
+        pieces = []
+        for literal, field in self.parts:
+            pieces.append(literal)
+            if field is not None:
+                pieces.append(str(values[field]))
+        return ''.join(pieces)
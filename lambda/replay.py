@@ -0,0 +1,164 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import deque
+
+from state_store import get_store
+
+# 끊긴 스트림 이어받기 (stream_replay=1 일 때 사용).
+# 생성 중인 요청은 보낸 프레임 (type, data, seq) 을 최근 replay_max_frames 개까지 링 버퍼에 두고
+# replay_flush_ms 마다 저장소에 기록한다. 연결이 끊겨도 (GoneException) 생성은 계속해서 버퍼에만 쌓는다.
+# 다시 연결한 클라이언트가 resume {requestId, lastSeq} 를 보내면
+#   1) resume 을 받은 Lambda 가 버퍼에서 lastSeq 이후 프레임을 새 연결로 보내고
+#   2) 아직 생성 중이면 redirect 를 기록해, 생성 중인 Lambda 가 이후 프레임을 새 연결로 보낸다.
+# 경계에서 같은 seq 가 두 번 갈 수 있으므로 클라이언트는 seq 로 중복을 버린다.
+# resume 은 원래 연결이거나, sendMessage 때 보낸 resumeKey 를 같이 보낸 연결만 할 수 있다.
+# 버퍼가 lastSeq 다음 프레임부터 갖고 있지 않으면 (링 버퍼에서 밀려남) 이어 보내지 않고 거절한다 (클라이언트가 다시 요청).
+# 연결이 끊긴 생성은 replay_detach_ms 안에 resume 이 없으면 중단한다.
+#
+# 저장소 키
+#   replay:<requestId>    {"frames": [[type, data, seq], ...], "done": bool, "owner": connectionId, "ownerKey": sha256(resumeKey)}
+#   redirect:<requestId>  {"connectionId", "replayedThrough", "settings"}
+
+
+def is_enabled():
+    return os.environ.get('stream_replay') == '1'
+
+
+def replay_key(request_id):
+    return f'replay:{request_id}'
+
+
+def redirect_key(request_id):
+    return f'redirect:{request_id}'
+
+
+def replay_ttl():
+    return int(os.environ.get('replay_ttl', 300))
+
+
+def detach_timeout():
+    return float(os.environ.get('replay_detach_ms', 30000)) / 1000.0
+
+
+def key_digest(resume_key):
+    return hashlib.sha256(resume_key.encode('utf-8')).hexdigest() if resume_key else None
+
+
+class ResumeRejected(Exception):
+    # reason: 'owner' (다른 클라이언트의 요청) / 'gap' (이어 보낼 프레임이 버퍼에 없음)
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class ReplayRecorder:
+    def __init__(self, request_id, connection_id, store=None, max_frames=None, flush_ms=None, resume_key=None):
+        if max_frames is None:
+            max_frames = os.environ.get('replay_max_frames', 256)
+        if flush_ms is None:
+            flush_ms = os.environ.get('replay_flush_ms', 200)
+
+        self.request_id = request_id
+        self.owner = connection_id
+        self.owner_key = key_digest(resume_key)
+        self._store = store
+        self.frames = deque(maxlen=int(max_frames))
+        self.interval = float(flush_ms) / 1000.0
+        self.last_flush = 0.0
+        self.last_poll = 0.0
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    @property
+    def store(self):
+        return self._store or get_store()
+
+    def record(self, frame):
+        with self.lock:
+            self.frames.append(list(frame))
+            self.dirty = True
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self, done=False):
+        with self.lock:
+            if not self.dirty and not done:
+                return
+            frames = list(self.frames)
+            self.dirty = False
+            self.last_flush = time.monotonic()
+        self.store.put(replay_key(self.request_id), {'frames': frames, 'done': done, 'owner': self.owner,
+                                                     'ownerKey': self.owner_key}, ttl=replay_ttl())
+
+    def finish(self):
+        self.flush(done=True)
+
+    def poll_redirect(self, force=False):
+        # 다른 연결에서 resume 했으면 redirect 정보, 아니면 None (interval 마다 한 번만 조회)
+        now = time.monotonic()
+        if not force and now - self.last_poll < self.interval:
+            return None
+        self.last_poll = now
+        return self.store.get(redirect_key(self.request_id))
+
+    def frames_after(self, seq):
+        with self.lock:
+            return [frame for frame in self.frames if frame[2] > seq]
+
+
+def load_replay(request_id, store=None):
+    return (store or get_store()).get(replay_key(request_id))
+
+
+def save_redirect(request_id, connection_id, replayed_through, settings, store=None):
+    (store or get_store()).put(redirect_key(request_id), {
+        'connectionId': connection_id,
+        'replayedThrough': replayed_through,
+        'settings': settings
+    }, ttl=replay_ttl())
+
+
+def is_owner(buffer, connection_id, resume_key):
+    if connection_id == buffer.get('owner'):
+        return True
+    digest = key_digest(resume_key)
+    return bool(digest and buffer.get('ownerKey')) and hmac.compare_digest(digest, buffer['ownerKey'])
+
+
+def resume_stream(request_id, last_seq, connection_id, codec, post, store=None, resume_key=None):
+    # resume 요청 처리. post(connection_id, data). 보낸 프레임 수를 반환하고, 버퍼가 없으면 None
+    # 이어 보낼 수 없으면 (다른 클라이언트 / 버퍼에서 밀려난 프레임) 아무것도 보내지 않고 ResumeRejected
+    store = store or get_store()
+    buffer = load_replay(request_id, store)
+    if buffer is None:
+        return None
+    if not is_owner(buffer, connection_id, resume_key):
+        raise ResumeRejected('owner', 'requestId belongs to another client')
+    if buffer['frames'] and buffer['frames'][0][2] > last_seq + 1:
+        raise ResumeRejected('gap', f"replay buffer starts at seq {buffer['frames'][0][2]}, client has {last_seq}")
+
+    sent = 0
+    replayed_through = last_seq
+
+    def send_after(frames, seq):
+        nonlocal sent, replayed_through
+        for frame_type, data, frame_seq in frames:
+            if frame_seq > seq:
+                post(connection_id, codec.encode(frame_type, data, frame_seq))
+                sent += 1
+                replayed_through = max(replayed_through, frame_seq)
+
+    send_after(buffer['frames'], last_seq)
+    if buffer['done']:
+        return sent
+
+    # 아직 생성 중: 이후 프레임은 생성 중인 Lambda 가 새 연결로 보낸다.
+    # redirect 기록 직후 생성이 끝났을 수도 있으므로 버퍼를 한 번 더 읽어 남은 프레임을 보낸다.
+    save_redirect(request_id, connection_id, replayed_through, codec.settings(), store)
+    buffer = load_replay(request_id, store)
+    if buffer and buffer['done']:
+        send_after(buffer['frames'], replayed_through)
+    return sent
@@ -0,0 +1,86 @@
+import os
+
+np = None  # numpy 는 import 비용이 커서 (cold start) 처음 필요할 때 load_numpy() 로 불러온다
+
+# 검색 결과를 많이 가져온 뒤 (over-fetch) MMR(maximal marginal relevance) 로 다양한 top-k 를 고른다.
+# 임베딩은 외부 호출 없이 글자 n-gram 을 해싱한 벡터를 사용한다.
+
+HASH_PRIME = 1000003
+
+
+def load_numpy():
+    # numpy 가 없는 배포에서는 False (재정렬 없이 상위 결과만 사용)
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+
+def hashed_ngram_vectors(texts, dim=1024, n=3):
+    # 각 텍스트의 글자 n-gram 을 dim 개 버킷으로 해싱해 L2 정규화한 행렬 (len(texts), dim)
+    load_numpy()
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        if len(codes) < n:
+            codes = np.pad(codes, (0, n - len(codes)))
+        hashes = np.zeros(len(codes) - n + 1, dtype=np.uint64)
+        for offset in range(n):
+            hashes = hashes * HASH_PRIME + codes[offset:len(codes) - n + 1 + offset]
+        matrix[row] = np.bincount((hashes % dim).astype(np.int64), minlength=dim)
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr(relevance, similarity, k, diversity=0.3):
+    # relevance: (n,), similarity: (n, n). 선택된 인덱스 목록을 반환
+    load_numpy()
+    n = len(relevance)
+    k = min(k, n)
+    selected = []
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(k):
+        redundancy = np.where(np.isinf(max_sim), 0.0, max_sim)
+        scores = (1.0 - diversity) * relevance - diversity * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_sim = np.maximum(max_sim, similarity[best])
+    return selected
+
+
+def result_uri(result):
+    return result.get('location', {}).get('s3Location', {}).get('uri')
+
+
+def rerank_results(results, top_k, diversity=None, source_penalty=None):
+    if diversity is None:
+        diversity = float(os.environ.get('rerank_diversity', 0.3))
+    if source_penalty is None:
+        source_penalty = float(os.environ.get('rerank_source_penalty', 0.2))
+
+    if len(results) <= top_k or not load_numpy():
+        return results[:top_k]
+
+    texts = [result.get('content', {}).get('text', '') for result in results]
+    vectors = hashed_ngram_vectors(texts)
+    similarity = vectors @ vectors.T
+
+    # 같은 파일의 청크끼리는 내용이 달라도 조금 더 비슷한 것으로 본다
+    uris = np.array([result_uri(result) or '' for result in results])
+    same_source = (uris[:, None] == uris[None, :]) & (uris[:, None] != '')
+    similarity = np.minimum(1.0, similarity + source_penalty * same_source)
+
+    relevance = np.array([result.get('score', 0.0) for result in results], dtype=np.float32)
+    span = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / span if span > 0 else np.ones_like(relevance)
+
+    return [results[i] for i in mmr(relevance, similarity, top_k, diversity)]
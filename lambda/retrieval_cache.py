@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# retrieve_rag 앞단 캐시.
+# 키: 정규화된 질문 + kbId + numberOfResults. 프로세스 내 LRU + TTL,
+# retrieval_cache_shared=1 이면 state_store 를 공유 백엔드로 같이 사용한다 (warm 인스턴스 간 공유).
+
+
+def normalize_query(query):
+    # 전각/반각, 대소문자, 공백, 끝의 물음표 등 차이는 같은 질문으로 본다
+    text = unicodedata.normalize('NFKC', query or '').lower()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip('?!.。？！ ')
+
+
+class RetrievalCache:
+    def __init__(self, maxsize=None, ttl=None, backend=None):
+        if maxsize is None:
+            maxsize = os.environ.get('retrieval_cache_size', 256)
+        if ttl is None:
+            ttl = os.environ.get('retrieval_cache_ttl', 600)
+
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self.backend = backend
+        self.entries = OrderedDict()  # key -> (expires_at, results)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, query, kb_id, number_of_results):
+        raw = json.dumps([normalize_query(query), kb_id, number_of_results], ensure_ascii=False)
+        return 'rag:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if self.maxsize <= 0:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, results = entry
+                if expires_at > time.time():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return results
+                del self.entries[key]
+
+        if self.backend is not None:
+            results = self.backend.get(key)
+            if results is not None:
+                self._put_local(key, results)
+                with self.lock:
+                    self.shared_hits += 1
+                return results
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, results):
+        if self.maxsize <= 0:
+            return
+        self._put_local(key, results)
+        if self.backend is not None:
+            self.backend.put(key, results, ttl=self.ttl)
+
+    def _put_local(self, key, results):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, results)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        # 로컬 엔트리만 비운다. 공유 백엔드 엔트리는 TTL 로 만료된다.
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.shared_hits) / lookups, 3) if lookups else 0.0
+            }
+
+
+def create_retrieval_cache():
+    backend = None
+    if os.environ.get('retrieval_cache_shared') == '1':
+        from state_store import get_store
+        backend = get_store()
+    return RetrievalCache(backend=backend)
@@ -0,0 +1,323 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from botocore.config import Config
+
+from instrumentation import NOOP_TRACE
+from rerank import hashed_ngram_vectors, load_numpy
+
+# 검색 백엔드
+#   KnowledgeBaseRetriever : Bedrock Knowledge Base retrieve (네트워크 호출)
+#   LocalIndexRetriever    : build_local_index.py 로 미리 만든 임베딩 행렬(mmap) + 메타데이터, NumPy 내적 top-k
+#   FallbackRetriever      : 로컬 인덱스 우선, 결과가 없거나 최고 점수가 기준 미만이거나 실패하면 KB
+#   FanOutRetriever        : 질문 변형 x KB 목록을 스레드 풀에서 동시에 검색해 점수순으로 병합
+#                            (retrieve_batch 가 있는 retriever 는 질문 변형 전체를 한 branch 에서 한 번에)
+# 결과 형식은 모두 KB retrieve 의 retrievalResults 와 같다. trace 는 요청 단위 로그 (instrumentation.py)
+
+
+class KnowledgeBaseRetriever:
+    def __init__(self, kb_id, client):
+        self.kb_id = kb_id
+        self.client = client
+        self.name = f'kb:{kb_id}'
+
+    def retrieve(self, query, number_of_results, trace=NOOP_TRACE):
+        response = self.client.retrieve(
+            retrievalQuery={'text': query},
+            knowledgeBaseId=self.kb_id,
+            retrievalConfiguration={
+                'vectorSearchConfiguration': {
+                    'numberOfResults': number_of_results,
+                    # 'overrideSearchType': "HYBRID", # optional
+                }
+            }
+        )
+        return response['retrievalResults']
+
+
+class LocalIndex:
+    # 인덱스 디렉터리 구성 (build_local_index.py 참고)
+    #   embeddings.npy      float32 (N, dim), L2 정규화
+    #   metadata.jsonl      행마다 {"text", "uri"}
+    #   ivf_centroids.npy   (선택) float32 (nlist, dim)
+    #   ivf_assign.npy      (선택) int32 (N,) 각 행의 centroid 번호
+    def __init__(self, path):
+        import numpy as np
+        self.path = path
+        self.embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'metadata.jsonl'), encoding='utf-8') as f:
+            self.metadata = [json.loads(line) for line in f]
+        self.dim = self.embeddings.shape[1]
+
+        self.centroids = None
+        self.lists = None
+        centroid_path = os.path.join(path, 'ivf_centroids.npy')
+        if os.path.exists(centroid_path):
+            self.centroids = np.load(centroid_path)
+            assign = np.load(os.path.join(path, 'ivf_assign.npy'))
+            order = np.argsort(assign, kind='stable')
+            bounds = np.searchsorted(assign[order], np.arange(len(self.centroids) + 1))
+            self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def search(self, queries, k, nprobe=None):
+        # queries: 질문 목록. 질문별 [(row, score)] 를 반환
+        import numpy as np
+        vectors = hashed_ngram_vectors(queries, dim=self.dim)
+        if self.centroids is None or not nprobe:
+            scores = vectors @ np.asarray(self.embeddings).T
+            return [self._top_k(np.arange(scores.shape[1]), row, k) for row in scores]
+
+        # IVF: 가까운 nprobe 개 파티션만 검색
+        probes = np.argsort(-(vectors @ self.centroids.T), axis=1)[:, :nprobe]
+        hits = []
+        for vector, probe in zip(vectors, probes):
+            rows = np.concatenate([self.lists[p] for p in probe])
+            hits.append(self._top_k(rows, np.asarray(self.embeddings[rows]) @ vector, k))
+        return hits
+
+    def _top_k(self, rows, scores, k):
+        import numpy as np
+        if len(rows) == 0:
+            return []
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def load_index(path):
+    # warm invocation 동안 메모리에 유지 (처음 검색할 때 로드)
+    with _index_lock:
+        if path not in _indexes:
+            _indexes[path] = LocalIndex(path)
+        return _indexes[path]
+
+
+class LocalIndexRetriever:
+    name = 'local'
+
+    def __init__(self, path, nprobe=None, min_score=None, fallback_score=None):
+        if nprobe is None:
+            nprobe = int(os.environ.get('local_index_nprobe', 0))
+        if min_score is None:
+            min_score = os.environ.get('local_index_min_score', 0.2)
+        if fallback_score is None:
+            fallback_score = os.environ.get('local_index_fallback_score', min_score)
+        self.path = path
+        self.nprobe = nprobe
+        self.min_score = float(min_score)  # 이보다 낮은 결과는 버린다
+        self.fallback_score = float(fallback_score)  # 최고 점수가 이보다 낮으면 FallbackRetriever 가 KB 를 쓴다
+        self.unavailable = None  # 처음 검색할 때 확인. 사용할 수 없으면 이유 문자열
+
+    def available(self, trace=NOOP_TRACE):
+        # numpy 와 인덱스 파일은 처음 검색할 때 확인한다 (server.py import 시 numpy 를 불러오지 않도록)
+        if self.unavailable is None:
+            if not load_numpy():
+                self.unavailable = 'numpy not installed'
+            elif not os.path.exists(os.path.join(self.path, 'embeddings.npy')):
+                self.unavailable = 'index not found'
+            else:
+                self.unavailable = ''
+            if self.unavailable:
+                trace.warning('Local index unavailable', path=self.path, reason=self.unavailable)
+        return not self.unavailable
+
+    def retrieve(self, query, number_of_results, trace=NOOP_TRACE):
+        return self.retrieve_batch([query], number_of_results, trace)[0]
+
+    def retrieve_batch(self, queries, number_of_results, trace=NOOP_TRACE):
+        if not self.available(trace):
+            return [[] for _ in queries]
+        index = load_index(self.path)
+        batches = []
+        for hits in index.search(queries, number_of_results, self.nprobe):
+            results = []
+            for row, score in hits:
+                if score < self.min_score:
+                    continue
+                meta = index.metadata[row]
+                results.append({
+                    'content': {'text': meta['text']},
+                    'location': {'type': 'S3', 's3Location': {'uri': meta['uri']}},
+                    'score': score,
+                    'retriever': self.name
+                })
+            batches.append(results)
+        return batches
+
+
+class FallbackRetriever:
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = fallback.name
+
+    def batchable(self, trace=NOOP_TRACE):
+        # primary 를 쓸 수 없으면 (로컬 인덱스 없음) 질문마다 fallback branch 로 나눠 동시에 검색한다
+        return getattr(self.primary, 'available', lambda trace: True)(trace)
+
+    def confident(self, results, trace=NOOP_TRACE):
+        # 결과가 있고 최고 점수가 primary 의 fallback_score 이상이면 그대로 쓴다
+        best = max((result.get('score', 0.0) for result in results), default=None)
+        if best is not None and best >= getattr(self.primary, 'fallback_score', float('-inf')):
+            return True
+        trace.debug('Retriever results below threshold, falling back', retriever=self.primary.name,
+                    fallback=self.fallback.name, best=best)
+        return False
+
+    def retrieve(self, query, number_of_results, trace=NOOP_TRACE):
+        try:
+            results = self.primary.retrieve(query, number_of_results, trace)
+            if self.confident(results, trace):
+                return results
+        except Exception as e:
+            trace.warning('Retriever failed, falling back', retriever=self.primary.name, fallback=self.fallback.name,
+                          error=str(e))
+        return self.fallback.retrieve(query, number_of_results, trace)
+
+    def retrieve_batch(self, queries, number_of_results, trace=NOOP_TRACE):
+        # primary 는 한 번에, 결과가 없거나 점수가 낮은 질문만 fallback 으로 (드문 경우라 순서대로)
+        try:
+            batches = self.primary.retrieve_batch(queries, number_of_results, trace)
+        except Exception as e:
+            trace.warning('Retriever failed, falling back', retriever=self.primary.name, fallback=self.fallback.name,
+                          error=str(e))
+            batches = [[] for _ in queries]
+        return [results if self.confident(results, trace) else self.fallback.retrieve(query, number_of_results, trace)
+                for query, results in zip(queries, batches)]
+
+
+_fan_out_pool = None
+_fan_out_lock = threading.Lock()
+
+
+def fan_out_pool():
+    # warm invocation 사이에 재사용. 시간 초과로 버린 branch 가 끝날 때까지 worker 를 점유하므로 여유 있게 둔다
+    global _fan_out_pool
+    with _fan_out_lock:
+        if _fan_out_pool is None:
+            _fan_out_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('fan_out_workers', 8)),
+                                               thread_name_prefix='retrieve')
+        return _fan_out_pool
+
+
+def result_key(result):
+    return (result.get('location', {}).get('s3Location', {}).get('uri'), result.get('content', {}).get('text'))
+
+
+def merge_results(batches, number_of_results):
+    # 같은 파일의 같은 청크는 높은 점수 하나만 남기고 점수순 상위 number_of_results 개
+    merged = {}
+    for results in batches:
+        for result in results:
+            key = result_key(result)
+            if key not in merged or result.get('score', 0.0) > merged[key].get('score', 0.0):
+                merged[key] = result
+    return sorted(merged.values(), key=lambda result: result.get('score', 0.0), reverse=True)[:number_of_results]
+
+
+def fan_out_timeout_ms():
+    return float(os.environ.get('fan_out_timeout_ms', 3000))
+
+
+def kb_client_config(timeout_ms=None):
+    # 시간 초과로 버린 branch 도 소켓 timeout 이 지나면 끝나 worker 를 돌려준다 (future.cancel() 은 실행 중인 branch 를 멈추지 못한다)
+    if timeout_ms is None:
+        timeout_ms = fan_out_timeout_ms()
+    timeout = float(timeout_ms) / 1000.0
+    return Config(connect_timeout=timeout, read_timeout=timeout, retries={'max_attempts': 0})
+
+
+class FanOutRetriever:
+    def __init__(self, retrievers, timeout_ms=None):
+        if timeout_ms is None:
+            timeout_ms = fan_out_timeout_ms()
+        self.retrievers = retrievers
+        self.timeout = float(timeout_ms) / 1000.0
+
+    def retrieve(self, query, number_of_results, trace=NOOP_TRACE):
+        return self.retrieve_all([query], number_of_results, trace)
+
+    def branches(self, queries, trace=NOOP_TRACE):
+        # retrieve_batch 가 있는 retriever (로컬 인덱스) 는 질문 전체가 branch 하나 (행렬 곱 한 번), 나머지는 질문마다
+        branches = []
+        for retriever in self.retrievers:
+            batchable = getattr(retriever, 'batchable', lambda trace: True)
+            if len(queries) > 1 and hasattr(retriever, 'retrieve_batch') and batchable(trace):
+                branches.append((retriever, list(queries)))
+            else:
+                branches.extend((retriever, [query]) for query in queries)
+        return branches
+
+    def retrieve_all(self, queries, number_of_results, trace=NOOP_TRACE):
+        branches = self.branches(queries, trace)
+        if len(branches) == 1 and len(branches[0][1]) == 1:
+            retriever, [query] = branches[0]
+            return retriever.retrieve(query, number_of_results, trace)
+
+        # 모든 branch 를 동시에 시작하므로 전체 지연은 가장 느린 branch (최대 timeout) 로 제한된다
+        started = time.monotonic()
+        pool = fan_out_pool()
+        futures = {pool.submit(run_branch, retriever, branch_queries, number_of_results, trace): (retriever, branch_queries)
+                   for retriever, branch_queries in branches}
+        done, pending = wait(futures, timeout=self.timeout)
+
+        batches = []
+        errors = []
+        succeeded = 0
+        for future in done:
+            retriever, branch_queries = futures[future]
+            try:
+                batches.extend(future.result())
+                succeeded += 1
+            except Exception as e:
+                trace.warning('Retrieval branch failed', retriever=retriever.name, queries=branch_queries, error=str(e))
+                errors.append(e)
+        for future in pending:
+            retriever, branch_queries = futures[future]
+            future.cancel()  # 아직 시작하지 않은 branch 만 취소된다. 실행 중인 KB 호출은 kb_client_config 의 timeout 으로 끝난다
+            trace.warning('Retrieval branch timed out', retriever=retriever.name, queries=branch_queries)
+
+        trace.debug('Fan-out retrieval', branches=len(branches), succeeded=succeeded,
+                    ms=round((time.monotonic() - started) * 1000))
+        if not succeeded:
+            if errors:
+                raise errors[0]
+            raise TimeoutError(f'all {len(branches)} retrieval branches timed out')
+        return merge_results(batches, number_of_results)
+
+
+def run_branch(retriever, queries, number_of_results, trace=NOOP_TRACE):
+    # 질문별 결과 목록
+    if len(queries) == 1:
+        return [retriever.retrieve(queries[0], number_of_results, trace)]
+    return retriever.retrieve_batch(queries, number_of_results, trace)
+
+
+def min_score_for(result, default):
+    # 로컬 인덱스 점수(해싱 n-gram 코사인)는 KB 점수와 척도가 달라 자체 기준 (min_score) 으로 이미 걸러져 있다
+    if result.get('retriever') == LocalIndexRetriever.name:
+        return float('-inf')
+    return default
+
+
+def create_retriever(kb_id, client, local=True):
+    # local_index_path 가 있으면 로컬 인덱스 우선, KB 는 fallback
+    # numpy / 인덱스 파일 확인과 로드는 첫 검색 때 (없으면 KB 만 사용)
+    retriever = KnowledgeBaseRetriever(kb_id, client)
+    path = os.environ.get('local_index_path')
+    if local and path:
+        retriever = FallbackRetriever(LocalIndexRetriever(path), retriever)
+    return retriever
+
+
+def create_fan_out(kb_ids, client):
+    # 로컬 인덱스는 첫 번째 (기본) KB 문서로 만든 것이므로 첫 KB 에만 붙인다
+    return FanOutRetriever([create_retriever(kb_id, client, local=(i == 0)) for i, kb_id in enumerate(kb_ids)])
@@ -0,0 +1,247 @@
+import json
+import os
+import random
+import threading
+import time
+
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from client_pool import get_client
+from context_packer import estimate_tokens
+from instrumentation import NOOP_TRACE
+
+# Bedrock 모델 선택 / 재시도 / 장애 조치.
+#
+# 정책 (model_policy, JSON) 은 프롬프트 크기별 단계 목록이다. 예상 입력 토큰이 maxPromptTokens 이하인 첫 단계를 쓰고,
+# 단계마다 max_tokens 와 route ("<modelId>@<region>", region 생략 시 us-east-1) 목록을 정한다.
+#   [{"maxPromptTokens": 2000, "maxTokens": 512, "routes": ["anthropic.claude-3-haiku-20240307-v1:0"]},
+#    {"maxTokens": 1024, "routes": ["anthropic.claude-3-haiku-20240307-v1:0", "anthropic.claude-3-sonnet-20240229-v1:0"]}]
+# model_fallback_routes (쉼표 구분) 는 모든 단계 뒤에 붙는 예비 route 다 (다른 리전 등).
+#
+# 스트림은 첫 델타가 나올 때까지만 재시도한다 (클라이언트가 받은 내용이 없을 때만).
+#   - throttling 계열 오류: 그 route 를 model_throttle_cooldown_ms 동안 뒤로 미루고 바로 다음 route 로
+#   - timeout / 연결 오류 / 5xx: 지터를 준 지수 백오프 후 다시 (route 가 더 있으면 다음 route)
+#   - 그 외 (ValidationException 등): 재시도하지 않음
+# route 별 첫 델타까지 시간 (EWMA) 과 오류 수를 컨테이너 안에 남겨 다음 선택 순서에 반영한다.
+
+DEFAULT_MODEL = 'anthropic.claude-3-haiku-20240307-v1:0'
+DEFAULT_REGION = 'us-east-1'
+DEFAULT_POLICY = [{'maxTokens': 512, 'routes': [DEFAULT_MODEL]}]
+
+THROTTLE_CODES = {'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException',
+                  'ModelNotReadyException', 'ServiceUnavailableException'}
+RETRYABLE_CODES = THROTTLE_CODES | {'ModelTimeoutException', 'InternalServerException', 'ModelStreamErrorException',
+                                    'InternalFailure', 'ServiceUnavailable', 'RequestTimeout'}
+
+# 재시도는 router 만 한다 (botocore 기본 재시도가 겹치면 throttle 한 번에 여러 번 호출되고 장애 조치가 늦어진다)
+NO_RETRY_CONFIG = Config(retries={'max_attempts': 0})
+
+
+def parse_route(text):
+    model_id, _, region = text.strip().partition('@')
+    return (model_id, region or DEFAULT_REGION)
+
+
+def route_name(route):
+    return f'{route[0]}@{route[1]}'
+
+
+def error_code(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code', 'ClientError')
+    return type(error).__name__
+
+
+def is_throttle(error):
+    return error_code(error) in THROTTLE_CODES
+
+
+def is_retryable(error):
+    # BotoCoreError 는 timeout / 연결 오류 (ReadTimeoutError, EndpointConnectionError 등)
+    return isinstance(error, BotoCoreError) or error_code(error) in RETRYABLE_CODES
+
+
+class RouteStats:
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.ttft_ms = None
+        self.calls = 0
+        self.errors = 0
+        self.throttles = 0
+        self.error_rate = 0.0  # 최근 호출 기준 (EWMA)
+        self.cooldown_until = 0.0
+
+    def success(self, ttft_ms):
+        self.calls += 1
+        self.ttft_ms = ttft_ms if self.ttft_ms is None else self.ttft_ms + self.alpha * (ttft_ms - self.ttft_ms)
+        self.error_rate -= self.alpha * self.error_rate
+
+    def failure(self, throttled, cooldown):
+        self.calls += 1
+        self.errors += 1
+        self.error_rate += self.alpha * (1 - self.error_rate)
+        if throttled:
+            self.throttles += 1
+            self.cooldown_until = time.monotonic() + cooldown
+
+    def cooling(self):
+        return time.monotonic() < self.cooldown_until
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'throttles': self.throttles,
+            'error_rate': round(self.error_rate, 3),
+            'ttft_ms': round(self.ttft_ms, 1) if self.ttft_ms is not None else None,
+            'cooling': self.cooling()
+        }
+
+
+class Plan:
+    def __init__(self, max_tokens, routes, model_id):
+        self.max_tokens = max_tokens
+        self.routes = routes  # 시도할 순서
+        self.model_id = model_id  # 단계의 기본 모델. completion cache 키 등에 사용 (장애 조치로 바뀌어도 같은 답변으로 본다)
+
+
+class RoutedStream:
+    # 첫 델타까지 미리 읽은 이벤트를 먼저 내보내고 나머지 스트림을 이어서 읽는다
+    def __init__(self, route, buffered, events, body):
+        self.route = route
+        self.buffered = buffered
+        self.events = events
+        self.body = body
+
+    def __iter__(self):
+        for event in self.buffered:
+            yield event
+        for event in self.events:
+            yield event
+
+    def close(self):
+        close = getattr(self.body, 'close', None)
+        if close:
+            close()
+
+
+class ModelRouter:
+    def __init__(self, policy=None, fallback_routes=None, max_attempts=None, retry_base_ms=None, retry_max_ms=None,
+                 cooldown_ms=None, client_for=None):
+        if policy is None:
+            policy = json.loads(os.environ['model_policy']) if os.environ.get('model_policy') else DEFAULT_POLICY
+        if fallback_routes is None:
+            fallback_routes = [r for r in os.environ.get('model_fallback_routes', '').split(',') if r.strip()]
+        if max_attempts is None:
+            max_attempts = os.environ.get('model_max_attempts', 3)
+        if retry_base_ms is None:
+            retry_base_ms = os.environ.get('model_retry_base_ms', 200)
+        if retry_max_ms is None:
+            retry_max_ms = os.environ.get('model_retry_max_ms', 2000)
+        if cooldown_ms is None:
+            cooldown_ms = os.environ.get('model_throttle_cooldown_ms', 10000)
+
+        fallbacks = [parse_route(r) for r in fallback_routes]
+        self.tiers = []
+        for tier in policy:
+            routes = [parse_route(r) for r in tier['routes']]
+            routes += [r for r in fallbacks if r not in routes]
+            limit = tier.get('maxPromptTokens')
+            self.tiers.append((float('inf') if limit is None else int(limit), int(tier.get('maxTokens', 512)), routes))
+        self.max_attempts = int(max_attempts)
+        self.retry_base = float(retry_base_ms) / 1000.0
+        self.retry_max = float(retry_max_ms) / 1000.0
+        self.cooldown = float(cooldown_ms) / 1000.0
+        self.client_for = client_for or (
+            lambda region: get_client('bedrock-runtime', region_name=region, config=NO_RETRY_CONFIG))
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def route_stats(self, route):
+        with self.lock:
+            if route not in self.stats:
+                self.stats[route] = RouteStats()
+            return self.stats[route]
+
+    def plan(self, prompt_text, extra_tokens=0):
+        # extra_tokens: 아직 조립하지 않은 부분 (RAG context 예산 등)
+        prompt_tokens = estimate_tokens(prompt_text) + int(extra_tokens)
+        for limit, max_tokens, routes in self.tiers:
+            if prompt_tokens <= limit:
+                return Plan(max_tokens, self.order(routes), routes[0][0])
+        _, max_tokens, routes = self.tiers[-1]
+        return Plan(max_tokens, self.order(routes), routes[0][0])
+
+    def order(self, routes):
+        # throttle 직후인 route, 최근 오류가 많은 route, 다른 route 보다 두 배 이상 느린 route 순으로 뒤로
+        stats = [self.route_stats(route) for route in routes]
+        known = [s.ttft_ms for s in stats if s.ttft_ms is not None]
+        fastest = min(known) if known else None
+
+        def rank(index):
+            s = stats[index]
+            slow = fastest is not None and s.ttft_ms is not None and s.ttft_ms > 2 * fastest
+            return (s.cooling(), s.error_rate >= 0.5, slow, index)
+        return [routes[i] for i in sorted(range(len(routes)), key=rank)]
+
+    def backoff(self, attempt):
+        # full jitter
+        return random.uniform(0, min(self.retry_max, self.retry_base * (2 ** attempt)))
+
+    def open_stream(self, plan, body, trace=NOOP_TRACE, client=None):
+        # 첫 content_block_delta 까지 읽은 RoutedStream 을 반환. 모든 시도가 실패하면 마지막 오류를 raise
+        # client 를 주면 (로컬 테스트의 fake) 모든 리전에 그 클라이언트를 쓴다
+        last_error = None
+        routes = list(plan.routes)
+        index = 0
+        for attempt in range(self.max_attempts):
+            route = routes[index % len(routes)]
+            started = time.perf_counter()
+            try:
+                stream = self.first_delta(route, body, client)
+                self.route_stats(route).success((time.perf_counter() - started) * 1000)
+                if attempt:
+                    trace.info('Bedrock stream opened after retry', route=route_name(route), attempt=attempt + 1)
+                return stream
+            except (BotoCoreError, ClientError) as error:
+                last_error = error
+                throttled = is_throttle(error)
+                self.route_stats(route).failure(throttled, self.cooldown)
+                trace.count('model_throttles' if throttled else 'model_errors')
+                trace.warning('Bedrock attempt failed', route=route_name(route), attempt=attempt + 1, code=error_code(error))
+                if not is_retryable(error):
+                    raise
+                index += 1
+                # throttle 이고 아직 안 쓴 route 가 있으면 기다리지 않고 바로 다음 route
+                if throttled and index < len(routes):
+                    continue
+                if attempt + 1 < self.max_attempts:
+                    time.sleep(self.backoff(attempt))
+        raise last_error
+
+    def first_delta(self, route, body, client=None):
+        model_id, region = route
+        response = (client or self.client_for(region)).invoke_model_with_response_stream(
+            modelId=model_id,
+            contentType="application/json",
+            body=body
+        )
+        event_stream = response['body']
+        events = iter(event_stream)
+        buffered = []
+        # 스트림 중간 오류 (EventStreamError) 도 첫 델타 전이면 여기서 raise 되어 재시도된다.
+        # 실패한 시도의 응답은 닫아서 HTTP 연결을 풀에 돌려준다
+        try:
+            for event in events:
+                buffered.append(event)
+                if 'chunk' in event and json.loads(event['chunk']['bytes']).get('type') == 'content_block_delta':
+                    break
+        except Exception:
+            RoutedStream(route, buffered, events, event_stream).close()
+            raise
+        return RoutedStream(route, buffered, events, event_stream)
+
+    def snapshot(self):
+        with self.lock:
+            return {route_name(route): stats.as_dict() for route, stats in self.stats.items()}
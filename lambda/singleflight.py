@@ -0,0 +1,208 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from frames import codec_from_settings
+from instrumentation import NOOP_TRACE
+from retrieval_cache import normalize_query
+from state_store import get_store
+
+# 동시에 들어온 같은 질문을 한 번만 생성하는 single-flight (single_flight=1 일 때 사용).
+# 처음 들어온 요청이 leader 가 되어 retrieval / Bedrock 스트림을 실행하고,
+# 이후 요청(follower)은 자기 connectionId 를 구독자로 등록만 하고 바로 반환한다.
+# leader 는 전송할 때마다 구독자 목록을 주기적으로 다시 읽어 새 구독자에게는 지금까지 보낸 메시지를 먼저 보낸다.
+#
+# 저장소 키
+#   flight:<key>          leader 정보 {"leader", "started", "id"} (있으면 진행 중)
+#   flight:<key>:subs     follower connectionId 집합
+#   flight:<key>:cancel   cancel 라우트로 구독을 해제한 follower 집합 (leader 가 done {reason: cancelled} 를 보낸다)
+#   flightof:<connId>     connection 이 구독 중인 flight 와 프레임 설정 (requestId, protocol)
+#   served:<flight id>    끝난 flight 가 마지막으로 전송한 connectionId 목록
+#
+# 프레임은 (type, data, seq) 로 받아 구독자마다 자기 프레임 형식으로 인코딩한다.
+# follower 가 등록하는 사이에 leader 가 끝나면, served 목록에 있을 때만 (이미 전부 받음) 새 flight 를 시작하지 않는다.
+
+FLIGHT_TTL = 300
+SERVED_WAIT = 1.0  # 끝나는 중인 flight 의 served 목록을 기다리는 최대 시간 (초)
+
+
+def flight_key(prompt):
+    return hashlib.sha256(normalize_query(prompt).encode('utf-8')).hexdigest()
+
+
+def is_gone(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') == 'GoneException'
+
+
+class Flight:
+    def __init__(self, group, key, leader_id, post, codec, flight_id=None, trace=NOOP_TRACE):
+        self.group = group
+        self.key = key
+        self.flight_id = flight_id
+        self.trace = trace
+        self.leader_id = leader_id
+        self.post = post  # post(connection_id, data)
+        self.targets = [leader_id]
+        self.codecs = {leader_id: codec}
+        self.dropped = set()
+        self.backlog = []
+        self.last_refresh = time.monotonic()
+        self.lock = threading.Lock()
+
+    def deliver(self, frame):
+        # 모든 구독자에게 전송. 남은 구독자가 없으면 False
+        self.refresh()
+        with self.lock:
+            self.backlog.append(frame)
+            targets = list(self.targets)
+        for connection_id in targets:
+            self._post(connection_id, frame)
+        return self.alive()
+
+    def _post(self, connection_id, frame):
+        try:
+            self.post(connection_id, self.codecs[connection_id].encode(*frame))
+        except ClientError as e:
+            self.trace.error('Failed to send message to client', connectionId=connection_id, error=str(e))
+            if is_gone(e):
+                self.drop(connection_id)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_refresh < self.group.refresh_interval:
+            return
+        self.last_refresh = now
+
+        members = self.group.store.members(self.group.subs_key(self.key))
+        with self.lock:
+            joined = [c for c in members if c not in self.targets and c not in self.dropped]
+            # disconnect_lambda 가 구독을 해제한 follower 는 대상에서 제외
+            left = [c for c in self.targets if c != self.leader_id and c not in members]
+            backlog = list(self.backlog)
+        if left:
+            # cancel 로 나간 follower 에게는 지금까지 보낸 프레임 다음 seq 로 done 을 보낸다 (끊긴 연결은 그냥 제외)
+            cancelled = self.group.store.members(self.group.cancel_key(self.key))
+            seq = backlog[-1][2] + 1 if backlog else 0
+            for connection_id in left:
+                if connection_id in cancelled:
+                    self._post(connection_id, ('done', {'reason': 'cancelled'}, seq))
+                self.drop(connection_id)
+        for connection_id in joined:
+            member = self.group.store.get(self.group.member_key(connection_id)) or {}
+            with self.lock:
+                self.codecs[connection_id] = codec_from_settings(member.get('settings'))
+                self.targets.append(connection_id)
+            # 늦게 들어온 follower 는 지금까지 보낸 메시지부터 받는다
+            for frame in backlog:
+                if connection_id in self.dropped:
+                    break
+                self._post(connection_id, frame)
+
+    def drop(self, connection_id):
+        with self.lock:
+            if connection_id in self.targets:
+                self.targets.remove(connection_id)
+            self.dropped.add(connection_id)
+        if connection_id != self.leader_id:
+            self.group.store.remove_member(self.group.subs_key(self.key), connection_id)
+
+    def alive(self):
+        with self.lock:
+            return bool(self.targets)
+
+    def close(self):
+        # flight 종료. leader 키를 먼저 지운 뒤 마지막으로 구독자를 읽어 늦게 들어온 follower 에게도 전달하고,
+        # 전달한 connection 을 served 목록에 남긴다 (그 사이 등록한 follower 가 다시 생성하지 않도록)
+        store = self.group.store
+        store.delete(self.group.flight_key(self.key))
+        self.refresh(force=True)
+        with self.lock:
+            served = list(self.targets) + list(self.dropped)
+        if self.flight_id:
+            store.put(self.group.served_key(self.flight_id), sorted(served), ttl=FLIGHT_TTL)
+        store.delete(self.group.subs_key(self.key))
+        store.delete(self.group.cancel_key(self.key))
+        for connection_id in served:
+            store.delete(self.group.member_key(connection_id))
+
+
+class SingleFlight:
+    def __init__(self, enabled=None, store=None, refresh_ms=None):
+        if enabled is None:
+            enabled = os.environ.get('single_flight') == '1'
+        if refresh_ms is None:
+            refresh_ms = os.environ.get('single_flight_refresh_ms', 100)
+
+        self.enabled = enabled
+        self._store = store
+        self.refresh_interval = float(refresh_ms) / 1000.0
+
+    @property
+    def store(self):
+        return self._store or get_store()
+
+    def flight_key(self, key):
+        return f'flight:{key}'
+
+    def subs_key(self, key):
+        return f'flight:{key}:subs'
+
+    def cancel_key(self, key):
+        return f'flight:{key}:cancel'
+
+    def member_key(self, connection_id):
+        return f'flightof:{connection_id}'
+
+    def served_key(self, flight_id):
+        return f'served:{flight_id}'
+
+    def join(self, key, connection_id, post, codec, trace=NOOP_TRACE):
+        # leader 면 Flight, follower 로 등록되었으면 None
+        store = self.store
+        flight_id = uuid.uuid4().hex
+        while True:
+            if store.add(self.flight_key(key), {'leader': connection_id, 'started': time.time(), 'id': flight_id},
+                         ttl=FLIGHT_TTL):
+                return Flight(self, key, connection_id, post, codec, flight_id, trace)
+            current = store.get(self.flight_key(key))
+            if current is None:
+                continue
+
+            store.put(self.member_key(connection_id), {'key': key, 'settings': codec.settings()}, ttl=FLIGHT_TTL)
+            store.add_member(self.subs_key(key), connection_id, ttl=FLIGHT_TTL)
+            latest = store.get(self.flight_key(key))
+            if latest is not None and latest.get('id') == current.get('id'):
+                return None
+
+            # 등록 직후 leader 가 끝났으면 마지막 전송에 포함됐는지 확인하고, 아니면 새 flight 의 leader 를 시도한다
+            store.remove_member(self.subs_key(key), connection_id)
+            if connection_id in self.served(current.get('id')):
+                return None
+
+    def served(self, flight_id):
+        # 끝난 flight 가 전달한 connection 목록. close() 가 기록할 때까지 잠깐 기다린다 (leader 가 죽었으면 빈 목록)
+        if not flight_id:
+            return set()
+        deadline = time.monotonic() + SERVED_WAIT
+        while True:
+            served = self.store.get(self.served_key(flight_id))
+            if served is not None:
+                return set(served)
+            if time.monotonic() >= deadline:
+                return set()
+            time.sleep(0.01)
+
+    def leave(self, connection_id, cancelled=False):
+        # disconnect / cancel 시 구독 해제. leader 는 다음 refresh 에서 대상에서 제외한다.
+        # cancelled 면 leader 가 제외하면서 done {reason: cancelled} 를 보낸다
+        store = self.store
+        member = store.get(self.member_key(connection_id))
+        if member is not None:
+            if cancelled:
+                store.add_member(self.cancel_key(member['key']), connection_id, ttl=FLIGHT_TTL)
+            store.remove_member(self.subs_key(member['key']), connection_id)
+            store.delete(self.member_key(connection_id))
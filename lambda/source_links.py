@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from client_pool import get_client
+from instrumentation import NOOP_TRACE
+
+# 검색 결과의 S3 URI 로 응답 끝의 "📚 출처" 링크를 만든다.
+#   source_link_mode=public    https://<bucket>.s3.amazonaws.com/<key> (기본값, 서명 없음)
+#   source_link_mode=presigned 공유 S3 클라이언트로 서명한 임시 URL. (bucket, key) 별로 캐시하고
+#                              ExpiresIn - source_link_margin 초가 지나면 다시 서명한다.
+# 같은 파일명은 링크를 만들기 전에 한 번만 남긴다.
+
+FOOTER_HEADER = "\n\n📚 출처\n"
+
+
+def split_uri(uri):
+    bucket_name, key = uri.replace('s3://', '').split('/', 1)
+    return bucket_name, key
+
+
+def public_url(bucket_name, key):
+    return f"https://{bucket_name}.s3.amazonaws.com/{urllib.parse.quote(key)}"
+
+
+def unique_uris(retrieval_results):
+    # 파일명 기준 중복 제거 (처음 나온 URI 유지)
+    uris = []
+    seen = set()
+    for result in retrieval_results:
+        uri = result.get('location', {}).get('s3Location', {}).get('uri')
+        if not uri:
+            continue
+        file_name = uri.split('/')[-1]
+        if file_name not in seen:
+            seen.add(file_name)
+            uris.append(uri)
+    return uris
+
+
+class SourceLinks:
+    def __init__(self, mode=None, expires_in=None, margin=None, maxsize=None, client=None):
+        if mode is None:
+            mode = os.environ.get('source_link_mode', 'public')
+        if expires_in is None:
+            expires_in = os.environ.get('source_link_expires', 3600)
+        if margin is None:
+            margin = os.environ.get('source_link_margin', 300)
+        if maxsize is None:
+            maxsize = os.environ.get('source_link_cache_size', 1024)
+
+        self.mode = mode
+        self.expires_in = int(expires_in)
+        self.margin = min(float(margin), self.expires_in / 2)
+        self.maxsize = int(maxsize)
+        self.client = client
+        self.entries = OrderedDict()  # (bucket, key) -> (reuse_until, url)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.signed = 0
+
+    def s3(self):
+        return self.client or get_client('s3')
+
+    def presigned_url(self, bucket_name, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get((bucket_name, key))
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end((bucket_name, key))
+                self.hits += 1
+                return entry[1]
+
+        url = self.s3().generate_presigned_url(
+            ClientMethod='get_object',
+            Params={
+                'Bucket': bucket_name,
+                'Key': key
+            },
+            ExpiresIn=self.expires_in  # 유효 기간(초)
+        )
+        with self.lock:
+            self.signed += 1
+            self.entries[(bucket_name, key)] = (now + self.expires_in - self.margin, url)
+            self.entries.move_to_end((bucket_name, key))
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return url
+
+    def link(self, uri, mode=None, trace=NOOP_TRACE):
+        try:
+            bucket_name, key = split_uri(uri)
+            if (mode or self.mode) == 'presigned':
+                return self.presigned_url(bucket_name, key)
+            return public_url(bucket_name, key)
+        except (ValueError, ClientError, BotoCoreError) as e:
+            trace.warning('Failed to build source link', uri=uri, error=str(e))
+            return None
+
+    def links(self, uris, trace=NOOP_TRACE):
+        return [(uri, self.link(uri, trace=trace)) for uri in uris]
+
+    def footer(self, retrieval_results, trace=NOOP_TRACE):
+        entries = [f"{uri.split('/')[-1]} ({url})" for uri, url in self.links(unique_uris(retrieval_results), trace)]
+        if not entries:
+            return ""
+        return FOOTER_HEADER + "".join(entries)
+
+    def stats(self):
+        with self.lock:
+            return {'mode': self.mode, 'cached': len(self.entries), 'hits': self.hits, 'signed': self.signed}
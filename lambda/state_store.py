@@ -0,0 +1,270 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 여러 Lambda(connect / disconnect / stream)가 함께 보는 상태 저장소.
+# state_store 환경 변수로 선택: memory (기본, 로컬 테스트용) / sqlite / dynamodb
+# 값은 JSON 으로 직렬화해서 저장한다.
+#
+# get / put / delete 외에
+# - add(key, value, ttl): 키가 없을 때만 저장하고 True 반환 (리더 선출 등)
+# - replace(key, expected, value, ttl): 현재 값이 expected 일 때만 저장하고 True 반환 (토큰 버킷 등)
+# - add_member / remove_member / members: 문자열 집합 (구독자 목록 등)
+
+
+class MemoryStore:
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self.items[key]
+            return None
+        return json.loads(value)
+
+    def _put(self, key, value, ttl):
+        expires_at = time.time() + ttl if ttl else None
+        self.items[key] = (json.dumps(value), expires_at)
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def put(self, key, value, ttl=None):
+        with self.lock:
+            self._put(key, value, ttl)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def add(self, key, value, ttl=None):
+        with self.lock:
+            if self._get(key) is not None:
+                return False
+            self._put(key, value, ttl)
+            return True
+
+    def replace(self, key, expected, value, ttl=None):
+        # expected 가 None 이면 키가 없을 때만 저장 (add 와 같음)
+        with self.lock:
+            if self._get(key) != expected:
+                return False
+            self._put(key, value, ttl)
+            return True
+
+    def add_member(self, key, member, ttl=None):
+        with self.lock:
+            members = set(self._get(key) or [])
+            members.add(member)
+            self._put(key, sorted(members), ttl)
+
+    def remove_member(self, key, member):
+        with self.lock:
+            members = self._get(key)
+            if members and member in members:
+                members.remove(member)
+                _, expires_at = self.items[key]
+                self._put(key, members, expires_at - time.time() if expires_at else None)
+
+    def members(self, key):
+        with self.lock:
+            return set(self._get(key) or [])
+
+
+class SqliteStore(MemoryStore):
+    # MemoryStore 와 같은 의미. 여러 프로세스가 같은 파일을 공유할 수 있다.
+    # add / replace 는 SQL 한 문장, 집합 연산은 BEGIN IMMEDIATE 트랜잭션으로 프로세스 사이에서도 원자적으로 처리한다.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self.db.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)')
+
+    def _get(self, key):
+        row = self.db.execute('SELECT value, expires_at FROM state WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            self.db.execute('DELETE FROM state WHERE key = ? AND expires_at <= ?', (key, time.time()))
+            return None
+        return json.loads(value)
+
+    def _put(self, key, value, ttl):
+        expires_at = time.time() + ttl if ttl else None
+        self.db.execute('INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)',
+                        (key, json.dumps(value), expires_at))
+
+    def delete(self, key):
+        with self.lock:
+            self.db.execute('DELETE FROM state WHERE key = ?', (key,))
+
+    def add(self, key, value, ttl=None):
+        # 키가 없거나 만료된 경우에만 저장
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                'INSERT INTO state (key, value, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at '
+                'WHERE state.expires_at IS NOT NULL AND state.expires_at <= ?',
+                (key, json.dumps(value), now + ttl if ttl else None, now))
+            return cursor.rowcount == 1
+
+    def replace(self, key, expected, value, ttl=None):
+        if expected is None:
+            return self.add(key, value, ttl)
+        # 저장된 JSON 문자열과 비교 (get 으로 읽은 값을 그대로 expected 로 넘기면 같은 문자열이 된다)
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                'UPDATE state SET value = ?, expires_at = ? '
+                'WHERE key = ? AND value = ? AND (expires_at IS NULL OR expires_at > ?)',
+                (json.dumps(value), now + ttl if ttl else None, key, json.dumps(expected), now))
+            return cursor.rowcount == 1
+
+    def add_member(self, key, member, ttl=None):
+        with self.lock, self._transaction():
+            members = set(self._get(key) or [])
+            members.add(member)
+            self._put(key, sorted(members), ttl)
+
+    def remove_member(self, key, member):
+        with self.lock, self._transaction():
+            members = self._get(key)
+            if members and member in members:
+                members.remove(member)
+                row = self.db.execute('SELECT expires_at FROM state WHERE key = ?', (key,)).fetchone()
+                expires_at = row[0] if row else None
+                self._put(key, members, expires_at - time.time() if expires_at else None)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # 쓰기 잠금을 먼저 잡아 읽고 쓰는 사이에 다른 프로세스가 끼어들지 못하게 한다
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+
+class DynamoStore:
+    # 테이블: 파티션 키 pk (S), 값 value (S), 집합 members (SS), TTL 속성 expires_at (N)
+    def __init__(self, table_name, region_name=None):
+        self.table_name = table_name
+        self.region_name = region_name or os.environ.get('region')
+
+    @property
+    def client(self):
+        # 처음 사용할 때 생성 (모듈 import 시점에 만들지 않도록)
+        from client_pool import get_client
+        return get_client('dynamodb', region_name=self.region_name)
+
+    def _get_item(self, key):
+        response = self.client.get_item(TableName=self.table_name, Key={'pk': {'S': key}}, ConsistentRead=True)
+        item = response.get('Item')
+        # DynamoDB TTL 삭제는 지연될 수 있으므로 직접 만료 확인
+        if item and 'expires_at' in item and float(item['expires_at']['N']) <= time.time():
+            return None
+        return item
+
+    def get(self, key):
+        item = self._get_item(key)
+        if not item or 'value' not in item:
+            return None
+        return json.loads(item['value']['S'])
+
+    def put(self, key, value, ttl=None):
+        self.client.put_item(TableName=self.table_name, Item=self._item(key, value, ttl))
+
+    def delete(self, key):
+        self.client.delete_item(TableName=self.table_name, Key={'pk': {'S': key}})
+
+    def add(self, key, value, ttl=None):
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item=self._item(key, value, ttl),
+                ConditionExpression='attribute_not_exists(pk) OR expires_at <= :now',
+                ExpressionAttributeValues={':now': {'N': str(int(time.time()))}}
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def replace(self, key, expected, value, ttl=None):
+        if expected is None:
+            return self.add(key, value, ttl)
+        # 저장된 JSON 문자열과 비교 (get 으로 읽은 값을 그대로 expected 로 넘기면 같은 문자열이 된다)
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item=self._item(key, value, ttl),
+                ConditionExpression='#v = :old',
+                ExpressionAttributeNames={'#v': 'value'},
+                ExpressionAttributeValues={':old': {'S': json.dumps(expected)}}
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def add_member(self, key, member, ttl=None):
+        update = 'ADD members :m'
+        values = {':m': {'SS': [member]}}
+        if ttl:
+            update += ' SET expires_at = :e'
+            values[':e'] = {'N': str(int(time.time() + ttl))}
+        self.client.update_item(TableName=self.table_name, Key={'pk': {'S': key}},
+                                UpdateExpression=update, ExpressionAttributeValues=values)
+
+    def remove_member(self, key, member):
+        self.client.update_item(TableName=self.table_name, Key={'pk': {'S': key}},
+                                UpdateExpression='DELETE members :m',
+                                ExpressionAttributeValues={':m': {'SS': [member]}})
+
+    def members(self, key):
+        item = self._get_item(key)
+        if not item:
+            return set()
+        return set(item.get('members', {}).get('SS', []))
+
+    def _item(self, key, value, ttl):
+        item = {'pk': {'S': key}, 'value': {'S': json.dumps(value)}}
+        if ttl:
+            item['expires_at'] = {'N': str(int(time.time() + ttl))}
+        return item
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = os.environ.get('state_store', 'memory')
+            if backend == 'dynamodb':
+                _store = DynamoStore(os.environ['state_table'])
+            elif backend == 'sqlite':
+                _store = SqliteStore(os.environ.get('state_store_path', '/tmp/state.db'))
+            else:
+                _store = MemoryStore()
+        return _store
+
+
+def set_store(store):
+    # 로컬 테스트 / 벤치마크에서 저장소 교체용
+    global _store
+    with _store_lock:
+        _store = store
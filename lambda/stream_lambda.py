@@ -1,20 +1,71 @@
 import json
-import boto3
-import os
-from botocore.exceptions import BotoCoreError, ClientError
+from client_pool import count_pool, pool_stats
+from singleflight import SingleFlight, flight_key
+from frames import negotiate
+from instrumentation import start_trace
+from conversation import ConversationStore, history_digest, history_tokens
+from admission import AdmissionControl
+from batch import send_batch
+from bedrock_stream import InvokeBedrock, post_to_connection, resume, router
 
 def lambda_handler(event, context):
-    print('@@@@@@@@@@@@@event: ', event)
-    print('@@@@@@@@@@@@@context: ', context)
+    trace = start_trace('stream', getattr(context, 'aws_request_id', None))
+    pool_before = pool_stats()
+    trace.debug('Event received', event=event)
 
     try:
-        body = json.loads(event['body'])
+        with trace.stage('parse'):
+            body = json.loads(event['body'])
         prompt = body.get('prompt')
         connection_id = body.get('connectionId')
 
+        # resume {requestId, lastSeq}: 끊긴 스트림의 나머지를 이 연결로 받는다 (stream_replay=1)
+        if body.get('action') == 'resume' or event.get('requestContext', {}).get('routeKey') == 'resume':
+            return resume(connection_id or event['requestContext']['connectionId'], body, trace)
+
+        # sendBatch {prompts: [{id, prompt}, ...], mode}: 여러 질문을 한 번의 호출에서 동시에 처리 (batch.py)
+        if body.get('action') == 'sendBatch' or event.get('requestContext', {}).get('routeKey') == 'sendBatch':
+            return send_batch(connection_id or event['requestContext']['connectionId'], body, trace, context, admission)
+
         if prompt:
-            invoker = InvokeBedrock(connection_id)
-            invoker.call_bedrock(prompt)
+            # single_flight=1 이면 같은 질문이 진행 중일 때 구독자로만 등록하고 반환
+            codec = negotiate(connection_id, body)
+            # conversation_memory=1 이면 이전 대화를 같이 보낸다 (대화 기록이 다르면 같은 질문이어도 따로 생성)
+            history = conversations.history(connection_id)
+            flight = None
+            if single_flight.enabled:
+                flight = single_flight.join(flight_key(prompt + history_digest(history)), connection_id, trace.timed_post(post_to_connection), codec, trace)
+                if flight is None:
+                    trace.info('Joined in-flight request', connectionId=connection_id)
+                    return {
+                        'statusCode': 200,
+                        'body': json.dumps({'message': 'Request received'})
+                    }
+
+            answer = None
+            ticket = None
+            try:
+                invoker = InvokeBedrock(connection_id, flight=flight, codec=codec, trace=trace,
+                                        resume_key=body.get('resumeKey'))
+                # admission_control=1 이면 요청 수 / 토큰 한도 안에서만 생성 (잠깐 기다리거나 busy 프레임)
+                plan = router.plan(prompt, history_tokens(history))
+                with trace.stage('admission'):
+                    ticket = admission.admit(connection_id, admission.estimate(prompt, plan.max_tokens, history_tokens(history)), trace)
+                if not ticket.admitted:
+                    invoker.reject(ticket)
+                    return {
+                        'statusCode': 429,
+                        'body': json.dumps({'error': 'Too many requests', 'retryAfterMs': ticket.retry_after_ms})
+                    }
+                answer = invoker.call_bedrock(prompt, history, plan)
+            finally:
+                if flight:
+                    flight.close()
+                if ticket:
+                    admission.settle(ticket, answer, plan.max_tokens)
+            # 응답을 받은 연결마다 질문/답변 추가 (single-flight 구독자 포함)
+            for target in (flight.targets if flight else [connection_id]):
+                conversations.append(target, prompt, answer)
             return {
                 'statusCode': 200,
                 'body': json.dumps({'message': 'Request received'})
@@ -26,75 +77,21 @@ def lambda_handler(event, context):
         }
 
     except KeyError as e:
-        print(f"KeyError: {e}")
+        trace.error('KeyError', error=str(e))
         return {
             'statusCode': 400,
             'body': json.dumps({'error': 'Missing key in event object'})
         }
     except json.JSONDecodeError as e:
-        print(f"JSONDecodeError: {e}")
+        trace.error('JSONDecodeError', error=str(e))
         return {
             'statusCode': 400,
             'body': json.dumps({'error': 'Invalid JSON'})
         }
+    finally:
+        trace.debug('Client pool stats', stats=count_pool(trace, pool_before))
+        trace.emit()
 
-class InvokeBedrock:
-    def __init__(self, connection_id):
-        self.client = boto3.client('bedrock-runtime', region_name='us-east-1')
-        self.conn = boto3.client('apigatewaymanagementapi', endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
-        self.params = {
-            "ConnectionId": connection_id,
-            "Data": ""
-        }
-
-    def call_bedrock(self, request):
-        model_id = "anthropic.claude-3-haiku-20240307-v1:0"
-        native_request = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 512,
-            "temperature": 0.5,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": request}]
-                }
-            ]
-        }
-
-        request_payload = json.dumps(native_request)
-
-        try:
-            response = self.client.invoke_model_with_response_stream(
-                modelId=model_id,
-                contentType="application/json",
-                body=request_payload
-            )
-
-            event_stream = response['body']
-            for event in event_stream:
-                print(f"Event received: {event}")
-
-                if 'chunk' in event:
-                    chunk_data = event['chunk']['bytes']
-                    chunk = json.loads(chunk_data)
-                    print(chunk)
-                    if chunk.get("type") == "content_block_delta":
-                        message = chunk["delta"].get("text", "")
-                        print(message, end="")
-                        self.send_message_to_client(str(message))  # 문자열로 변환하여 전송
-                    elif chunk.get("type") == "content_block_stop":
-                        self.send_message_to_client(json.dumps({"type": "done"}))
-                else:
-                    print("No 'chunk' in event")
-
-        except (BotoCoreError, ClientError) as error:
-            print(error)
-            self.params["Data"] = json.dumps({'error': str(error)})
-            self.conn.post_to_connection(**self.params)
-
-    def send_message_to_client(self, message):
-        self.params["Data"] = json.dumps({"message": str(message)})  # 문자열로 변환하여 전송
-        try:
-            self.conn.post_to_connection(**self.params)
-        except ClientError as e:
-            print(f"Failed to send message to client: {e}")
+conversations = ConversationStore()
+admission = AdmissionControl()
+single_flight = SingleFlight()
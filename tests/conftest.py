@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# lambda/ 와 tmp/ 의 모듈은 Lambda 처럼 최상위 모듈로 import 한다
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'tmp'), ROOT]
+
+os.environ.setdefault('api_endpoint', 'https://fake.execute-api.local/dev')
+os.environ.setdefault('region', 'us-east-1')
+os.environ.setdefault('instrumentation', 'off')
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    # 테스트마다 새 클라이언트 레지스트리 / 메모리 저장소
+    import client_pool
+    import state_store
+    client_pool.clear()
+    state_store.set_store(state_store.MemoryStore())
+    yield
+    client_pool.clear()
+    state_store.set_store(None)
+
+
+@pytest.fixture
+def gateway():
+    import client_pool
+    from fakes import FakeGatewayClient
+    client = FakeGatewayClient()
+    client_pool.register_client(client, 'apigatewaymanagementapi',
+                                endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
+    return client
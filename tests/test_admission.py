@@ -0,0 +1,51 @@
+import time
+
+from admission import AdmissionControl, bucket_key
+from context_packer import estimate_tokens
+from state_store import MemoryStore
+
+
+def control(store, **kwargs):
+    options = dict(enabled=True, store=store, conn_rps=1, conn_burst=5, conn_tpm=10000,
+                   global_rps=10, global_burst=100, global_tpm=100000, max_wait_ms=50, max_queue=5)
+    options.update(kwargs)
+    return AdmissionControl(**options)
+
+
+def tokens_left(store, scope):
+    return store.get(bucket_key(scope))['tokens']
+
+
+def test_settle_returns_unused_output_and_context_tokens():
+    store = MemoryStore()
+    admission = control(store)
+    tokens = admission.estimate('질문', 512, extra_tokens=1500)
+    ticket = admission.admit('c1', tokens)
+    assert ticket.admitted
+    before = {scope: tokens_left(store, scope) for scope in ('conn:c1', 'global')}
+
+    # context 는 예산 1500 중 300 만 사용
+    admission.settle(ticket, '네', 512, unused_input=1500 - 300)
+
+    expected = 512 - estimate_tokens('네') + 1200
+    for scope, tokens_before in before.items():
+        assert abs(tokens_left(store, scope) - tokens_before - expected) < 1  # 그 사이 채워진 만큼의 오차
+
+
+def test_wait_is_bounded_and_reports_scope():
+    store = MemoryStore()
+    admission = control(store, conn_burst=1, conn_rps=0.1)
+    assert admission.admit('c1', 10).admitted
+
+    started = time.monotonic()
+    ticket = admission.admit('c1', 10)
+    assert not ticket.admitted
+    assert ticket.scope == 'connection'
+    assert ticket.retry_after_ms > 50
+    assert time.monotonic() - started < 0.05
+    assert admission.waiting() == 0
+
+
+def test_disabled_admits_everything():
+    admission = control(MemoryStore(), enabled=False)
+    assert all(admission.admit('c1', 10 ** 9).admitted for _ in range(10))
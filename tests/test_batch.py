@@ -0,0 +1,112 @@
+import json
+
+import client_pool
+import pytest
+from admission import AdmissionControl
+from batch import parse_batch, run_batch, send_batch
+from bedrock_stream import InvokeBedrock
+from fakes import FakeBedrockRuntime
+from frames import FrameCodec, decode_frame
+from instrumentation import NOOP_TRACE
+from state_store import MemoryStore
+
+
+@pytest.fixture
+def bedrock():
+    client = FakeBedrockRuntime(chunks=4, token_ms=0, first_token_ms=0)
+    client_pool.register_client(client, 'bedrock-runtime', region_name='us-east-1')
+    return client
+
+
+def frames_for(gateway, request_id=None):
+    frames = [decode_frame(data) for conn, data in gateway.posts]
+    return [frame for frame in frames if request_id is None or frame['id'] == request_id]
+
+
+def batch_body(*prompts, mode='stream', protocol=2):
+    return {'action': 'sendBatch', 'requestId': 'b1', 'protocol': protocol, 'mode': mode,
+            'prompts': [{'id': f'q{i}', 'prompt': prompt} for i, prompt in enumerate(prompts)]}
+
+
+def test_parse_batch_forces_aggregate_for_v1():
+    items, mode = parse_batch({'prompts': ['a', {'id': 'x', 'prompt': 'b'}]}, 'b1', FrameCodec(1))
+
+    assert mode == 'aggregate'
+    assert [item['id'] for item in items] == ['b1-0', 'x']
+    assert parse_batch({'prompts': ['a'], 'mode': 'stream'}, 'b1', FrameCodec(2, request_id='b1'))[1] == 'stream'
+
+
+@pytest.mark.parametrize('prompts', [[], ['a', ''], [{'id': 'x', 'prompt': 'a'}, {'id': 'x', 'prompt': 'b'}]])
+def test_parse_batch_rejects_invalid_prompts(prompts):
+    with pytest.raises(ValueError):
+        parse_batch({'prompts': prompts}, 'b1', FrameCodec(2, request_id='b1'))
+
+
+def test_failing_items_do_not_abort_the_batch(gateway, bedrock):
+    broken = FakeBedrockRuntime(chunks=4, token_ms=0, first_token_ms=0, stream_error_after=1,
+                                error_code='ModelStreamErrorException')
+
+    def run_item(item, codec, conn):
+        if item['id'] == 'raise':
+            raise RuntimeError('boom')
+        client = broken if item['id'] == 'bedrock' else bedrock
+        return InvokeBedrock('c1', client=client, conn=conn, codec=codec).call_bedrock(item['prompt'])
+
+    items = [{'id': item_id, 'prompt': '질문'} for item_id in ['ok1', 'raise', 'bedrock', 'ok2']]
+    summary = run_batch(items, run_item, 'c1', FrameCodec(2, request_id='b1'), gateway, 'stream')
+
+    results = {result['id']: result for result in summary['results']}
+    assert (summary['ok'], summary['failed']) == (2, 2)
+    assert results['ok1']['ok'] and results['ok2']['ok']
+    assert results['raise']['error'] == 'RuntimeError: boom'
+    assert 'ModelStreamErrorException' in results['bedrock']['error']
+    assert frames_for(gateway, 'raise')[-1]['type'] == 'error'
+    assert frames_for(gateway, 'ok2')[-1]['type'] == 'done'
+
+
+def test_busy_and_skipped_items_are_reported(gateway):
+    def run_item(item, codec, conn):
+        conn.post_to_connection(ConnectionId='c1', Data=codec.encode('busy', {'retryAfterMs': 250, 'scope': 'global'}, 0))
+
+    items = [{'id': 'q0', 'prompt': 'a'}]
+    summary = run_batch(items, run_item, 'c1', FrameCodec(2, request_id='b1'), gateway, 'aggregate')
+    assert summary['results'][0]['error'] == 'busy'
+    assert summary['results'][0]['retryAfterMs'] == 250
+
+    summary = run_batch(items, run_item, 'c1', FrameCodec(2, request_id='b1'), gateway, 'aggregate',
+                        remaining_ms=lambda: 1000)
+    assert summary['results'][0]['error'] == 'skipped: invocation time limit'
+
+
+def test_summary_frame_shape(gateway, bedrock):
+    response = send_batch('c1', batch_body('첫 질문', '둘째 질문', mode='aggregate'), NOOP_TRACE, None,
+                          AdmissionControl(enabled=False))
+
+    assert response['statusCode'] == 200
+    items = [frame for frame in frames_for(gateway) if frame['id'] != 'b1']
+    assert sorted(frame['id'] for frame in items) == ['q0', 'q1']
+    assert all(frame['type'] == 'done' and frame['data']['ok'] and frame['data']['text'] for frame in items)
+
+    summary = frames_for(gateway, 'b1')
+    assert len(summary) == 1 and summary[0]['type'] == 'done'
+    batch = summary[0]['data']['batch']
+    assert set(batch) == {'items', 'ok', 'failed', 'totalMs', 'results'}
+    assert (batch['items'], batch['ok'], batch['failed']) == (2, 2, 0)
+    assert set(batch['results'][0]) == {'id', 'ok', 'error', 'queuedMs', 'ttftMs', 'totalMs', 'chars'}
+
+
+def test_batches_are_charged_to_the_connection_bucket(gateway, bedrock):
+    store = MemoryStore()
+    admission = AdmissionControl(enabled=True, store=store, conn_rps=100, conn_burst=100, conn_tpm=5000,
+                                 max_wait_ms=0)
+    body = batch_body(*['질문'] * 10, mode='aggregate')
+
+    assert send_batch('c1', body, NOOP_TRACE, None, admission)['statusCode'] == 200
+    # 두 번째 배치는 첫 배치가 실제로 쓴 토큰만큼 연결 버킷이 비어 있어 거절된다
+    response = send_batch('c1', body, NOOP_TRACE, None, admission)
+    assert response['statusCode'] == 429
+    assert frames_for(gateway, 'b1')[-1]['type'] == 'busy'
+    assert frames_for(gateway, 'b1')[-1]['data']['scope'] == 'connection'
+    # 다른 연결은 영향 없음
+    assert send_batch('c2', body, NOOP_TRACE, None, admission)['statusCode'] == 200
+    assert json.loads(response['body'])['retryAfterMs'] > 0
@@ -0,0 +1,87 @@
+import threading
+
+import disconnect_lambda
+import pytest
+from bedrock_stream import InvokeBedrock
+from cancellation import is_cancelled
+from fakes import FakeBedrockRuntime, FakeGatewayClient
+from frames import FrameCodec, decode_frame
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setenv('coalesce_max_bytes', '0')
+    monkeypatch.setenv('cancel_check_ms', '0')
+
+
+def disconnect_event(route_key, connection_id='c1'):
+    return {'requestContext': {'connectionId': connection_id, 'routeKey': route_key}}
+
+
+def generate_while(gateway, action, chunks=200):
+    # action 을 생성 도중에 실행한다
+    bedrock = FakeBedrockRuntime(chunks=chunks, chunk_chars=2, token_ms=2, first_token_ms=0)
+    timer = threading.Timer(0.02, action)
+    timer.start()
+    answer = InvokeBedrock('c1', client=bedrock, conn=gateway, codec=FrameCodec(2, request_id='r1')).call_bedrock('질문')
+    timer.join()
+    return bedrock, answer
+
+
+def test_gone_connection_stops_reading_and_closes_the_stream():
+    gateway = FakeGatewayClient(fail_on=3, error_code='GoneException')
+    bedrock = FakeBedrockRuntime(chunks=50, chunk_chars=2, token_ms=0, first_token_ms=0)
+
+    InvokeBedrock('c1', client=bedrock, conn=gateway, codec=FrameCodec(2, request_id='r1')).call_bedrock('질문')
+
+    assert len(gateway.posts) == 3
+    assert gateway.attempts == 4  # GoneException 뒤에는 보내지 않는다
+    assert bedrock.streams[0].closed
+    assert bedrock.emitted() == 5  # 실패한 post 다음 청크에서 멈춤
+
+
+def test_cancel_route_ends_the_stream_with_cancelled_done(gateway):
+    response = {}
+    bedrock, answer = generate_while(gateway, lambda: response.update(disconnect_lambda.lambda_handler(disconnect_event('cancel'), None)))
+
+    frames = [decode_frame(data) for conn, data in gateway.posts]
+    assert response['statusCode'] == 200
+    assert frames[-1]['type'] == 'done' and frames[-1]['data'] == {'reason': 'cancelled'}
+    assert [frame['type'] for frame in frames].count('done') == 1
+    assert bedrock.streams[0].closed and bedrock.emitted() < 200
+    assert ''.join(frame['data'] for frame in frames if frame['type'] == 'delta') == answer
+    assert 'c1' not in gateway.disconnected  # cancel 은 연결을 끊지 않는다
+
+
+def test_disconnect_cancels_generation_when_replay_is_off(gateway):
+    bedrock, _ = generate_while(gateway, lambda: disconnect_lambda.lambda_handler(disconnect_event('$disconnect'), None))
+
+    assert is_cancelled('c1')
+    assert 'c1' in gateway.disconnected
+    assert bedrock.streams[0].closed and bedrock.emitted() < 200
+
+
+def test_disconnect_keeps_generating_for_resume_when_replay_is_on(gateway, monkeypatch):
+    monkeypatch.setenv('stream_replay', '1')
+
+    disconnect_lambda.lambda_handler(disconnect_event('$disconnect'), None)
+
+    assert not is_cancelled('c1')
+
+
+def test_cancel_route_ends_a_single_flight_follower(gateway, monkeypatch):
+    from singleflight import SingleFlight
+    monkeypatch.setenv('single_flight', '1')
+    posts = []
+    post = lambda connection_id, data: posts.append((connection_id, decode_frame(data)))
+    group = SingleFlight(refresh_ms=0)
+    leader = group.join('k', 'c0', post, FrameCodec(2, request_id='r0'))
+    group.join('k', 'c1', post, FrameCodec(2, request_id='r1'))
+    leader.deliver(('delta', '안녕', 0))
+
+    disconnect_lambda.lambda_handler(disconnect_event('cancel'), None)
+    leader.deliver(('delta', '하세요', 1))
+
+    assert [(frame['type'], frame['data']) for conn, frame in posts if conn == 'c1'] == [
+        ('delta', '안녕'), ('done', {'reason': 'cancelled'})]
+    assert leader.targets == ['c0']
@@ -0,0 +1,33 @@
+from botocore.config import Config
+
+import client_pool
+
+
+def test_clients_are_keyed_by_config(monkeypatch):
+    monkeypatch.setattr(client_pool.boto3, 'client', lambda service, **kwargs: object())
+
+    default = client_pool.get_client('bedrock-runtime', region_name='us-east-1')
+    no_retry = client_pool.get_client('bedrock-runtime', region_name='us-east-1', config=Config(retries={'max_attempts': 0}))
+
+    assert default is not no_retry
+    assert client_pool.get_client('bedrock-runtime', region_name='us-east-1') is default
+    assert client_pool.get_client('bedrock-runtime', region_name='us-east-1', config=Config(retries={'max_attempts': 0})) is no_retry
+
+
+def test_registered_fake_wins_for_any_config():
+    fake = object()
+    client_pool.register_client(fake, 'bedrock-runtime', region_name='us-east-1')
+    assert client_pool.get_client('bedrock-runtime', region_name='us-east-1', config=Config(retries={'max_attempts': 0})) is fake
+
+
+def test_count_pool_reports_clients_created_and_reused_since_a_snapshot(monkeypatch):
+    from instrumentation import Trace
+    monkeypatch.setattr(client_pool.boto3, 'client', lambda service, **kwargs: object())
+    client_pool.get_client('s3', region_name='us-east-1')
+    before = client_pool.pool_stats()
+    client_pool.get_client('s3', region_name='us-east-1')
+    client_pool.get_client('sts', region_name='us-east-1')
+
+    trace = Trace('stream')
+    client_pool.count_pool(trace, before)
+    assert (trace.counters['clients_created'], trace.counters['clients_reused']) == (1, 1)
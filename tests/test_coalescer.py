@@ -0,0 +1,165 @@
+import time
+from types import SimpleNamespace
+
+import coalescer
+import pytest
+from coalescer import DeltaCoalescer
+from fakes import FakeBedrockRuntime
+from frames import FrameCodec, decode_frame
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(coalescer, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def test_first_delta_is_sent_immediately_then_buffered_until_max_bytes(clock):
+    sent = []
+    c = DeltaCoalescer(sent.append, max_bytes=6, max_delay_ms=1000)
+
+    c.add('a')
+    c.add('bb')
+    c.add('cc')
+    assert sent == ['a']
+    c.add('dd')
+    assert sent == ['a', 'bbccdd']
+    assert c.stats() == {'deltas': 4, 'posts': 2, 'saved_posts': 2}
+
+
+def test_max_bytes_counts_utf8_bytes(clock):
+    sent = []
+    c = DeltaCoalescer(sent.append, max_bytes=6, max_delay_ms=1000)
+
+    c.add('첫')
+    c.add('토큰')  # 6 bytes
+    assert sent == ['첫', '토큰']
+
+
+def test_zero_max_bytes_sends_every_delta(clock):
+    sent = []
+    c = DeltaCoalescer(sent.append, max_bytes=0, max_delay_ms=1000)
+
+    for text in ['a', 'b', 'c']:
+        c.add(text)
+    assert sent == ['a', 'b', 'c']
+
+
+def test_time_bound_flushes_on_next_delta(clock):
+    sent = []
+    c = DeltaCoalescer(sent.append, max_bytes=1000, max_delay_ms=50)
+
+    c.add('a')
+    c.add('b')
+    clock.now += 0.049
+    c.add('c')
+    assert sent == ['a']
+    clock.now += 0.002
+    c.add('d')
+    assert sent == ['a', 'bcd']
+
+
+def test_time_bound_flushes_without_next_delta():
+    sent = []
+    c = DeltaCoalescer(sent.append, max_bytes=1000, max_delay_ms=20)
+
+    c.add('a')
+    c.add('b')
+    c.add('c')
+    assert sent == ['a']
+    # 스트림이 멈춰도 타이머가 모아 둔 텍스트를 보낸다
+    time.sleep(0.2)
+    assert sent == ['a', 'bc']
+    c.add('d')
+    time.sleep(0.2)
+    assert sent == ['a', 'bc', 'd']
+    assert c.timer is None
+
+
+def test_flush_and_cancel_stop_the_timer():
+    sent = []
+    c = DeltaCoalescer(sent.append, max_bytes=1000, max_delay_ms=20)
+
+    c.add('a')
+    c.add('b')
+    c.flush()
+    c.add('c')
+    c.cancel()
+    time.sleep(0.1)
+    assert sent == ['a', 'b']
+    assert c.buffer == ['c']
+
+
+def test_flush_sends_remaining_and_ignores_empty(clock):
+    sent = []
+    c = DeltaCoalescer(sent.append, max_bytes=1000, max_delay_ms=1000)
+
+    c.flush()
+    c.add('a')
+    c.add('')
+    c.add('b')
+    c.flush()
+    c.flush()
+    assert sent == ['a', 'b']
+
+
+def generate(gateway, monkeypatch, max_bytes, **fake):
+    monkeypatch.setenv('coalesce_max_bytes', str(max_bytes))
+    monkeypatch.setenv('coalesce_max_ms', '60000')
+    import stream_lambda
+    bedrock = FakeBedrockRuntime(token_ms=0, first_token_ms=0, **fake)
+    invoker = stream_lambda.InvokeBedrock('c1', client=bedrock, conn=gateway, codec=FrameCodec(2, request_id='r1'))
+    answer = invoker.call_bedrock('질문')
+    return bedrock, answer, [decode_frame(data) for conn, data in gateway.posts]
+
+
+def text_of(frames):
+    return ''.join(frame['data'] for frame in frames if frame['type'] == 'delta')
+
+
+def test_coalescing_reduces_posts_and_flushes_before_done(gateway, monkeypatch):
+    bedrock, answer, frames = generate(gateway, monkeypatch, 256)
+
+    # 첫 델타 + 256 바이트마다 + content_block_stop 에서 남은 것 + done
+    assert len(frames) == 4
+    assert frames[-1]['type'] == 'done'
+    assert text_of(frames) == answer == bedrock.text
+
+
+def test_coalescing_disabled_posts_every_delta(gateway, monkeypatch):
+    bedrock, answer, frames = generate(gateway, monkeypatch, 0)
+
+    assert len(frames) == bedrock.emitted() + 1
+    assert text_of(frames) == bedrock.text
+
+
+def test_buffered_text_is_flushed_before_error_frame(gateway, monkeypatch):
+    bedrock, _, frames = generate(gateway, monkeypatch, 256, chunk_chars=2,
+                                  stream_error_after=10, error_code='ModelStreamErrorException')
+
+    assert [frame['type'] for frame in frames] == ['delta', 'delta', 'error']
+    assert text_of(frames) == bedrock.text[:20]
+
+
+def test_coalesce_counts_go_to_the_request_metrics(gateway, monkeypatch):
+    from bedrock_stream import InvokeBedrock
+    from instrumentation import Trace
+    monkeypatch.setenv('coalesce_max_bytes', '256')
+    bedrock = FakeBedrockRuntime(token_ms=0, first_token_ms=0)
+    trace = Trace('stream', 'r1')
+    InvokeBedrock('c1', client=bedrock, conn=gateway, codec=FrameCodec(2, request_id='r1'), trace=trace).call_bedrock('질문')
+
+    record = trace.emit()
+    assert record['deltas'] == bedrock.emitted()
+    assert record['posts'] == len(gateway.posts)
+    assert record['delta_posts'] == record['posts'] - 1  # done 프레임 제외
+    assert record['saved_posts'] == record['deltas'] - record['delta_posts'] > 0
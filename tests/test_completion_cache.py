@@ -0,0 +1,54 @@
+from completion_cache import CompletionCache, bump_kb_version
+from state_store import MemoryStore
+
+
+def cache(**limits):
+    options = dict(enabled=True, max_entries=8, max_bytes=1024, max_entry_bytes=512, ttl=60, store=MemoryStore(),
+                   version_check_seconds=0)
+    options.update(limits)
+    return CompletionCache(**options)
+
+
+def test_oldest_entries_are_evicted_by_count_and_by_bytes():
+    by_count = cache(max_entries=2)
+    for key in 'abc':
+        by_count.put(key, [key * 10])
+    assert by_count.get('a') is None and by_count.get('c') == ['c' * 10]
+    assert by_count.stats()['evictions'] == 1
+
+    by_bytes = cache(max_bytes=250)
+    for key in 'abc':
+        by_bytes.put(key, ['가' * 40])  # 120 bytes
+    assert [by_bytes.get(key) is not None for key in 'abc'] == [False, True, True]
+    assert by_bytes.stats()['bytes'] == 240
+
+
+def test_entries_over_the_per_entry_cap_are_not_stored():
+    completions = cache(max_entry_bytes=100)
+
+    completions.put('big', ['x' * 60, 'y' * 60])
+    completions.put('small', ['x' * 60])
+
+    assert completions.get('big') is None
+    assert completions.get('small') == ['x' * 60]
+
+
+def test_bump_kb_version_invalidates_every_instance():
+    store = MemoryStore()
+    first, second = cache(store=store), cache(store=store)
+    for completions in (first, second):
+        completions.get('warm-up')
+        completions.put('k', ['답변'])
+
+    bump_kb_version(store)
+
+    assert first.get('k') is None and second.get('k') is None
+    assert first.stats()['invalidations'] == 1
+    first.put('k', ['새 답변'])
+    assert first.get('k') == ['새 답변']
+
+
+def test_disabled_cache_stores_nothing():
+    completions = cache(enabled=False)
+    completions.put('k', ['답변'])
+    assert completions.get('k') is None
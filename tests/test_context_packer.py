@@ -0,0 +1,38 @@
+from context_packer import estimate_tokens, pack_context, truncate_to_tokens
+
+
+def result(text, score=0.9):
+    return {'content': {'text': text}, 'score': score}
+
+
+def test_near_duplicate_chunks_are_dropped_by_shingle_overlap():
+    text = '2023년 가계 저축률은 전년보다 1.2%p 높아진 35.1% 였다. 소득 상위 분위에서 증가폭이 컸다.'
+    results = [result(text, 0.9), result(text + ' 참고.', 0.8), result('전혀 다른 내용의 청크. 금리 인상 효과.', 0.7)]
+
+    context, report = pack_context(results, budget_tokens=1000, max_chunk_tokens=500, threshold=0.8)
+
+    assert report['duplicates'] == 1 and report['chunks_used'] == 2
+    # 점수가 높은 쪽이 남는다
+    assert context.split('\n\n') == [text, '전혀 다른 내용의 청크. 금리 인상 효과.']
+
+
+def test_packing_stops_at_the_token_budget():
+    results = [result(f'청크 {i} ' + '가나다라마바사 ' * 20, 1 - i / 10) for i in range(6)]
+
+    context, report = pack_context(results, budget_tokens=300, max_chunk_tokens=500, threshold=0.99)
+
+    assert report['tokens'] <= 300 + 2
+    assert report['chunks_used'] < 6 and report['truncated'] == 1
+    assert context.startswith('청크 0 ')
+
+
+def test_truncation_cuts_at_a_sentence_boundary():
+    text = '첫 문장입니다. 둘째 문장은 왜 그럴까요? 셋째 문장! ' + '넷째 문장은 아주 길게 이어진다 ' * 3
+
+    truncated, was_truncated = truncate_to_tokens(text, 30)
+    assert was_truncated
+    assert truncated == '첫 문장입니다. 둘째 문장은 왜 그럴까요? 셋째 문장! …'
+    assert estimate_tokens(truncated) <= 30
+    # '? ' / '! ' 도 문장 끝
+    assert truncate_to_tokens(text, 15)[0] == '첫 문장입니다. 둘째 문장은 왜 그럴까요? …'
+    assert truncate_to_tokens('짧은 문장.', 40) == ('짧은 문장.', False)
@@ -0,0 +1,102 @@
+import connect_lambda
+import disconnect_lambda
+from context_packer import estimate_tokens
+from conversation import (ConversationStore, build_messages, conversation_key, history_digest, history_tokens,
+                          summary_tokens, turns_tokens)
+from state_store import MemoryStore, get_store
+
+
+def conversations(**limits):
+    return ConversationStore(enabled=True, store=MemoryStore(), **limits)
+
+
+def exchange(i):
+    return f'질문 {i} ' + '가' * 30, f'답변 {i} ' + '나' * 60
+
+
+def test_over_budget_rolls_oldest_pairs_into_the_summary():
+    store = conversations(budget_tokens=300, summary_tokens=1000, turn_tokens=400)
+    for i in range(5):
+        store.append('c1', *exchange(i))
+
+    history = store.history('c1')
+    assert turns_tokens(history['turns']) + summary_tokens(history['summary']) <= 300
+    assert 2 < len(history['turns']) < 10
+    # 최근 턴은 원문 그대로, 오래된 대화는 요약으로 (오래된 순서)
+    assert history['turns'][-2:] == [{'role': 'user', 'text': exchange(4)[0]},
+                                     {'role': 'assistant', 'text': exchange(4)[1]}]
+    kept = len(history['turns']) // 2
+    assert len(history['summary']) == 5 - kept
+    assert [line.split(' ')[2] for line in history['summary']] == [str(i) for i in range(5 - kept)]
+    assert all(line.startswith('Q: 질문') and ' / A: 답변' in line for line in history['summary'])
+
+
+def test_last_exchange_is_kept_even_over_budget():
+    store = conversations(budget_tokens=10, summary_tokens=1000)
+    store.append('c1', *exchange(0))
+    store.append('c1', *exchange(1))
+
+    history = store.history('c1')
+    assert [turn['text'] for turn in history['turns']] == list(exchange(1))
+    assert len(history['summary']) == 1
+
+
+def test_summary_is_trimmed_to_its_cap_dropping_the_oldest_lines():
+    store = conversations(budget_tokens=10, summary_tokens=80)
+    for i in range(10):
+        store.append('c1', *exchange(i))
+
+    summary = store.history('c1')['summary']
+    assert summary_tokens(summary) <= 80
+    assert summary and summary[-1].startswith('Q: 질문 8')
+
+
+def test_each_turn_is_truncated_to_the_turn_limit():
+    store = conversations(turn_tokens=50)
+    store.append('c1', '짧은 질문', '다' * 1000)
+
+    question, answer = store.history('c1')['turns']
+    assert question['text'] == '짧은 질문'
+    assert estimate_tokens(answer['text']) <= 52 and answer['text'].endswith('…')
+
+
+def test_nothing_is_stored_without_an_answer_or_when_disabled():
+    store = conversations()
+    store.append('c1', '질문', '')
+    assert store.history('c1') == {'summary': [], 'turns': []}
+
+    disabled = ConversationStore(enabled=False, store=MemoryStore())
+    disabled.append('c1', '질문', '답변')
+    assert disabled.history('c1') == {'summary': [], 'turns': []}
+
+
+def test_build_messages_puts_summary_in_system_and_request_last():
+    history = {'summary': ['Q: a / A: b', 'Q: c / A: d'],
+               'turns': [{'role': 'user', 'text': '이전 질문'}, {'role': 'assistant', 'text': '이전 답변'}]}
+
+    system, messages = build_messages(history, '이번 질문')
+
+    assert system == 'Summary of the earlier conversation with this user:\nQ: a / A: b\nQ: c / A: d'
+    assert [(m['role'], m['content'][0]['text']) for m in messages] == [
+        ('user', '이전 질문'), ('assistant', '이전 답변'), ('user', '이번 질문')]
+    assert build_messages(None, '질문') == (None, [{'role': 'user', 'content': [{'type': 'text', 'text': '질문'}]}])
+
+
+def test_history_tokens_counts_texts_not_the_json_digest():
+    history = {'summary': ['Q: 가나다 / A: 라마바'], 'turns': [{'role': 'user', 'text': '안녕하세요 ' * 20}]}
+
+    assert history_tokens(history) == turns_tokens(history['turns']) + summary_tokens(history['summary'])
+    assert history_tokens(history) < estimate_tokens(history_digest(history))
+    assert history_tokens(None) == 0
+
+
+def test_record_is_started_on_connect_and_cleared_on_disconnect(monkeypatch, gateway):
+    monkeypatch.setenv('conversation_memory', '1')
+    event = {'requestContext': {'connectionId': 'c1', 'routeKey': '$connect'}}
+
+    connect_lambda.lambda_handler(event, None)
+    assert get_store().get(conversation_key('c1')) == {'summary': [], 'turns': []}
+
+    ConversationStore().append('c1', '질문', '답변')
+    disconnect_lambda.lambda_handler({'requestContext': {'connectionId': 'c1', 'routeKey': '$disconnect'}}, None)
+    assert get_store().get(conversation_key('c1')) is None
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from frames import FRAME_TYPES, FrameCodec, decode_frame
+from ws_client import parse_frame
+
+CODECS = [FrameCodec(1), FrameCodec(2, request_id='r1'), FrameCodec(2, compact=True, request_id='r1')]
+SAMPLES = [('delta', '안녕'), ('sources', '✅ s3://bucket/a.pdf'), ('done', {'reason': 'cancelled'}),
+           ('error', 'boom'), ('busy', {'retryAfterMs': 500, 'scope': 'global'})]
+
+
+@pytest.mark.parametrize('codec', CODECS, ids=['v1', 'v2', 'compact'])
+@pytest.mark.parametrize('frame_type, data', SAMPLES)
+def test_round_trip(codec, frame_type, data):
+    frame = decode_frame(codec.encode(frame_type, data, 7))
+
+    # v1 은 sources 와 delta 를 구분하지 않는다
+    assert frame['type'] == ('delta' if codec.version < 2 and frame_type == 'sources' else frame_type)
+    assert frame['seq'] == 7
+    assert frame['data'] == data
+    assert frame['id'] == (None if codec.version < 2 else 'r1')
+
+
+@pytest.mark.parametrize('message', ['{"type":"done"}', '{"reason": "cancelled", "type": "done"}'])
+def test_v1_done_is_detected_by_parsing_the_inner_json(message):
+    frame = decode_frame(json.dumps({'message': message, 'seq': 3}))
+
+    assert frame['type'] == 'done'
+
+
+@pytest.mark.parametrize('message', ['{"type": "done" 로 시작하는 답변', '{"type": "delta"}', '{'])
+def test_v1_text_that_looks_like_json_is_a_delta(message):
+    frame = decode_frame(json.dumps({'message': message}))
+
+    assert frame == {'type': 'delta', 'id': None, 'seq': None, 'data': message}
+
+
+@pytest.mark.parametrize('raw, request_id', [
+    ('[2, "z", "r1", 4, null]', 'r1'),
+    ('[2, "d", "r1"]', 'r1'),
+    ('{"v": 2, "type": "progress", "id": "r1", "seq": 4, "data": 1}', 'r1'),
+    ('"text"', None),
+])
+def test_unknown_frames_become_errors(raw, request_id):
+    frame = decode_frame(raw)
+
+    assert frame['type'] == 'error'
+    assert frame['id'] == request_id
+
+
+def test_client_uses_the_same_decoder():
+    for codec in CODECS:
+        for frame_type in FRAME_TYPES:
+            raw = codec.encode(frame_type, 'x' if frame_type in ('delta', 'sources', 'error') else None, 1)
+            assert parse_frame(raw) == decode_frame(raw)
+    assert parse_frame('plain text') == {'type': 'delta', 'id': None, 'seq': None, 'data': 'plain text'}
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import client_pool
+from cancellation import request_cancel
+from fakes import FakeBedrockRuntime, FakeGatewayClient
+from frames import FrameCodec, decode_frame
+from pipeline import DeliveryPipeline
+from singleflight import SingleFlight
+
+
+def test_pipeline_sends_in_submit_order_including_callables():
+    sent = []
+
+    def send(message, seq):
+        time.sleep(0.001)
+        sent.append(message)
+
+    pipeline = DeliveryPipeline(lambda message, seq: message() if callable(message) else send(message, seq), maxsize=2)
+    for i in range(10):
+        pipeline.submit(i)
+    pipeline.submit(lambda: sent.append('done'))
+    pipeline.close()
+
+    assert sent == list(range(10)) + ['done']
+    assert pipeline.stats()['sent'] == 11
+
+
+def test_cancelled_leader_gets_done_after_its_last_delta(monkeypatch):
+    monkeypatch.setenv('stream_pipeline', '1')
+    monkeypatch.setenv('coalesce_max_bytes', '0')
+    monkeypatch.setenv('cancel_check_ms', '0')
+    import os
+    import stream_lambda
+    gateway = FakeGatewayClient(latency_ms=3)
+    client_pool.register_client(gateway, 'apigatewaymanagementapi',
+                                endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
+    client_pool.register_client(FakeBedrockRuntime(chunks=80, chunk_chars=2, token_ms=1, first_token_ms=0),
+                                'bedrock-runtime', region_name='us-east-1')
+
+    group = SingleFlight(enabled=True, refresh_ms=0)
+    senders = []
+
+    def post(connection_id, data):
+        senders.append((connection_id, decode_frame(data)['type'], threading.current_thread().name))
+        stream_lambda.post_to_connection(connection_id, data)
+
+    flight = group.join('k', 'leader', post, FrameCodec(2, request_id='r1'))
+    assert group.join('k', 'follower', post, FrameCodec(2, request_id='r2')) is None
+
+    invoker = stream_lambda.InvokeBedrock('leader', flight=flight, codec=FrameCodec(2, request_id='r1'))
+    canceller = threading.Timer(0.03, request_cancel, ['leader'])
+    canceller.start()
+    invoker.call_bedrock('질문')
+    canceller.join()
+    flight.close()
+
+    leader = [decode_frame(data) for conn, data in gateway.posts if conn == 'leader']
+    follower = [decode_frame(data) for conn, data in gateway.posts if conn == 'follower']
+    assert leader[-1]['type'] == 'done' and leader[-1]['data'] == {'reason': 'cancelled'}
+    assert [frame['type'] for frame in leader].count('done') == 1
+    assert [frame['seq'] for frame in leader] == sorted(frame['seq'] for frame in leader)
+    assert follower[-1]['type'] == 'done' and len(follower) > len(leader)
+    # 델타와 같은 sender 스레드에서 보내야 순서가 보장된다
+    assert {name for conn, frame_type, name in senders if conn == 'leader'} == {'sender'}
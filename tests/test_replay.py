@@ -0,0 +1,96 @@
+import client_pool
+import pytest
+import replay
+from fakes import FakeBedrockRuntime
+from frames import FrameCodec, decode_frame
+from instrumentation import NOOP_TRACE
+from state_store import MemoryStore, get_store
+
+
+def recorded_buffer(store, frames, owner='c1', resume_key='secret', max_frames=256):
+    recorder = replay.ReplayRecorder('r1', owner, store=store, max_frames=max_frames, flush_ms=0, resume_key=resume_key)
+    for seq in range(frames):
+        recorder.record(('delta', f'd{seq}', seq))
+    recorder.finish()
+    return recorder
+
+
+def resume(store, last_seq, connection_id='c2', resume_key='secret'):
+    posts = []
+    sent = replay.resume_stream('r1', last_seq, connection_id, FrameCodec(2, request_id='r1'),
+                                lambda conn, data: posts.append((conn, decode_frame(data))), store, resume_key)
+    return sent, posts
+
+
+def test_resume_with_key_replays_missing_frames():
+    store = MemoryStore()
+    recorded_buffer(store, 5)
+
+    sent, posts = resume(store, 2)
+
+    assert sent == 2
+    assert [(conn, frame['seq']) for conn, frame in posts] == [('c2', 3), ('c2', 4)]
+
+
+def test_resume_from_owner_connection_needs_no_key():
+    store = MemoryStore()
+    recorded_buffer(store, 3)
+
+    sent, _ = resume(store, 0, connection_id='c1', resume_key=None)
+
+    assert sent == 2
+
+
+@pytest.mark.parametrize('resume_key', [None, 'other'])
+def test_resume_from_other_client_is_rejected(resume_key):
+    store = MemoryStore()
+    recorded_buffer(store, 3)
+
+    with pytest.raises(replay.ResumeRejected) as rejected:
+        resume(store, 0, resume_key=resume_key)
+    assert rejected.value.reason == 'owner'
+    assert store.get(replay.redirect_key('r1')) is None
+
+
+def test_resume_past_ring_buffer_is_rejected_without_replaying():
+    store = MemoryStore()
+    recorded_buffer(store, 10, max_frames=4)  # seq 6..9 만 남음
+
+    with pytest.raises(replay.ResumeRejected) as rejected:
+        resume(store, 3)
+    assert rejected.value.reason == 'gap'
+
+    sent, _ = resume(store, 5)
+    assert sent == 4
+
+
+def test_resume_handler_sends_error_frame_on_rejection(gateway, monkeypatch):
+    monkeypatch.setenv('stream_replay', '1')
+    import stream_lambda
+    recorded_buffer(get_store(), 3)
+
+    response = stream_lambda.resume('c2', {'requestId': 'r1', 'lastSeq': 0, 'resumeKey': 'wrong', 'protocol': 2},
+                                    NOOP_TRACE)
+
+    assert response['statusCode'] == 403
+    frames = [decode_frame(data) for conn, data in gateway.posts if conn == 'c2']
+    assert [frame['type'] for frame in frames] == ['error']
+
+
+def test_detached_generation_stops_without_resume(gateway, monkeypatch):
+    monkeypatch.setenv('stream_replay', '1')
+    monkeypatch.setenv('replay_detach_ms', '50')
+    monkeypatch.setenv('replay_flush_ms', '10')
+    monkeypatch.setenv('coalesce_max_bytes', '0')
+    import stream_lambda
+    bedrock = FakeBedrockRuntime(chunks=100, chunk_chars=2, token_ms=5, first_token_ms=0)
+    client_pool.register_client(bedrock, 'bedrock-runtime', region_name='us-east-1')
+    gateway.disconnect('c1')
+
+    invoker = stream_lambda.InvokeBedrock('c1', codec=FrameCodec(2, request_id='r1'), resume_key='secret')
+    invoker.call_bedrock('질문')
+
+    stream = bedrock.streams[0]
+    assert invoker.gone
+    assert stream.closed
+    assert stream.emitted < 100
@@ -0,0 +1,31 @@
+import pytest
+import rerank
+from rerank import rerank_results
+
+
+def result(text, score, uri):
+    return {'content': {'text': text}, 'score': score, 'location': {'s3Location': {'uri': uri}}}
+
+
+RESULTS = [
+    result('2023년 가계 저축률은 35.1% 로 전년보다 1.2%p 높아졌다. 상위 분위의 증가폭이 컸다.', 0.92, 's3://kb/a.pdf'),
+    result('2023년 가계 저축률은 35.1% 로 전년보다 1.2%p 높아졌다. 상위 분위 증가폭이 가장 컸다.', 0.91, 's3://kb/a.pdf'),
+    result('기준금리 인상 이후 예금 잔액이 늘고 대출 잔액은 줄었다. 변동금리 비중도 낮아졌다.', 0.85, 's3://kb/b.pdf'),
+    result('주택 가격은 수도권 중심으로 하락했고 거래량은 크게 줄었다.', 0.60, 's3://kb/c.pdf'),
+]
+
+
+def test_near_duplicate_from_the_same_source_is_demoted():
+    pytest.importorskip('numpy')
+
+    reranked = rerank_results(RESULTS, 2, diversity=0.3, source_penalty=0.2)
+
+    # 점수순이면 a.pdf 의 거의 같은 청크 두 개가 뽑힌다
+    assert [r['score'] for r in reranked] == [0.92, 0.85]
+
+
+def test_without_numpy_the_top_k_is_returned_unchanged(monkeypatch):
+    monkeypatch.setattr(rerank, 'load_numpy', lambda: False)
+
+    assert rerank_results(RESULTS, 2) == RESULTS[:2]
+    assert rerank_results(RESULTS[:2], 5) == RESULTS[:2]
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import retrieval_cache
+import server
+from instrumentation import NOOP_TRACE
+from retrieval_cache import RetrievalCache, normalize_query
+from state_store import MemoryStore
+
+RESULTS = [{'content': {'text': '저축률 35.1%'}, 'score': 0.9}]
+
+
+def test_equivalent_queries_share_a_key():
+    cache = RetrievalCache(maxsize=8, ttl=60)
+
+    assert normalize_query('  가계  저축률은？ ') == normalize_query('가계 저축률은') == '가계 저축률은'
+    assert cache.make_key('Savings  RATE?', 'kb1', 5) == cache.make_key('savings rate', 'kb1', 5)
+    assert cache.make_key('savings rate', 'kb1', 5) != cache.make_key('savings rate', 'kb2', 5)
+    assert cache.make_key('savings rate', 'kb1', 5) != cache.make_key('savings rate', 'kb1', 20)
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(retrieval_cache, 'time', SimpleNamespace(time=lambda: now[0]))
+    cache = RetrievalCache(maxsize=8, ttl=60)
+
+    cache.put('k', RESULTS)
+    now[0] += 59
+    assert cache.get('k') == RESULTS
+    now[0] += 2
+    assert cache.get('k') is None
+    assert cache.stats()['size'] == 0 and cache.stats()['misses'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RetrievalCache(maxsize=2, ttl=60)
+
+    cache.put('a', RESULTS)
+    cache.put('b', RESULTS)
+    cache.get('a')
+    cache.put('c', RESULTS)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == RESULTS and cache.get('c') == RESULTS
+    assert cache.stats()['evictions'] == 1
+
+
+def test_shared_tier_serves_other_instances():
+    store = MemoryStore()
+    RetrievalCache(maxsize=8, ttl=60, backend=store).put('k', RESULTS)
+
+    other = RetrievalCache(maxsize=8, ttl=60, backend=store)
+    assert other.get('k') == RESULTS
+    assert other.get('k') == RESULTS
+    assert (other.stats()['shared_hits'], other.stats()['hits']) == (1, 1)
+
+
+def test_failed_retrievals_are_not_cached(monkeypatch):
+    class FailingRetriever:
+        calls = 0
+
+        def retrieve_all(self, queries, number_of_results, trace):
+            self.calls += 1
+            raise RuntimeError('ThrottlingException')
+
+    failing = FailingRetriever()
+    cache = RetrievalCache(maxsize=8, ttl=60)
+    monkeypatch.setattr(server, 'retriever', failing)
+    monkeypatch.setattr(server, 'retrieval_cache', cache)
+
+    assert server.retrieve_rag('저축률', trace=NOOP_TRACE)['details'] == 'ThrottlingException'
+    assert server.retrieve_rag('저축률', trace=NOOP_TRACE)['details'] == 'ThrottlingException'
+    assert failing.calls == 2 and cache.stats()['size'] == 0
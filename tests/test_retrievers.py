@@ -0,0 +1,183 @@
+import json
+import time
+
+import pytest
+from fakes import FakeAgentRuntime
+import retrievers
+from retrievers import (FallbackRetriever, FanOutRetriever, KnowledgeBaseRetriever, LocalIndexRetriever, create_fan_out,
+                        kb_client_config)
+
+
+def result(uri, score, name):
+    return {'content': {'text': uri}, 'location': {'type': 'S3', 's3Location': {'uri': uri}},
+            'score': score, 'retriever': name}
+
+
+class FakeRetriever:
+    def __init__(self, name, hits=None):
+        self.name = name
+        self.hits = hits or {}
+        self.calls = []
+
+    def retrieve(self, query, number_of_results, trace=None):
+        self.calls.append(('retrieve', query))
+        return [result(uri, score, self.name) for uri, score in self.hits.get(query, [])]
+
+
+class FakeBatchRetriever(FakeRetriever):
+    def retrieve(self, query, number_of_results, trace=None):
+        return self.retrieve_batch([query], number_of_results)[0]
+
+    def retrieve_batch(self, queries, number_of_results, trace=None):
+        self.calls.append(('retrieve_batch', tuple(queries)))
+        return [[result(uri, score, self.name) for uri, score in self.hits.get(query, [])] for query in queries]
+
+
+def test_fan_out_uses_one_batch_branch_for_batch_retrievers():
+    local = FakeBatchRetriever('local', {'q1': [('a', 0.9)], 'q2': [('b', 0.8)]})
+    kb = FakeRetriever('kb:2', {'q1': [('c', 0.7)], 'q2': [('a', 0.95)]})
+
+    results = FanOutRetriever([local, kb]).retrieve_all(['q1', 'q2'], 5)
+
+    assert local.calls == [('retrieve_batch', ('q1', 'q2'))]
+    assert sorted(kb.calls) == [('retrieve', 'q1'), ('retrieve', 'q2')]
+    assert [(r['location']['s3Location']['uri'], r['score']) for r in results] == [('a', 0.95), ('b', 0.8), ('c', 0.7)]
+
+
+def test_single_query_skips_batching():
+    local = FakeBatchRetriever('local', {'q1': [('a', 0.9)]})
+
+    assert FanOutRetriever([local]).retrieve_all(['q1'], 5)[0]['score'] == 0.9
+    assert local.calls == [('retrieve_batch', ('q1',))]
+
+
+def test_fallback_batch_falls_back_only_for_empty_queries():
+    local = FakeBatchRetriever('local', {'q1': [('a', 0.9)]})
+    kb = FakeRetriever('kb:1', {'q2': [('b', 0.5)]})
+    fallback = FallbackRetriever(local, kb)
+
+    batches = FanOutRetriever([fallback]).retrieve_all(['q1', 'q2'], 5)
+
+    assert local.calls == [('retrieve_batch', ('q1', 'q2'))]
+    assert kb.calls == [('retrieve', 'q2')]
+    assert [r['retriever'] for r in batches] == ['local', 'kb:1']
+
+
+def test_fallback_when_the_best_primary_score_is_below_its_threshold():
+    local = FakeBatchRetriever('local', {'q1': [('a', 0.9)], 'q2': [('b', 0.3), ('c', 0.25)]})
+    local.fallback_score = 0.5
+    kb = FakeRetriever('kb:1', {'q2': [('d', 0.7)]})
+    fallback = FallbackRetriever(local, kb)
+
+    assert [r['retriever'] for r in fallback.retrieve('q2', 5)] == ['kb:1']
+    assert [[r['retriever'] for r in results] for results in fallback.retrieve_batch(['q1', 'q2'], 5)] == [
+        ['local'], ['kb:1']]
+    assert kb.calls == [('retrieve', 'q2'), ('retrieve', 'q2')]
+
+
+def write_index(path, texts):
+    np = pytest.importorskip('numpy')
+    from rerank import hashed_ngram_vectors
+    np.save(path / 'embeddings.npy', hashed_ngram_vectors(texts, dim=256))
+    (path / 'metadata.jsonl').write_text(
+        ''.join(json.dumps({'text': text, 'uri': f's3://kb/{i}.txt'}, ensure_ascii=False) + '\n'
+                for i, text in enumerate(texts)), encoding='utf-8')
+    return str(path)
+
+
+def test_local_thresholds_are_read_when_the_retriever_is_built(tmp_path, monkeypatch):
+    path = write_index(tmp_path, ['가계 저축률은 35.1% 였다', '기준금리 인상 이후 예금이 늘었다'])
+    scores = [r['score'] for r in LocalIndexRetriever(path, min_score=-1).retrieve('가계 저축률', 5)]
+
+    monkeypatch.setenv('local_index_min_score', str((scores[0] + scores[1]) / 2))
+    monkeypatch.setenv('local_index_fallback_score', str(scores[0] + 0.01))
+    retriever = LocalIndexRetriever(path)
+
+    assert [r['score'] for r in retriever.retrieve('가계 저축률', 5)] == scores[:1]
+    kb = FakeRetriever('kb:1', {'가계 저축률': [('kb', 0.6)]})
+    assert [r['retriever'] for r in FallbackRetriever(retriever, kb).retrieve('가계 저축률', 5)] == ['kb:1']
+
+
+def test_local_index_is_checked_on_the_first_retrieve_not_at_build(tmp_path, monkeypatch):
+    checks = []
+    monkeypatch.setattr(retrievers, 'load_numpy', lambda: checks.append('numpy') or False)
+    monkeypatch.setenv('local_index_path', str(tmp_path))
+    kb = FakeAgentRuntime(latency_ms=0)
+
+    fan_out = create_fan_out(['kb1'], kb)
+    assert checks == []
+
+    results = fan_out.retrieve_all(['q1', 'q2'], 5)
+    # numpy 가 없으면 질문마다 KB branch 로 나눠 검색하고, 확인은 한 번만
+    assert checks == ['numpy'] and kb.calls == 2
+    assert results and 'retriever' not in results[0]
+    fan_out.retrieve_all(['q3'], 5)
+    assert checks == ['numpy'] and kb.calls == 3
+
+
+def test_failed_batch_branch_does_not_hide_other_branches():
+    class Broken(FakeBatchRetriever):
+        def retrieve_batch(self, queries, number_of_results, trace=None):
+            raise RuntimeError('index missing')
+
+    kb = FakeRetriever('kb:1', {'q1': [('a', 0.5)]})
+    results = FanOutRetriever([Broken('local'), kb]).retrieve_all(['q1', 'q2'], 5)
+    assert [r['retriever'] for r in results] == ['kb:1']
+
+    with pytest.raises(RuntimeError):
+        FanOutRetriever([Broken('local')]).retrieve_all(['q1', 'q2'], 5)
+
+
+def test_branch_failures_are_reported_through_the_trace():
+    class RecordingTrace:
+        def __init__(self):
+            self.warnings = []
+
+        def warning(self, message, **fields):
+            self.warnings.append((message, fields))
+
+        def debug(self, message, **fields):
+            pass
+
+    class Broken(FakeBatchRetriever):
+        def retrieve_batch(self, queries, number_of_results, trace=None):
+            raise RuntimeError('index missing')
+
+    trace = RecordingTrace()
+    kb = FakeRetriever('kb:1', {'q1': [('a', 0.5)]})
+    FanOutRetriever([FallbackRetriever(Broken('local'), kb)]).retrieve_all(['q1', 'q2'], 5, trace)
+
+    assert trace.warnings == [('Retriever failed, falling back',
+                               {'retriever': 'local', 'fallback': 'kb:1', 'error': 'index missing'})]
+
+
+def test_slow_branches_are_dropped_at_the_fan_out_timeout():
+    class RecordingTrace:
+        def __init__(self):
+            self.warnings = []
+
+        def warning(self, message, **fields):
+            self.warnings.append((message, fields))
+
+        def debug(self, message, **fields):
+            pass
+
+    fast = KnowledgeBaseRetriever('fast', FakeAgentRuntime(latency_ms=0, documents=2))
+    slow = KnowledgeBaseRetriever('slow', FakeAgentRuntime(latency_ms=300))
+    trace = RecordingTrace()
+
+    started = time.monotonic()
+    results = FanOutRetriever([fast, slow], timeout_ms=50).retrieve_all(['q1'], 5, trace)
+
+    assert time.monotonic() - started < 0.25
+    assert {r['location']['s3Location']['uri'] for r in results} == {
+        's3://fake-kb-bucket/docs/document-0.pdf', 's3://fake-kb-bucket/docs/document-1.pdf'}
+    assert trace.warnings == [('Retrieval branch timed out', {'retriever': 'kb:slow', 'queries': ['q1']})]
+    with pytest.raises(TimeoutError):
+        FanOutRetriever([slow, slow], timeout_ms=50).retrieve_all(['q1'], 5)
+
+
+def test_kb_client_socket_timeouts_follow_the_fan_out_timeout(monkeypatch):
+    monkeypatch.setenv('fan_out_timeout_ms', '1500')
+    config = kb_client_config()
+    assert (config.connect_timeout, config.read_timeout) == (1.5, 1.5)
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from fakes import FakeBedrockRuntime
+from routing import ModelRouter
+
+HAIKU = 'anthropic.claude-3-haiku-20240307-v1:0'
+BODY = json.dumps({'messages': [{'role': 'user', 'content': '질문'}]})
+
+
+def make_router(clients, routes, **kwargs):
+    policy = [{'maxTokens': 256, 'routes': routes}]
+    return ModelRouter(policy=policy, fallback_routes=[], retry_base_ms=1, retry_max_ms=1,
+                       client_for=lambda region: clients[region], **kwargs)
+
+
+def deltas(stream):
+    text = ''
+    for event in stream:
+        chunk = json.loads(event['chunk']['bytes'])
+        if chunk['type'] == 'content_block_delta':
+            text += chunk['delta']['text']
+    return text
+
+
+def test_throttle_then_retry_same_route():
+    fake = FakeBedrockRuntime(text='안녕하세요', first_token_ms=0, token_ms=0, throttle_first=1)
+    router = make_router({'us-east-1': fake}, [HAIKU])
+    plan = router.plan('질문')
+
+    stream = router.open_stream(plan, BODY)
+
+    assert deltas(stream) == '안녕하세요'
+    assert len(fake.calls) == 2
+    assert fake.throttled == 1
+    assert router.snapshot()[f'{HAIKU}@us-east-1']['throttles'] == 1
+
+
+def test_throttle_fails_over_to_next_route():
+    east = FakeBedrockRuntime(text='east', first_token_ms=0, token_ms=0, throttle_first=10)
+    west = FakeBedrockRuntime(text='west', first_token_ms=0, token_ms=0)
+    router = make_router({'us-east-1': east, 'us-west-2': west}, [HAIKU, f'{HAIKU}@us-west-2'])
+
+    stream = router.open_stream(router.plan('질문'), BODY)
+
+    assert stream.route == (HAIKU, 'us-west-2')
+    assert deltas(stream) == 'west'
+    assert len(east.calls) == 1
+    assert len(west.calls) == 1
+    # throttle 된 route 는 cooldown 동안 다음 계획에서 뒤로 간다
+    assert router.plan('질문').routes[0] == (HAIKU, 'us-west-2')
+
+
+def test_error_before_first_delta_closes_body_and_retries():
+    fake = FakeBedrockRuntime(text='abcdefgh', first_token_ms=0, token_ms=0, stream_error_after=0)
+    router = make_router({'us-east-1': fake}, [HAIKU], max_attempts=2)
+
+    with pytest.raises(ClientError):
+        router.open_stream(router.plan('질문'), BODY)
+
+    assert len(fake.calls) == 2
+    assert all(stream.closed for stream in fake.streams)
+
+
+def test_error_after_first_delta_is_not_retried():
+    fake = FakeBedrockRuntime(text='abcdefgh', chunk_chars=2, first_token_ms=0, token_ms=0, stream_error_after=2)
+    router = make_router({'us-east-1': fake}, [HAIKU])
+
+    stream = router.open_stream(router.plan('질문'), BODY)
+    received = []
+    with pytest.raises(ClientError):
+        for event in stream:
+            chunk = json.loads(event['chunk']['bytes'])
+            if chunk['type'] == 'content_block_delta':
+                received.append(chunk['delta']['text'])
+
+    assert received == ['ab', 'cd']
+    assert len(fake.calls) == 1
+
+
+def test_non_retryable_error_is_raised_once():
+    fake = FakeBedrockRuntime(first_token_ms=0, token_ms=0, throttle_first=1, error_code='ValidationException')
+    router = make_router({'us-east-1': fake}, [HAIKU])
+
+    with pytest.raises(ClientError):
+        router.open_stream(router.plan('질문'), BODY)
+
+    assert len(fake.calls) == 1
+
+
+def test_default_client_disables_botocore_retries(monkeypatch):
+    import routing
+    seen = {}
+
+    def fake_get_client(service, region_name=None, config=None):
+        seen['config'] = config
+        return FakeBedrockRuntime(text='ok', first_token_ms=0, token_ms=0)
+    monkeypatch.setattr(routing, 'get_client', fake_get_client)
+
+    router = ModelRouter(policy=[{'maxTokens': 256, 'routes': [HAIKU]}], fallback_routes=[])
+    assert deltas(router.open_stream(router.plan('질문'), BODY)) == 'ok'
+    assert seen['config'] is routing.NO_RETRY_CONFIG
@@ -0,0 +1,92 @@
+from frames import FrameCodec, decode_frame
+from singleflight import SingleFlight
+from state_store import MemoryStore
+
+
+class HookedStore(MemoryStore):
+    # 지정한 키에 쓰기 직전/직후 hook 을 실행해 leader 종료와 follower 등록이 겹치는 순서를 만든다
+    def __init__(self):
+        super().__init__()
+        self.hooks = {}
+
+    def put(self, key, value, ttl=None):
+        self.run(('put', key))
+        super().put(key, value, ttl)
+
+    def add_member(self, key, member, ttl=None):
+        super().add_member(key, member, ttl)
+        self.run(('add_member', key))
+
+    def run(self, name):
+        hook = self.hooks.pop(name, None)
+        if hook:
+            hook()
+
+
+def start(store):
+    group = SingleFlight(enabled=True, store=store, refresh_ms=0)
+    posts = []
+    post = lambda connection_id, data: posts.append((connection_id, decode_frame(data)))
+    leader = group.join('k', 'leader', post, FrameCodec(2, request_id='r1'))
+    leader.deliver(('delta', '안녕', 0))
+    return group, leader, posts, post
+
+
+def received(posts, connection_id):
+    return [frame['type'] for conn, frame in posts if conn == connection_id]
+
+
+def test_follower_receives_backlog_and_later_frames():
+    group, leader, posts, post = start(MemoryStore())
+
+    assert group.join('k', 'follower', post, FrameCodec(2, request_id='r2')) is None
+    leader.deliver(('done', None, 1))
+    leader.close()
+
+    assert received(posts, 'follower') == ['delta', 'done']
+    assert leader.targets == ['leader', 'follower']
+
+
+def test_follower_served_by_closing_leader_does_not_start_new_flight():
+    store = HookedStore()
+    group, leader, posts, post = start(store)
+    leader.deliver(('done', None, 1))
+    # follower 가 구독자로 등록된 직후, flight 키를 다시 읽기 전에 leader 가 끝난다
+    store.hooks[('add_member', group.subs_key('k'))] = leader.close
+
+    assert group.join('k', 'follower', post, FrameCodec(2, request_id='r2')) is None
+    assert received(posts, 'follower') == ['delta', 'done']
+    assert store.get(group.flight_key('k')) is None
+
+
+def test_follower_missed_by_closing_leader_becomes_leader():
+    store = HookedStore()
+    group, leader, posts, post = start(store)
+    leader.deliver(('done', None, 1))
+    # follower 가 구독자로 등록되기 전에 leader 가 끝난다
+    store.hooks[('put', group.member_key('follower'))] = leader.close
+
+    flight = group.join('k', 'follower', post, FrameCodec(2, request_id='r2'))
+
+    assert flight is not None and flight.leader_id == 'follower'
+    assert received(posts, 'follower') == []
+    assert 'follower' not in store.members(group.subs_key('k'))
+
+
+def test_cancelled_follower_gets_done_and_no_more_frames():
+    group, leader, posts, post = start(MemoryStore())
+    group.join('k', 'cancelled', post, FrameCodec(2, request_id='r2'))
+    group.join('k', 'closed', post, FrameCodec(2, request_id='r3'))
+    leader.deliver(('delta', '하세요', 1))
+
+    group.leave('cancelled', cancelled=True)
+    group.leave('closed')
+    leader.deliver(('delta', '!', 2))
+    leader.deliver(('done', None, 3))
+    leader.close()
+
+    done = [frame for conn, frame in posts if conn == 'cancelled'][-1]
+    assert received(posts, 'cancelled') == ['delta', 'delta', 'done']
+    assert (done['data'], done['seq'], done['id']) == ({'reason': 'cancelled'}, 2, 'r2')
+    assert received(posts, 'closed') == ['delta', 'delta']
+    assert received(posts, 'leader') == ['delta', 'delta', 'delta', 'done']
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import source_links
+from source_links import FOOTER_HEADER, SourceLinks, unique_uris
+
+
+class FakeS3:
+    def __init__(self):
+        self.calls = []
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        self.calls.append((Params['Bucket'], Params['Key'], ExpiresIn))
+        return f"https://signed/{Params['Key']}?n={len(self.calls)}"
+
+
+def result(uri):
+    return {'location': {'s3Location': {'uri': uri}}}
+
+
+def test_same_file_name_is_listed_once():
+    results = [result('s3://kb/2023/report.pdf'), result('s3://kb/2024/report.pdf'), {}, result('s3://kb/b 1.pdf')]
+
+    assert unique_uris(results) == ['s3://kb/2023/report.pdf', 's3://kb/b 1.pdf']
+    footer = SourceLinks(mode='public').footer(results)
+    assert footer == FOOTER_HEADER + ('report.pdf (https://kb.s3.amazonaws.com/2023/report.pdf)'
+                                      'b 1.pdf (https://kb.s3.amazonaws.com/b%201.pdf)')
+    assert SourceLinks(mode='public').footer([{}]) == ''
+
+
+def test_presigned_urls_are_reused_until_expires_in_minus_margin(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(source_links, 'time', SimpleNamespace(time=lambda: now[0]))
+    s3 = FakeS3()
+    links = SourceLinks(mode='presigned', expires_in=3600, margin=300, client=s3)
+
+    first = links.link('s3://kb/a.pdf')
+    now[0] += 3299
+    assert links.link('s3://kb/a.pdf') == first
+    assert links.link('s3://kb/b.pdf') != first
+    now[0] += 2
+    assert links.link('s3://kb/a.pdf') != first
+
+    assert s3.calls == [('kb', 'a.pdf', 3600), ('kb', 'b.pdf', 3600), ('kb', 'a.pdf', 3600)]
+    assert links.stats()['hits'] == 1 and links.stats()['signed'] == 3
+
+
+def test_margin_is_capped_at_half_the_expiry():
+    assert SourceLinks(mode='presigned', expires_in=600, margin=900).margin == 300
@@ -0,0 +1,81 @@
+import multiprocessing
+import time
+
+import pytest
+from state_store import MemoryStore, SqliteStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStore()
+    return SqliteStore(str(tmp_path / 'state.db'))
+
+
+def test_add_only_when_missing_or_expired(store):
+    assert store.add('k', {'n': 1}, ttl=60)
+    assert not store.add('k', {'n': 2}, ttl=60)
+    assert store.get('k') == {'n': 1}
+
+    assert store.add('short', 1, ttl=0.05)
+    time.sleep(0.1)
+    assert store.add('short', 2, ttl=60)
+    assert store.get('short') == 2
+
+
+def test_replace_compares_current_value(store):
+    assert store.replace('k', None, {'n': 1})
+    assert not store.replace('k', None, {'n': 9})
+    assert not store.replace('k', {'n': 0}, {'n': 9})
+    assert store.replace('k', {'n': 1}, {'n': 2})
+    assert store.get('k') == {'n': 2}
+    assert not store.replace('missing', {'n': 1}, {'n': 2})
+
+
+def test_members(store):
+    store.add_member('s', 'a', ttl=60)
+    store.add_member('s', 'b', ttl=60)
+    store.add_member('s', 'a', ttl=60)
+    store.remove_member('s', 'a')
+    store.remove_member('s', 'missing')
+    assert store.members('s') == {'b'}
+
+
+def _increment(path, times):
+    store = SqliteStore(path)
+    for _ in range(times):
+        while True:
+            current = store.get('counter')
+            if store.replace('counter', current, (current or 0) + 1):
+                break
+
+
+def _try_lead(path, key, results):
+    results.put(SqliteStore(path).add(key, 'leader', ttl=60))
+
+
+def test_sqlite_replace_is_atomic_across_processes(tmp_path):
+    path = str(tmp_path / 'state.db')
+    SqliteStore(path)
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_increment, args=(path, 50)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert SqliteStore(path).get('counter') == 200
+
+
+def test_sqlite_add_elects_one_leader_across_processes(tmp_path):
+    path = str(tmp_path / 'state.db')
+    SqliteStore(path)
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=_try_lead, args=(path, f'flight:{n // 4}', results)) for n in range(16)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(results.get() for _ in workers).count(True) == 4
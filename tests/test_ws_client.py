@@ -0,0 +1,183 @@
+import asyncio
+import json
+
+import pytest
+import ws_client
+from ws_client import StreamClient, StreamError
+
+
+class FakeSocket:
+    # API Gateway 웹소켓 연결 하나. 서버 쪽 (FakeServer) 이 queue 에 넣은 메시지를 읽는다. None 은 연결 끊김
+    def __init__(self, server, connection_id):
+        self.server = server
+        self.connection_id = connection_id
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    async def send(self, data):
+        message = json.loads(data)
+        if message['action'] == '$connect':
+            await self.queue.put(json.dumps({'connectionId': self.connection_id}))
+            return
+        self.server.received.append((self.connection_id, message['action'], json.loads(message['body'])))
+
+    async def recv(self):
+        return await self.queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.queue.get()
+        if message is None:
+            raise ConnectionError('connection dropped')
+        return message
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeServer:
+    def __init__(self):
+        self.sockets = []
+        self.received = []
+
+    async def connect(self, url, **kwargs):
+        self.sockets.append(FakeSocket(self, f'c{len(self.sockets) + 1}'))
+        return self.sockets[-1]
+
+    def push(self, request_id, frame_type, seq, data=None):
+        self.sockets[-1].queue.put_nowait(json.dumps({'v': 2, 'type': frame_type, 'id': request_id, 'seq': seq,
+                                                      'data': data}))
+
+    def drop(self):
+        self.sockets[-1].queue.put_nowait(None)
+
+    async def wait_for(self, action, count=1):
+        for _ in range(1000):
+            messages = [body for conn, name, body in self.received if name == action]
+            if len(messages) >= count:
+                return messages
+            await asyncio.sleep(0)
+        raise AssertionError(f'{action} not received')
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(ws_client.websockets, 'connect', server.connect)
+    return server
+
+
+def run(scenario):
+    return asyncio.run(asyncio.wait_for(scenario, timeout=5))
+
+
+def test_interleaved_requests_are_routed_by_id(server):
+    async def scenario():
+        async with StreamClient('wss://fake', reconnect_delay=0) as client:
+            first = asyncio.ensure_future(client.ask('a', request_id='r1'))
+            second = asyncio.ensure_future(client.ask('b', request_id='r2'))
+            await server.wait_for('sendMessage', 2)
+            server.push('r1', 'delta', 0, '하나 ')
+            server.push('r2', 'delta', 0, 'one ')
+            server.push('r2', 'delta', 1, 'two')
+            server.push('r1', 'delta', 1, '둘')
+            server.push('r2', 'done', 2)
+            server.push('r1', 'done', 2)
+            return await first, await second
+
+    assert run(scenario()) == ('하나 둘', 'one two')
+
+
+def test_dropped_socket_resumes_with_last_seq_and_resume_key(server):
+    async def scenario():
+        async with StreamClient('wss://fake', reconnect_delay=0) as client:
+            answer = asyncio.ensure_future(client.ask('a', request_id='r1'))
+            await server.wait_for('sendMessage')
+            server.push('r1', 'delta', 0, 'a')
+            server.push('r1', 'delta', 1, 'b')
+            server.drop()
+            resume = (await server.wait_for('resume'))[0]
+            server.push('r1', 'delta', 2, 'c')
+            server.push('r1', 'done', 3)
+            return client, resume, await answer
+
+    client, resume, answer = run(scenario())
+    assert answer == 'abc'
+    assert client.reconnects == 1
+    assert resume == {'requestId': 'r1', 'lastSeq': 1, 'connectionId': 'c2', 'resumeKey': client.resume_key}
+    assert server.received[0][2]['resumeKey'] == client.resume_key
+
+
+def test_duplicate_seq_after_resume_is_dropped(server):
+    async def scenario():
+        async with StreamClient('wss://fake', reconnect_delay=0) as client:
+            answer = asyncio.ensure_future(client.ask('a', request_id='r1'))
+            await server.wait_for('sendMessage')
+            server.push('r1', 'delta', 0, 'a')
+            server.push('r1', 'delta', 1, 'b')
+            server.drop()
+            await server.wait_for('resume')
+            # 서버는 끊기기 직전 프레임을 다시 보낼 수 있다
+            server.push('r1', 'delta', 1, 'b')
+            server.push('r1', 'delta', 2, 'c')
+            server.push('r1', 'done', 3)
+            return await answer
+
+    assert run(scenario()) == 'abc'
+
+
+def test_error_frame_fails_only_its_request(server):
+    async def scenario():
+        async with StreamClient('wss://fake') as client:
+            failing = asyncio.ensure_future(client.ask('a', request_id='r1'))
+            other = asyncio.ensure_future(client.ask('b', request_id='r2'))
+            await server.wait_for('sendMessage', 2)
+            server.push('r1', 'error', 0, 'Bedrock 호출 실패')
+            server.push('r2', 'delta', 0, 'ok')
+            server.push('r2', 'done', 1)
+            with pytest.raises(StreamError, match='Bedrock'):
+                await failing
+            return await other
+
+    assert run(scenario()) == 'ok'
+
+
+def test_close_and_lost_connection_fail_pending_requests(server):
+    async def closed():
+        client = StreamClient('wss://fake')
+        await client.connect()
+        answer = asyncio.ensure_future(client.ask('a', request_id='r1'))
+        await server.wait_for('sendMessage')
+        await client.close()
+        with pytest.raises(StreamError, match='client closed'):
+            await answer
+
+    async def lost():
+        async with StreamClient('wss://fake', reconnect=False) as client:
+            answer = asyncio.ensure_future(client.ask('a', request_id='r2'))
+            await server.wait_for('sendMessage', 2)
+            server.drop()
+            with pytest.raises(StreamError, match='connection lost'):
+                await answer
+
+    run(closed())
+    run(lost())
+
+
+def test_protocol_1_refuses_a_second_pending_request(server):
+    async def scenario():
+        async with StreamClient('wss://fake', protocol=1) as client:
+            first = asyncio.ensure_future(client.ask('a'))
+            await server.wait_for('sendMessage')
+            with pytest.raises(StreamError, match='protocol 1'):
+                await client.ask('b')
+            with pytest.raises(StreamError, match='protocol 1'):
+                await client.batch(['c'])
+            # v1 프레임 (requestId 없음) 은 하나뿐인 요청으로 간다
+            server.sockets[-1].queue.put_nowait(json.dumps({'message': 'ok', 'seq': 0}))
+            server.sockets[-1].queue.put_nowait(json.dumps({'message': json.dumps({'type': 'done'}), 'seq': 1}))
+            return await first
+
+    assert run(scenario()) == 'ok'
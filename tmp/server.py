@@ -1,46 +1,35 @@
 import json
-import boto3
-import logging
 import os
-import html
-import urllib.parse
-from botocore.client import Config
-from botocore.exceptions import ClientError, BotoCoreError
-from langchain.llms.bedrock import Bedrock
-from langchain.retrievers.bedrock import AmazonKnowledgeBasesRetriever
-from langchain.prompts import PromptTemplate
+from client_pool import count_pool, lazy_client, pool_stats
+from retrieval_cache import create_retrieval_cache, normalize_query
+from singleflight import SingleFlight, flight_key
+from frames import negotiate
+from context_packer import pack_context
+from rerank import rerank_results
+from retrievers import create_fan_out, kb_client_config, min_score_for
+from source_links import SourceLinks
+from instrumentation import NOOP_TRACE, start_trace
+from conversation import ConversationStore, history_digest, history_tokens
+from prompt_template import PromptTemplate
+from admission import AdmissionControl
+from batch import send_batch
+import bedrock_stream
+from bedrock_stream import post_to_connection, resume, router
 
 ################################################################################################
 region = 'us-east-1'
-bedrock_client = boto3.client('bedrock-runtime', region_name = region)
-bedrock_config = Config(connect_timeout=120, read_timeout=120, retries={'max_attempts': 0})
-bedrock_agent_client = boto3.client("bedrock-agent-runtime", config=bedrock_config, region_name = region)
-################################################################################################
-
-
-def lambda_handler(event, context):
-    print('@@@@@@@@@@@@@event: ', event)
-    print('@@@@@@@@@@@@@context: ', context)
-
-    try:
-        body = json.loads(event['body'])
-        query = body.get('prompt')
-        connection_id = body.get('connectionId')
-
-        retrieval_results = retrieve_rag(query)
-        # print("@@retrieval_results: ", retrieval_results)
-        
-        min_score = 0.5
-        filtered_results = [result for result in retrieval_results if result['score'] >= min_score]
-        print("@@filtered_results: ", filtered_results)
-        
-        
-        # context = get_contexts(filtered_results)
-        
-        html_output = generate_accessible_s3_urls(filtered_results)
-        
+# 클라이언트는 처음 사용할 때 생성 (cold start 에서 import 시간에 포함되지 않도록)
+# KB 검색 소켓 timeout 은 fan-out branch 제한 시간 (fan_out_timeout_ms) 에 맞춘다
+bedrock_agent_client = lazy_client("bedrock-agent-runtime", config=kb_client_config(), region_name = region)
+retrieval_cache = create_retrieval_cache()
+# local_index_path 가 있으면 로컬 벡터 인덱스 우선, 없거나 결과가 없으면 Knowledge Base
+# kb_ids 에 여러 KB 를 쓰면 동시에 검색해 점수순으로 병합
+kb_ids = os.environ.get('kb_ids', "WCQI6NWIU3").split(',')
+retriever = create_fan_out(kb_ids, bedrock_agent_client)
+single_flight = SingleFlight()
+source_links = SourceLinks()
 
-        PROMPT_TEMPLATE = """
+PROMPT_TEMPLATE = """
         Human: You are a financial advisor AI system, and provides answers to questions by using fact based and statistical information.
         Use the following pieces of information to provide a concise answer to the question enclosed in <question> tags.
         If you don't know the answer, just say that you don't know, don't try to make up an answer. Answer in Korean.
@@ -55,52 +44,177 @@ def lambda_handler(event, context):
         The response should be specific and use statistics or numbers when possible.
 
         Assistant:"""
+
+# 템플릿은 모듈 로드 시 한 번만 파싱
+prompt = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
+################################################################################################
+
+
+def lambda_handler(event, context):
+    trace = start_trace('rag', getattr(context, 'aws_request_id', None))
+    pool_before = pool_stats()
+    trace.debug('Event received', event=event)
+
+    flight = None
+    answer = None
+    ticket = None
+    budget = context_tokens = 0
+    try:
+        with trace.stage('parse'):
+            body = json.loads(event['body'])
+        query = body.get('prompt')
+        connection_id = body.get('connectionId')
+
+        # resume {requestId, lastSeq}: 끊긴 스트림의 나머지를 이 연결로 받는다 (stream_replay=1)
+        if body.get('action') == 'resume' or event.get('requestContext', {}).get('routeKey') == 'resume':
+            return resume(connection_id or event['requestContext']['connectionId'], body, trace)
+
+        # sendBatch {prompts: [{id, prompt}, ...], mode}: 여러 질문의 검색과 생성을 한 번의 호출에서 동시에 처리 (batch.py)
+        if body.get('action') == 'sendBatch' or event.get('requestContext', {}).get('routeKey') == 'sendBatch':
+            return send_batch(connection_id or event['requestContext']['connectionId'], body, trace, context,
+                              admission, prepare_batch_item, InvokeBedrock, context_budget())
+
+        codec = negotiate(connection_id, body)
+        # conversation_memory=1 이면 이전 대화를 같이 보낸다 (검색은 이번 질문으로만)
+        history = conversations.history(connection_id)
+
+        # single_flight=1 이면 같은 질문이 진행 중일 때 구독자로만 등록하고 반환
+        if single_flight.enabled:
+            flight = single_flight.join(flight_key(query + history_digest(history)), connection_id, trace.timed_post(post_to_connection), codec, trace)
+            if flight is None:
+                trace.info('Joined in-flight request', connectionId=connection_id)
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps({'message': 'Request received'})
+                }
+
+        invoker = InvokeBedrock(connection_id, flight=flight, codec=codec, trace=trace, resume_key=body.get('resumeKey'))
+        # admission_control=1 이면 요청 수 / 토큰 한도 안에서만 검색과 생성을 시작 (잠깐 기다리거나 busy 프레임)
+        # context 는 아직 모르므로 context_token_budget 만큼 잡는다
+        # 모델 / max_tokens 는 context 예산까지 포함한 예상 프롬프트 크기로 미리 정한다
+        budget = context_budget()
+        plan = router.plan(query, budget + history_tokens(history))
+        with trace.stage('admission'):
+            ticket = admission.admit(connection_id, admission.estimate(query, plan.max_tokens, budget + history_tokens(history)), trace)
+        if not ticket.admitted:
+            invoker.reject(ticket)
+            return {
+                'statusCode': 429,
+                'body': json.dumps({'error': 'Too many requests', 'retryAfterMs': ticket.retry_after_ms})
+            }
+
+        with trace.stage('retrieval'):
+            retrieval_results = retrieve_rag(query, body.get('queryVariants'), trace)
+            if isinstance(retrieval_results, dict):
+                # 검색 실패: 생성하지 않고 error 프레임
+                invoker.fail(retrieval_results['error'])
+                return {
+                    'statusCode': 502,
+                    'body': json.dumps({'error': 'Retrieval failed'})
+                }
+
+            min_score = 0.5
+            filtered_results = [result for result in retrieval_results if result['score'] >= min_score_for(result, min_score)]
+        trace.count('retrieved', len(filtered_results))
+        if trace.verbose:
+            trace.debug('Filtered results', results=filtered_results)
+        
         
-        prompt = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
-        prompt_str = prompt.format(context=context, question=query)
+        with trace.stage('prompt'):
+            # 중복 제거 후 토큰 예산 안에서 context 조립
+            context_text, context_report = pack_context(filtered_results)
+            context_tokens = context_report['tokens']
+            invoker.html_output = generate_accessible_s3_urls(filtered_results, trace)
+        trace.debug('Context packed', report=context_report, links=source_links.stats())
+        
+        with trace.stage('prompt'):
+            prompt_str = prompt.format(context=context_text, question=query)
 
-        invoker = InvokeBedrock(connection_id)
-        invoker.call_bedrock(prompt_str, html_output)
+        answer = invoker.call_bedrock(prompt_str, history, plan)
 
         return {
             'statusCode': 200,
             'body': json.dumps({'message': 'Request received'})
         }
     except KeyError as e:
-        print(f"KeyError: {e}")
+        trace.error('KeyError', error=str(e))
         return {
             'statusCode': 400,
             'body': json.dumps({'error': 'Missing key in event object'})
         }
     except json.JSONDecodeError as e:
-        print(f"JSONDecodeError: {e}")
+        trace.error('JSONDecodeError', error=str(e))
         return {
             'statusCode': 400,
             'body': json.dumps({'error': 'Invalid JSON'})
         }
+    finally:
+        if flight:
+            flight.close()
+        if ticket:
+            # context 예산 중 실제로 채우지 못한 만큼도 돌려준다
+            admission.settle(ticket, answer, plan.max_tokens, budget - context_tokens)
+        if answer:
+            # 응답을 받은 연결마다 (single-flight 구독자 포함) 원래 질문과 답변을 추가
+            for target in (flight.targets if flight else [connection_id]):
+                conversations.append(target, query, answer)
+        trace.debug('Client pool stats', stats=count_pool(trace, pool_before))
+        trace.emit()
+
+def prepare_batch_item(invoker, item, trace):
+    # sendBatch 항목 하나의 검색 / context 조립 (batch.py). (프롬프트, 쓰지 않은 context 토큰)
+    query = item['prompt']
+    with trace.stage('retrieval'):
+        retrieval_results = retrieve_rag(query, item.get('queryVariants'), trace)
+    if isinstance(retrieval_results, dict):
+        raise RuntimeError(retrieval_results.get('details') or retrieval_results.get('error'))
+    filtered_results = [result for result in retrieval_results if result['score'] >= min_score_for(result, 0.5)]
+    with trace.stage('prompt'):
+        context_text, context_report = pack_context(filtered_results)
+        invoker.html_output = generate_accessible_s3_urls(filtered_results, trace)
+        prompt_str = prompt.format(context=context_text, question=query)
+    return prompt_str, context_budget() - context_report['tokens']
 
-def retrieve_rag(query):
+def context_budget():
+    return int(os.environ.get('context_token_budget', 1500))
+
+def retrieve_rag(query, variants=None, trace=NOOP_TRACE):
     try:
         numberOfResults=5
-        kbId = "WCQI6NWIU3"
-        
-        relevant_documents = bedrock_agent_client.retrieve(
-            retrievalQuery= {
-                'text': query
-            },
-            knowledgeBaseId=kbId,
-            retrievalConfiguration= {
-                'vectorSearchConfiguration': {
-                    'numberOfResults': numberOfResults,
-                    # 'overrideSearchType': "HYBRID", # optional
-                }
-            }
-        )
-        
-        print('@@@@@@@@@@@@@@relevant_documents: ', relevant_documents)
-        return relevant_documents['retrievalResults']
+        kbId = ','.join(kb_ids)
+
+        # queryVariants 가 있으면 원래 질문과 함께 동시에 검색 (fan_out_max_queries 개까지)
+        queries = [query]
+        for variant in variants or []:
+            if len(queries) >= int(os.environ.get('fan_out_max_queries', 4)):
+                break
+            if normalize_query(variant) not in [normalize_query(q) for q in queries]:
+                queries.append(variant)
+
+        # rerank=1 이면 더 많이 가져와서 MMR 로 다양한 numberOfResults 개를 고른다
+        top_k = numberOfResults
+        if os.environ.get('rerank') == '1':
+            numberOfResults = int(os.environ.get('rerank_fetch', 20))
+
+        # 같은 질문이 반복되면 retrieve 호출 없이 캐시 결과 사용
+        cache_key = retrieval_cache.make_key(' | '.join(queries), kbId, numberOfResults)
+        cached = retrieval_cache.get(cache_key)
+        if cached is not None:
+            trace.count('retrieval_cache_hits')
+            trace.debug('Retrieval cache hit', stats=retrieval_cache.stats())
+            return cached
+        trace.count('retrieval_cache_misses')
+
+        results = retriever.retrieve_all(queries, numberOfResults, trace)
+        if trace.verbose:
+            trace.debug('Relevant documents', results=results)
+        if len(results) > top_k:
+            results = rerank_results(results, top_k)
+        retrieval_cache.put(cache_key, results)
+        trace.debug('Retrieval cache miss', stats=retrieval_cache.stats())
+        return results
     except Exception as e:
-        print(f"error: {e}")
+        trace.error('Retrieval failed', error=str(e))
         return {'error': '예기치 않은 오류가 발생했습니다.', 'details': str(e)}
 
 def get_contexts(retrievalResults):
@@ -123,158 +237,34 @@ def extract_uris_and_text(retrieval_results):
     return uris, texts
     
 def generate_public_s3_url(source_location):
-    try:
-        # source_location에서 버킷 이름과 키(파일 경로) 추출
-        bucket_name, key = source_location.replace('s3://', '').split('/', 1)
-
-        # 키를 URL 인코딩
-        encoded_key = urllib.parse.quote(key)
-
-        # 퍼블릭 URL 생성
-        url = f"https://{bucket_name}.s3.amazonaws.com/{encoded_key}"
-
-        return url
-    except Exception as e:
-        logger.error(e)
-        return None
+    # 퍼블릭 URL 생성
+    return source_links.link(source_location, mode='public')
 
         
 def generate_s3_url(source_location):
-    try:
-        # S3 클라이언트 생성
-        s3 = boto3.client('s3')
-
-        # source_location에서 버킷 이름과 키(파일 경로) 추출
-        bucket_name, key = source_location.replace('s3://', '').split('/', 1)
-
-        # 임시 URL 생성
-        url = s3.generate_presigned_url(
-            ClientMethod='get_object',
-            Params={
-                'Bucket': bucket_name,
-                'Key': key
-            },
-            ExpiresIn=3600  # 유효 기간(초)
-        )
-
-        return url
-    except ClientError as e:
-        logger.error(e)
-        return None
+    # 임시 URL 생성 (공유 S3 클라이언트, (bucket, key) 별 캐시)
+    return source_links.link(source_location, mode='presigned')
     
-def generate_accessible_s3_urls(retrieval_results):
-    uris, texts = extract_uris_and_text(retrieval_results)
-    
-    print("@@@uris: ", uris)
-    print("@@@texts: ", texts)
-    
-    html_output = ""
-    first_time = True 
-    processed_files = set()
-    
-
-    for i, uri in enumerate(uris):
-        url = generate_public_s3_url(uri)
-        file_name = uri.split('/')[-1]
-        print('@@@url: ', url)
-        print('@@@file_name: ', file_name)
-        
-
-        # 이미 처리된 파일명 SKIP
-        if file_name not in processed_files:
-            processed_files.add(file_name)
-            
-            if first_time:
-                html_output += "\n\n📚 출처\n"
-                first_time = False  # 이후 실행에서는 이 부분이 실행되지 않도록 플래그 변경
-
-            html_output += f'{file_name} ({url})'
-            # html_output += f'{file_name}'
-    
-    return html_output
+def generate_accessible_s3_urls(retrieval_results, trace=NOOP_TRACE):
+    # 파일명 중복은 링크를 만들기 전에 제거
+    return source_links.footer(retrieval_results, trace)
     
     
     
 ###############################################################################################
 
-class InvokeBedrock:
-    def __init__(self, connection_id):
-        self.client = boto3.client('bedrock-runtime', region_name='us-east-1')
-        self.conn = boto3.client('apigatewaymanagementapi', endpoint_url=os.environ['api_endpoint'], region_name=os.environ['region'])
-        self.params = {
-            "ConnectionId": connection_id,
-            "Data": ""
-        }
-
-
-
-    def call_bedrock(self, request, html_output):
-        model_id = "anthropic.claude-3-haiku-20240307-v1:0"
-        native_request = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 512,
-            "temperature": 0.5,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": request}]
-                }
-            ]
-        }
-
-        request_payload = json.dumps(native_request)
-        
-        
-        ################
-        # texts, uris, scores = [], [], []
-        
-        # for result in filtered_results:
-        #     texts.append(result['content']['text'])
-        #     uris.append(result['location']['s3Location']['uri'])
-        #     scores.append(result['score'])
-            
-            
-        # for uri in uris:
-        #     print('@@@@@@@@uri: ', uri)    
-            
-        # url_score_list = [f"✅ {uri} ({score})" for uri, score in zip(uris, scores)]
-        ################
+conversations = ConversationStore()
+admission = AdmissionControl()
 
-        try:
-            response = self.client.invoke_model_with_response_stream(
-                modelId=model_id,
-                contentType="application/json",
-                body=request_payload
-            )
+class InvokeBedrock(bedrock_stream.InvokeBedrock):
+    # 공통 생성 경로 (bedrock_stream.py) 에 RAG 출처 프레임과 검색 실패 처리를 더한다
+    html_output = ''  # 답변 끝 (done 직전) 에 보내는 출처 목록. 검색 뒤에 채운다
 
-            event_stream = response['body']
-            
-            for event in event_stream:
-                if 'chunk' in event:
-                    chunk_data = event['chunk']['bytes']
-                    chunk = json.loads(chunk_data)
-                    if chunk.get("type") == "content_block_delta":
-                        message = chunk["delta"].get("text", "")
-                        print(message, end="")
-                        self.send_message_to_client(str(message))
-                    elif chunk.get("type") == "content_block_stop":
-                        # for item in url_score_list:
-                        #     self.send_message_to_client('\n' + item)
-                        
-                        # print("@@@html_output: ", html_output)
-                        self.send_message_to_client(html_output)
-                        self.send_message_to_client(json.dumps({"type": "done"}))
-                else:
-                    print("No 'chunk' in event")
+    def send_footer(self, emit):
+        emit('sources', self.html_output)
 
-        except (BotoCoreError, ClientError) as error:
-            print(error)
-            self.params["Data"] = json.dumps({'error': str(error)})
-            self.conn.post_to_connection(**self.params)
-            
-    def send_message_to_client(self, message):
-        self.params["Data"] = json.dumps({"message": str(message)})
-        try:
-            self.conn.post_to_connection(**self.params)
-        except ClientError as e:
-            print(f"Failed to send message to client: {e}")
+    def fail(self, message):
+        # 생성 전에 실패 (검색 오류 등). reject 와 같은 경로로 error 프레임을 보낸다
+        self.send_frame('error', message)
+        if self.replay:
+            self.finish_replay()
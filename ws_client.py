@@ -0,0 +1,310 @@
+import asyncio
+import itertools
+import json
+import os
+import sys
+import uuid
+
+import websockets
+
+# 프레임 해석은 서버와 같은 lambda/frames.py 를 쓴다
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda'))
+from frames import decode_frame
+
+# 웹소켓 스트리밍 클라이언트 라이브러리 (asyncio).
+#   - 연결 하나를 유지하며 (ping keep-alive) 끊기면 자동으로 다시 연결
+#   - 한 연결에서 여러 질문을 동시에 보내고 프레임의 requestId 로 나눠 받는다 (v2 프레임 필요)
+#   - 다시 연결하면 진행 중이던 요청은 resume {requestId, lastSeq} 로 이어받는다 (서버 stream_replay=1)
+#
+#   async with StreamClient(url) as client:
+#       async for delta in client.stream('질문'):
+#           print(delta, end='')
+#       answer = await client.ask('다른 질문', sink=FileSink('answer.txt'))
+
+WEBSOCKET_URL = 'wss://l776hl36a4.execute-api.us-east-1.amazonaws.com/dev'
+
+
+def protocol_url(url, protocol=2, compact=False):
+    # $connect 시 query string 으로 프레임 형식을 정한다
+    if protocol < 2:
+        return url
+    return f"{url}?protocol={protocol}&encoding={'compact' if compact else 'json'}"
+
+
+def parse_frame(message):
+    # {"type", "id", "seq", "data"}. 프레임 형식은 lambda/frames.py 참고 (알 수 없는 프레임은 error)
+    # JSON 이 아닌 메시지는 델타 텍스트로 본다
+    try:
+        return decode_frame(message)
+    except json.JSONDecodeError:
+        return {'type': 'delta', 'id': None, 'seq': None, 'data': message}
+
+
+class StreamError(Exception):
+    pass
+
+
+class ServerBusy(StreamError):
+    # 서버의 요청 제한에 걸림 (busy 프레임). retry_after_ms 뒤에 다시 보내면 된다
+    def __init__(self, data):
+        data = data or {}
+        self.retry_after_ms = data.get('retryAfterMs', 0)
+        self.scope = data.get('scope')
+        super().__init__(f'server busy ({self.scope}), retry after {self.retry_after_ms} ms')
+
+
+# 응답을 받을 곳 (문자열 += 대신 사용)
+class ListSink:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def text(self):
+        return ''.join(self.parts)
+
+
+class FileSink:
+    def __init__(self, path_or_file, encoding='utf-8'):
+        self.owned = isinstance(path_or_file, str)
+        self.file = open(path_or_file, 'a', encoding=encoding) if self.owned else path_or_file
+
+    def write(self, text):
+        self.file.write(text)
+
+    def close(self):
+        self.file.flush()
+        if self.owned:
+            self.file.close()
+
+
+class CallbackSink:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, text):
+        self.callback(text)
+
+
+class PendingRequest:
+    def __init__(self, request_id, prompt, resumable=True):
+        self.request_id = request_id
+        self.prompt = prompt
+        self.frames = asyncio.Queue()
+        self.last_seq = -1
+        self.resumable = resumable  # sendBatch 항목은 resume 할 수 없다
+
+
+class StreamClient:
+    def __init__(self, url=WEBSOCKET_URL, protocol=2, compact=False, ping_interval=20, ping_timeout=20,
+                 reconnect=True, reconnect_delay=0.5, max_reconnect_delay=30, resume=True):
+        self.url = url
+        self.protocol = protocol
+        self.compact = compact
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.reconnect = reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.resume = resume
+        self.resume_key = uuid.uuid4().hex  # 다시 연결한 뒤 resume 할 때 같은 클라이언트임을 증명한다
+
+        self.websocket = None
+        self.connection_id = None
+        self.pending = {}
+        self.reader = None
+        self.connected = asyncio.Event()
+        self.closing = False
+        self.reconnects = 0
+        self.send_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        await self._open()
+        self.reader = asyncio.ensure_future(self._read_loop())
+
+    async def _open(self):
+        self.websocket = await websockets.connect(protocol_url(self.url, self.protocol, self.compact),
+                                                  ping_interval=self.ping_interval, ping_timeout=self.ping_timeout)
+        # 연결 후 connectionID를 서버로부터 받기 위해 초기 메시지를 전송
+        await self.websocket.send(json.dumps({'action': '$connect'}))
+        self.connection_id = json.loads(await self.websocket.recv()).get('connectionId')
+        self.connected.set()
+
+    async def close(self):
+        self.closing = True
+        if self.websocket is not None and self.connection_id:
+            try:
+                await self.websocket.send(json.dumps({'action': 'disconnect', 'connectionId': self.connection_id}))
+            except Exception:
+                pass
+        if self.reader:
+            self.reader.cancel()
+            try:
+                await self.reader
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self.websocket is not None and hasattr(self.websocket, 'close'):
+            await self.websocket.close()
+        self._fail_pending(StreamError('client closed'))
+
+    async def _send(self, action, body):
+        await self.connected.wait()
+        async with self.send_lock:
+            await self.websocket.send(json.dumps({'action': action, 'body': json.dumps(body, ensure_ascii=False)}))
+
+    async def _read_loop(self):
+        while not self.closing:
+            try:
+                async for message in self.websocket:
+                    self._dispatch(parse_frame(message))
+                raise ConnectionError('connection closed by server')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.closing:
+                    return
+                if not self.reconnect:
+                    self._fail_pending(StreamError(f'connection lost: {e}'))
+                    return
+                await self._reconnect()
+
+    def _dispatch(self, frame):
+        request = self.pending.get(frame.get('id'))
+        if request is None and frame.get('id') is None and len(self.pending) == 1:
+            # v1 프레임에는 requestId 가 없다 (한 번에 한 요청만 가능)
+            request = next(iter(self.pending.values()))
+        if request is None:
+            return
+        seq = frame.get('seq')
+        if seq is not None:
+            # resume 경계에서 같은 seq 가 다시 올 수 있다
+            if seq <= request.last_seq:
+                return
+            request.last_seq = seq
+        request.frames.put_nowait(frame)
+
+    async def _reconnect(self):
+        self.connected.clear()
+        delay = self.reconnect_delay
+        for attempt in itertools.count():
+            try:
+                await self._open()
+                break
+            except Exception as e:
+                print(f"Reconnect attempt {attempt + 1} failed: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+        self.reconnects += 1
+
+        for request in list(self.pending.values()):
+            if self.resume and self.protocol >= 2 and request.resumable:
+                await self._send('resume', {'requestId': request.request_id, 'lastSeq': request.last_seq,
+                                            'connectionId': self.connection_id, 'resumeKey': self.resume_key})
+            else:
+                request.frames.put_nowait({'type': 'error', 'data': 'connection lost'})
+
+    def _fail_pending(self, error):
+        for request in list(self.pending.values()):
+            request.frames.put_nowait({'type': 'error', 'data': str(error)})
+
+    def _check_concurrent(self, requests=1):
+        # v1 프레임에는 requestId 가 없어 요청이 둘 이상이면 어느 요청의 프레임인지 알 수 없다 (프레임을 버리고 멈춘다)
+        if self.protocol < 2 and len(self.pending) + requests > 1:
+            raise StreamError('protocol 1 allows one request at a time; connect with protocol=2 for concurrent requests')
+
+    async def stream(self, prompt, sink=None, request_id=None, **options):
+        # delta / sources 텍스트를 순서대로 yield. options 는 sendMessage body 에 그대로 추가 (queryVariants 등)
+        self._check_concurrent()
+        request = PendingRequest(request_id or uuid.uuid4().hex[:12], prompt)
+        self.pending[request.request_id] = request
+        try:
+            body = {'prompt': prompt, 'connectionId': self.connection_id, 'requestId': request.request_id}
+            if self.protocol >= 2:
+                body.update({'protocol': self.protocol, 'encoding': 'compact' if self.compact else 'json'})
+            if self.resume:
+                body['resumeKey'] = self.resume_key
+            body.update(options)
+            await self._send('sendMessage', body)
+
+            while True:
+                frame = await request.frames.get()
+                if frame['type'] == 'done':
+                    return
+                if frame['type'] == 'error':
+                    raise StreamError(frame['data'])
+                if frame['type'] == 'busy':
+                    raise ServerBusy(frame['data'])
+                if sink is not None:
+                    sink.write(frame['data'])
+                yield frame['data']
+        finally:
+            self.pending.pop(request.request_id, None)
+
+    async def batch(self, prompts, mode='aggregate', on_delta=None, request_id=None, **options):
+        # sendBatch. prompts 는 문자열 또는 {"id", "prompt"}. 서버의 요약 {"items", "ok", "failed", "totalMs", "results"} 에
+        # 항목별 답변 "answers" {id: text} 를 붙여 반환. stream 모드에서는 on_delta(id, text) 로 델타를 받는다
+        batch_id = request_id or uuid.uuid4().hex[:12]
+        items = [dict(p) if isinstance(p, dict) else {'prompt': p} for p in prompts]
+        # 항목마다 요청 하나 + 요약 요청 (v1 에서는 항목이 하나여도 둘이 된다)
+        self._check_concurrent(len(items) + 1)
+        for index, item in enumerate(items):
+            item.setdefault('id', f'{batch_id}-{index}')
+        requests = [PendingRequest(item['id'], item['prompt'], resumable=False) for item in items]
+        summary_request = PendingRequest(batch_id, None, resumable=False)
+        for request in requests + [summary_request]:
+            self.pending[request.request_id] = request
+        answers = {item['id']: ListSink() for item in items}
+
+        async def collect(request):
+            # 항목의 마지막 프레임 (done / error / busy) 까지. 실패는 서버 요약의 results 에 있다
+            while True:
+                frame = await request.frames.get()
+                if frame['type'] in ('delta', 'sources'):
+                    answers[request.request_id].write(frame['data'])
+                    if on_delta is not None:
+                        on_delta(request.request_id, frame['data'])
+                elif frame['type'] == 'done':
+                    if isinstance(frame['data'], dict) and 'text' in frame['data']:
+                        answers[request.request_id].write(frame['data']['text'])
+                    return
+                else:
+                    return
+
+        collectors = [asyncio.ensure_future(collect(request)) for request in requests]
+        try:
+            body = {'prompts': items, 'mode': mode, 'connectionId': self.connection_id, 'requestId': batch_id}
+            if self.protocol >= 2:
+                body.update({'protocol': self.protocol, 'encoding': 'compact' if self.compact else 'json'})
+            body.update(options)
+            await self._send('sendBatch', body)
+
+            frame = await summary_request.frames.get()
+            if frame['type'] != 'done':
+                raise StreamError(frame['data'])
+            # 요약은 모든 항목이 끝난 뒤에 오지만 같은 연결의 프레임 순서가 바뀔 수 있으므로 잠깐 기다린다
+            await asyncio.wait(collectors, timeout=5)
+            summary = frame['data']['batch']
+            summary['answers'] = {item_id: sink.text() for item_id, sink in answers.items()}
+            return summary
+        finally:
+            for collector in collectors:
+                collector.cancel()
+            for request in requests + [summary_request]:
+                self.pending.pop(request.request_id, None)
+
+    async def ask(self, prompt, sink=None, **options):
+        # 전체 응답 문자열을 반환 (sink 가 있으면 같이 기록)
+        parts = ListSink()
+        async for delta in self.stream(prompt, **options):
+            parts.write(delta)
+            if sink is not None:
+                sink.write(delta)
+        return parts.text()